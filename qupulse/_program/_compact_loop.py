@@ -0,0 +1,512 @@
+"""Flat array representation of Loop trees for programs with a very large number of nodes.
+
+The nodes of a CompactLoop are stored in depth first pre-order. The descendants of node i are the nodes i+1 to
+subtree_ends[i]-1 and node 0 is the root. Waveforms and measurement names are stored once and referenced by index. The
+measurements of node i are the entries measurement_offsets[i] to measurement_offsets[i+1]-1 of the measurement arrays.
+"""
+from typing import Dict, Tuple, List, Sequence, Optional
+
+import numpy as np
+
+from qupulse.utils.types import MeasurementWindow
+from qupulse._program.waveforms import Waveform
+from qupulse._program._loop import Loop, _WaveformBuilder, _expand_ranges
+
+__all__ = ['CompactLoop']
+
+
+def _group_starts(sorted_keys: np.ndarray) -> np.ndarray:
+    """Positions where a new group of equal keys starts in a sorted array"""
+    if len(sorted_keys) == 0:
+        return np.zeros(0, dtype=np.int64)
+    return np.flatnonzero(np.concatenate(([True], sorted_keys[1:] != sorted_keys[:-1])))
+
+
+class CompactLoop:
+    """Immutable program tree that is stored in numpy arrays instead of Loop objects.
+
+    Use from_loop and to_loop to convert from and to the Loop representation."""
+
+    def __init__(self,
+                 parents: Sequence[int],
+                 subtree_ends: Sequence[int],
+                 repetition_counts: Sequence[int],
+                 waveform_ids: Sequence[int],
+                 waveforms: Sequence[Waveform],
+                 measurement_offsets: Sequence[int],
+                 measurement_name_ids: Sequence[int],
+                 measurement_begins: Sequence[float],
+                 measurement_lengths: Sequence[float],
+                 measurement_names: Sequence[str]):
+        """
+        Args:
+            parents: Index of the parent of each node. -1 for the root
+            subtree_ends: Index after the last descendant of each node
+            repetition_counts: Repetition count of each node
+            waveform_ids: Index into waveforms for each node. -1 if the node has no waveform
+            waveforms: Distinct waveforms of the program
+            measurement_offsets: Start of the measurements of each node in the measurement arrays. Has one more element
+                than there are nodes
+            measurement_name_ids: Index into measurement_names for each measurement
+            measurement_begins: Begin of each measurement relative to the node
+            measurement_lengths: Length of each measurement
+            measurement_names: Distinct measurement names of the program
+        """
+        self._parents = np.asarray(parents, dtype=np.int64)
+        self._subtree_ends = np.asarray(subtree_ends, dtype=np.int64)
+        self._repetition_counts = np.asarray(repetition_counts, dtype=np.int64)
+        self._waveform_ids = np.asarray(waveform_ids, dtype=np.int64)
+        self._waveforms = tuple(waveforms)
+
+        self._measurement_offsets = np.asarray(measurement_offsets, dtype=np.int64)
+        self._measurement_name_ids = np.asarray(measurement_name_ids, dtype=np.int64)
+        self._measurement_begins = np.asarray(measurement_begins, dtype=float)
+        self._measurement_lengths = np.asarray(measurement_lengths, dtype=float)
+        self._measurement_names = tuple(measurement_names)
+
+        if len(self._parents) == 0:
+            raise ValueError('A CompactLoop needs at least a root node')
+        if not (len(self._parents) == len(self._subtree_ends) == len(self._repetition_counts)
+                == len(self._waveform_ids) == len(self._measurement_offsets) - 1):
+            raise ValueError('The node arrays of a CompactLoop need to have the same length')
+
+        # lazily computed
+        self._nodes_per_level = None  # type: Optional[List[np.ndarray]]
+        self._body_durations = None  # type: Optional[np.ndarray]
+        self._heights = None  # type: Optional[np.ndarray]
+        self._balanced = None  # type: Optional[np.ndarray]
+
+    @classmethod
+    def from_loop(cls, loop: Loop) -> 'CompactLoop':
+        parents = []
+        subtree_ends = []
+        repetition_counts = []
+        waveform_ids = []
+        measurement_counts = []
+        measurement_name_ids = []
+        measurement_begins = []
+        measurement_lengths = []
+
+        # waveforms are identified by identity to avoid the comparison of (possibly expensive) compare keys
+        waveform_ids_by_id = dict()
+        waveforms = []
+        measurement_name_ids_by_name = dict()
+
+        # None marks the end of the subtree of the node with the given index
+        stack = [(loop, -1)]
+        while stack:
+            node, parent = stack.pop()
+            if node is None:
+                subtree_ends[parent] = len(parents)
+                continue
+
+            index = len(parents)
+            parents.append(parent)
+            subtree_ends.append(None)
+            repetition_counts.append(node.repetition_count)
+
+            waveform = node.waveform
+            if waveform is None:
+                waveform_ids.append(-1)
+            else:
+                waveform_id = waveform_ids_by_id.get(id(waveform), None)
+                if waveform_id is None:
+                    waveform_id = waveform_ids_by_id[id(waveform)] = len(waveforms)
+                    waveforms.append(waveform)
+                waveform_ids.append(waveform_id)
+
+            measurements = node._measurements or ()
+            measurement_counts.append(len(measurements))
+            for name, begin, length in measurements:
+                name_id = measurement_name_ids_by_name.setdefault(name, len(measurement_name_ids_by_name))
+                measurement_name_ids.append(name_id)
+                measurement_begins.append(begin)
+                measurement_lengths.append(length)
+
+            stack.append((None, index))
+            stack.extend((child, index) for child in reversed(node.children))
+
+        return cls(parents=parents,
+                   subtree_ends=subtree_ends,
+                   repetition_counts=repetition_counts,
+                   waveform_ids=waveform_ids,
+                   waveforms=waveforms,
+                   measurement_offsets=np.concatenate(([0], np.cumsum(measurement_counts, dtype=np.int64))),
+                   measurement_name_ids=measurement_name_ids,
+                   measurement_begins=measurement_begins,
+                   measurement_lengths=measurement_lengths,
+                   measurement_names=sorted(measurement_name_ids_by_name, key=measurement_name_ids_by_name.get))
+
+    def to_loop(self) -> Loop:
+        names = self._measurement_names
+        name_ids = self._measurement_name_ids.tolist()
+        begins = self._measurement_begins.tolist()
+        lengths = self._measurement_lengths.tolist()
+        offsets = self._measurement_offsets.tolist()
+
+        # children are created before their parents and collected in reversed order
+        children = dict()  # type: Dict[int, List[Loop]]
+        loop = None
+        for index, parent, repetition_count, waveform_id in zip(range(len(self) - 1, -1, -1),
+                                                                self._parents[::-1].tolist(),
+                                                                self._repetition_counts[::-1].tolist(),
+                                                                self._waveform_ids[::-1].tolist()):
+            start, end = offsets[index], offsets[index + 1]
+            measurements = [(names[name_ids[i]], begins[i], lengths[i]) for i in range(start, end)] if end > start \
+                else None
+
+            loop_children = children.pop(index, [])
+            loop_children.reverse()
+
+            loop = Loop(children=loop_children,
+                        waveform=None if waveform_id < 0 else self._waveforms[waveform_id],
+                        measurements=measurements,
+                        repetition_count=repetition_count)
+            if parent >= 0:
+                children.setdefault(parent, []).append(loop)
+        return loop
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    @property
+    def parents(self) -> np.ndarray:
+        return self._parents
+
+    @property
+    def subtree_ends(self) -> np.ndarray:
+        return self._subtree_ends
+
+    @property
+    def repetition_counts(self) -> np.ndarray:
+        return self._repetition_counts
+
+    @property
+    def waveform_ids(self) -> np.ndarray:
+        return self._waveform_ids
+
+    @property
+    def waveforms(self) -> Tuple[Waveform, ...]:
+        return self._waveforms
+
+    @property
+    def measurement_names(self) -> Tuple[str, ...]:
+        return self._measurement_names
+
+    def get_children(self, index: int) -> List[int]:
+        children = []
+        child, end = index + 1, self._subtree_ends[index]
+        while child < end:
+            children.append(child)
+            child = self._subtree_ends[child]
+        return children
+
+    def is_leaf(self, index: int) -> bool:
+        return self._subtree_ends[index] == index + 1
+
+    def get_measurements(self, index: int) -> List[MeasurementWindow]:
+        measurements = slice(self._measurement_offsets[index], self._measurement_offsets[index + 1])
+        return [(self._measurement_names[name_id], begin, length)
+                for name_id, begin, length in zip(self._measurement_name_ids[measurements].tolist(),
+                                                  self._measurement_begins[measurements].tolist(),
+                                                  self._measurement_lengths[measurements].tolist())]
+
+    @property
+    def nodes_per_level(self) -> List[np.ndarray]:
+        """Indices of the nodes of each tree level in ascending order. Level 0 is the root."""
+        if self._nodes_per_level is None:
+            levels = np.zeros(len(self), dtype=np.int64)
+            ancestors = self._parents.copy()
+            has_ancestor = ancestors >= 0
+            while np.any(has_ancestor):
+                levels += has_ancestor
+                ancestors[has_ancestor] = self._parents[ancestors[has_ancestor]]
+                has_ancestor = ancestors >= 0
+
+            sorted_nodes = np.argsort(levels, kind='stable')
+            level_starts = np.searchsorted(levels[sorted_nodes], np.arange(levels.max() + 2))
+            self._nodes_per_level = [sorted_nodes[start:end]
+                                     for start, end in zip(level_starts[:-1], level_starts[1:])]
+        return self._nodes_per_level
+
+    @property
+    def body_durations(self) -> np.ndarray:
+        """Duration of a single repetition of each node as float"""
+        if self._body_durations is None:
+            waveform_durations = np.array([float(waveform.duration) for waveform in self._waveforms] + [0.])
+            is_leaf = self._subtree_ends == np.arange(1, len(self) + 1)
+
+            # waveform id -1 selects the appended zero duration
+            body_durations = np.where(is_leaf, waveform_durations[self._waveform_ids], 0.)
+            for nodes in reversed(self.nodes_per_level[1:]):
+                body_durations += np.bincount(self._parents[nodes],
+                                              weights=self._repetition_counts[nodes] * body_durations[nodes],
+                                              minlength=len(self))
+            self._body_durations = body_durations
+        return self._body_durations
+
+    @property
+    def duration(self) -> float:
+        return float(self._repetition_counts[0] * self.body_durations[0])
+
+    def _get_offsets_in_parent(self, nodes: np.ndarray) -> np.ndarray:
+        """Start of each node in the body of its parent. nodes need to be all nodes of one level in ascending order."""
+        durations = self._repetition_counts[nodes] * self.body_durations[nodes]
+        ends = np.cumsum(durations)
+        starts = ends - durations
+        first_siblings = np.zeros(len(nodes), dtype=np.int64)
+        first_siblings[_group_starts(self._parents[nodes])] = _group_starts(self._parents[nodes])
+        return starts - starts[np.maximum.accumulate(first_siblings)]
+
+    def _get_measurement_windows(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """Name ids, begins and lengths of all measurement windows in depth first order.
+
+        The windows of the nodes are collected bottom up one tree level at a time. The windows a node passes to its
+        parent are its own measurements followed by the windows of its children, repeated repetition count times."""
+        owners = np.zeros(0, dtype=np.int64)
+        name_ids = np.zeros(0, dtype=np.int64)
+        begins = np.zeros(0, dtype=float)
+        lengths = np.zeros(0, dtype=float)
+
+        nodes_per_level = self.nodes_per_level
+        for level in range(len(nodes_per_level) - 1, -1, -1):
+            nodes = nodes_per_level[level]
+
+            if len(owners):
+                # the windows of the level below are relative to the start of their owners
+                child_offsets = np.zeros(len(self))
+                child_offsets[nodes_per_level[level + 1]] = self._get_offsets_in_parent(nodes_per_level[level + 1])
+                begins = begins + child_offsets[owners]
+
+            measurement_counts = self._measurement_offsets[nodes + 1] - self._measurement_offsets[nodes]
+            own_measurements = _expand_ranges(self._measurement_offsets[nodes], measurement_counts)
+
+            # a nodes own measurements have the node index as sort key and precede the windows of its children which
+            # have the index of the child as sort key
+            sort_keys = np.concatenate((np.repeat(nodes, measurement_counts), owners))
+            order = np.argsort(sort_keys, kind='stable')
+            owners = np.concatenate((np.repeat(nodes, measurement_counts), self._parents[owners]))[order]
+            name_ids = np.concatenate((self._measurement_name_ids[own_measurements], name_ids))[order]
+            begins = np.concatenate((self._measurement_begins[own_measurements], begins))[order]
+            lengths = np.concatenate((self._measurement_lengths[own_measurements], lengths))[order]
+
+            # repeat the windows of each owner
+            group_starts = _group_starts(owners)
+            group_owners = owners[group_starts]
+            group_sizes = np.diff(np.append(group_starts, len(owners)))
+            group_repetitions = self._repetition_counts[group_owners]
+            if np.any(group_repetitions != 1):
+                repeated_sizes = group_sizes * group_repetitions
+                groups = np.repeat(np.arange(len(group_starts)), repeated_sizes)
+                positions = np.arange(len(groups)) - np.repeat(np.cumsum(repeated_sizes) - repeated_sizes,
+                                                               repeated_sizes)
+                repetitions, positions = np.divmod(positions, group_sizes[groups])
+                sources = group_starts[groups] + positions
+
+                owners = owners[sources]
+                name_ids = name_ids[sources]
+                begins = begins[sources] + repetitions * self.body_durations[owners]
+                lengths = lengths[sources]
+
+        return name_ids, begins, lengths
+
+    def get_measurement_windows(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
+        """Begins and lengths of all measurement windows by name. The windows of each name are sorted by begin and
+        length."""
+        name_ids, begins, lengths = self._get_measurement_windows()
+        order = np.lexsort((lengths, begins, name_ids))
+        name_ends = np.cumsum(np.bincount(name_ids, minlength=len(self._measurement_names)))
+        return {name: (begins[window_indices], lengths[window_indices])
+                for name, window_indices in zip(self._measurement_names, np.split(order, name_ends[:-1]))
+                if len(window_indices)}
+
+    def _get_heights_and_balance(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Loop.depth and Loop.is_balanced for all nodes"""
+        if self._heights is None:
+            heights = np.zeros(len(self), dtype=np.int64)
+            balanced = np.ones(len(self), dtype=bool)
+            for nodes in reversed(self.nodes_per_level[1:]):
+                group_starts = _group_starts(self._parents[nodes])
+                parents = self._parents[nodes[group_starts]]
+
+                child_heights = heights[nodes]
+                heights[parents] = np.maximum.reduceat(child_heights, group_starts) + 1
+                balanced[parents] = (np.minimum.reduceat(balanced[nodes], group_starts)
+                                     & (np.minimum.reduceat(child_heights, group_starts) + 1 == heights[parents]))
+            self._heights, self._balanced = heights, balanced
+        return self._heights, self._balanced
+
+    def flatten_and_balance(self, depth: int) -> 'CompactLoop':
+        """Equivalent of Loop.flatten_and_balance that returns a new CompactLoop.
+
+        Args:
+            depth: Target depth of the program
+        """
+        builder = _CompactLoopBuilder(self)
+        root = builder.begin(-1, self._repetition_counts[0], self._waveform_ids[0], 0)
+        for child in self.get_children(0):
+            self._balance(builder, child, depth - 1, root)
+        builder.end(root)
+        return builder.build()
+
+    def _balance(self, builder: '_CompactLoopBuilder', index: int, target: int, parent: int) -> None:
+        """Emit node index with the given target depth as child of parent the way Loop.flatten_and_balance does."""
+        heights, balanced = self._get_heights_and_balance()
+        repetition_count = int(self._repetition_counts[index])
+        waveform_id = int(self._waveform_ids[index])
+        height = int(heights[index])
+
+        # Loop.encapsulate
+        wrappers = []
+        while height < target:
+            parent = builder.begin(parent, 1, -1, -1)
+            wrappers.append(parent)
+            target -= 1
+
+        if not balanced[index]:
+            if target > 0:
+                node = builder.begin(parent, repetition_count, waveform_id, index)
+                for child in self.get_children(index):
+                    self._balance(builder, child, target - 1, node)
+                builder.end(node)
+            else:
+                # the children become leaves and the node is unrolled
+                start = len(builder)
+                for child in self.get_children(index):
+                    self._balance(builder, child, target - 1, parent)
+                builder.repeat(start, repetition_count)
+
+        else:
+            children_source = index
+            while True:
+                if height == target or height == 0:
+                    node = builder.begin(parent, repetition_count, waveform_id, index)
+                    builder.copy_children(children_source, node)
+                    builder.end(node)
+                    break
+
+                children = self.get_children(children_source)
+                if len(children) == 1 and len(self.get_children(children[0])) == 1:
+                    # merge nested loops with a single child
+                    repetition_count *= int(self._repetition_counts[children[0]])
+                    waveform_id = int(self._waveform_ids[children[0]])
+                    children_source = children[0]
+                    height -= 1
+
+                else:
+                    # Loop.unroll
+                    start = len(builder)
+                    for child in children:
+                        self._balance(builder, child, target, parent)
+                    builder.repeat(start, repetition_count)
+                    break
+
+        for wrapper in reversed(wrappers):
+            builder.end(wrapper)
+
+    def to_waveform(self) -> Waveform:
+        """Equivalent of qupulse._program._loop.to_waveform. Structurally identical subtrees result in the same
+        waveform object."""
+        waveform_builder = _WaveformBuilder()
+
+        # children are converted before their parents and collected in reversed order
+        children = dict()  # type: Dict[int, List[Waveform]]
+        waveform = None
+        for index, parent, repetition_count, waveform_id in zip(range(len(self) - 1, -1, -1),
+                                                                self._parents[::-1].tolist(),
+                                                                self._repetition_counts[::-1].tolist(),
+                                                                self._waveform_ids[::-1].tolist()):
+            child_waveforms = children.pop(index, None)
+            if child_waveforms is None:
+                waveform = waveform_builder.get_leaf(None if waveform_id < 0 else self._waveforms[waveform_id])
+            elif len(child_waveforms) == 1:
+                waveform = child_waveforms[0]
+            else:
+                child_waveforms.reverse()
+                waveform = waveform_builder.get_sequence(child_waveforms)
+
+            if repetition_count > 1:
+                waveform = waveform_builder.get_repetition(waveform, repetition_count)
+            if parent >= 0:
+                children.setdefault(parent, []).append(waveform)
+        return waveform
+
+
+class _CompactLoopBuilder:
+    """Appends nodes in pre-order. The measurements of each node are taken from a node of the source program."""
+
+    def __init__(self, source: CompactLoop):
+        self._source = source
+        self._parents = []
+        self._subtree_ends = []
+        self._repetition_counts = []
+        self._waveform_ids = []
+        self._measurement_sources = []
+
+    def __len__(self) -> int:
+        return len(self._parents)
+
+    def begin(self, parent: int, repetition_count: int, waveform_id: int, measurement_source: int) -> int:
+        """Append a node. The node is finished by calling end after its descendants were appended."""
+        index = len(self._parents)
+        self._parents.append(parent)
+        self._subtree_ends.append(None)
+        self._repetition_counts.append(repetition_count)
+        self._waveform_ids.append(waveform_id)
+        self._measurement_sources.append(measurement_source)
+        return index
+
+    def end(self, index: int) -> None:
+        self._subtree_ends[index] = len(self._parents)
+
+    def copy_children(self, source_index: int, parent: int) -> None:
+        """Append copies of the descendants of source_index as descendants of parent"""
+        source = self._source
+        descendants = slice(source_index + 1, source.subtree_ends[source_index])
+        shift = len(self._parents) - descendants.start
+
+        source_parents = source.parents[descendants]
+        self._parents.extend(np.where(source_parents == source_index, parent, source_parents + shift).tolist())
+        self._subtree_ends.extend((source.subtree_ends[descendants] + shift).tolist())
+        self._repetition_counts.extend(source.repetition_counts[descendants].tolist())
+        self._waveform_ids.extend(source.waveform_ids[descendants].tolist())
+        self._measurement_sources.extend(range(descendants.start, descendants.stop))
+
+    def repeat(self, start: int, count: int) -> None:
+        """Append count - 1 copies of all nodes from start on"""
+        stop = len(self._parents)
+        if count == 0:
+            for values in (self._parents, self._subtree_ends, self._repetition_counts, self._waveform_ids,
+                           self._measurement_sources):
+                del values[start:]
+            return
+
+        parents = np.array(self._parents[start:], dtype=np.int64)
+        subtree_ends = np.array(self._subtree_ends[start:], dtype=np.int64)
+        is_inner = parents >= start
+        for copy in range(1, count):
+            shift = copy * (stop - start)
+            self._parents.extend(np.where(is_inner, parents + shift, parents).tolist())
+            self._subtree_ends.extend((subtree_ends + shift).tolist())
+            self._repetition_counts.extend(self._repetition_counts[start:stop])
+            self._waveform_ids.extend(self._waveform_ids[start:stop])
+            self._measurement_sources.extend(self._measurement_sources[start:stop])
+
+    def build(self) -> CompactLoop:
+        source = self._source
+        measurement_sources = np.array(self._measurement_sources, dtype=np.int64)
+        measurement_counts = np.where(measurement_sources >= 0,
+                                      source._measurement_offsets[measurement_sources + 1]
+                                      - source._measurement_offsets[measurement_sources], 0)
+        measurements = _expand_ranges(source._measurement_offsets[measurement_sources], measurement_counts)
+
+        return CompactLoop(parents=self._parents,
+                           subtree_ends=self._subtree_ends,
+                           repetition_counts=self._repetition_counts,
+                           waveform_ids=self._waveform_ids,
+                           waveforms=source.waveforms,
+                           measurement_offsets=np.concatenate(([0], np.cumsum(measurement_counts))),
+                           measurement_name_ids=source._measurement_name_ids[measurements],
+                           measurement_begins=source._measurement_begins[measurements],
+                           measurement_lengths=source._measurement_lengths[measurements],
+                           measurement_names=source.measurement_names)
@@ -1,6 +1,6 @@
 import itertools
-from typing import Union, Dict, Set, Iterable, FrozenSet, Tuple, cast, List, Optional, DefaultDict, Generator
-from collections import defaultdict, deque
+from typing import Union, Dict, Set, Iterable, FrozenSet, Tuple, cast, List, Optional, Generator
+from collections import deque
 from copy import deepcopy
 from enum import Enum
 import warnings
@@ -19,7 +19,15 @@ from qupulse._program.waveforms import SequenceWaveform, RepetitionWaveform
 __all__ = ['Loop', 'MultiChannelProgram', 'make_compatible']
 
 
+def _expand_ranges(starts: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    """Concatenation of range(start, start + count) for all starts and counts"""
+    counts_before = np.cumsum(counts) - counts
+    return np.arange(np.sum(counts), dtype=np.int64) + np.repeat(starts - counts_before, counts)
+
+
 class Loop(Node):
+    __slots__ = ('_waveform', '_measurements', '_repetition_count', '_cached_body_duration')
+
     MAX_REPR_SIZE = 2000
 
     """Build a loop tree. The leaves of the tree are loops with one element."""
@@ -180,48 +188,116 @@ class Loop(Node):
         return type(self)(parent=self.parent if new_parent is False else new_parent,
                           waveform=self._waveform,
                           repetition_count=self.repetition_count,
-                          measurements=self._measurements,
+                          measurements=None if self._measurements is None else list(self._measurements),
                           children=(child.copy_tree_structure() for child in self))
 
-    def _get_measurement_windows(self) -> DefaultDict[str, np.ndarray]:
-        temp_meas_windows = defaultdict(list)
-        if self._measurements:
-            for (mw_name, begin, length) in self._measurements:
-                temp_meas_windows[mw_name].append((begin, length))
-
-            for mw_name, begin_length_list in temp_meas_windows.items():
-                temp_meas_windows[mw_name] = [np.asarray(begin_length_list, dtype=float)]
-
-        # calculate duration together with meas windows in the same iteration
-        if self.is_leaf():
-            body_duration = float(self.body_duration)
-        else:
-            offset = TimeType(0)
-            for child in self:
-                for mw_name, begins_length_array in child._get_measurement_windows().items():
-                    begins_length_array[:, 0] += float(offset)
-                    temp_meas_windows[mw_name].append(begins_length_array)
-                offset += child.duration
-
-            body_duration = float(offset)
-
-        # repeat and add repetition based offset
-        for mw_name, begin_length_list in temp_meas_windows.items():
-            temp_begin_length_array = np.concatenate(begin_length_list)
-
-            begin_length_array = np.tile(temp_begin_length_array, (self.repetition_count, 1))
-
-            shaped_begin_length_array = np.reshape(begin_length_array, (self.repetition_count, -1, 2))
-
-            shaped_begin_length_array[:, :, 0] += (np.arange(self.repetition_count) * body_duration)[:, np.newaxis]
-
-            temp_meas_windows[mw_name] = begin_length_array
-
-        return temp_meas_windows
+    def _get_measurement_windows(self) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+        """Names, name ids, begins and lengths of all measurement windows in no particular order.
+
+        The tree is traversed once to collect the offset of each node in the body of its parent. The start times of all
+        repetitions of the nodes that contain measurements are then expanded one tree level at a time."""
+        parents = []
+        levels = []
+        offsets = []
+        body_durations = []
+        repetition_counts = []
+        measurement_nodes = []
+        measurement_name_ids = []
+        measurement_begins = []
+        measurement_lengths = []
+        name_ids = dict()
+
+        # sibling offsets are summed exactly and converted to float once per node to avoid accumulating rounding errors
+        stack = [(self, -1, 0, 0., float(self.body_duration))]
+        while stack:
+            node, parent, level, offset, body_duration = stack.pop()
+            index = len(parents)
+            parents.append(parent)
+            levels.append(level)
+            offsets.append(offset)
+            body_durations.append(body_duration)
+            repetition_counts.append(node.repetition_count)
+
+            if node._measurements:
+                for name, begin, length in node._measurements:
+                    measurement_nodes.append(index)
+                    measurement_name_ids.append(name_ids.setdefault(name, len(name_ids)))
+                    measurement_begins.append(begin)
+                    measurement_lengths.append(length)
+
+            children = []
+            child_offset = TimeType(0)
+            for child in node:
+                child_body_duration = child.body_duration
+                children.append((child, index, level + 1, float(child_offset), float(child_body_duration)))
+                child_offset += child_body_duration * child.repetition_count
+            stack.extend(reversed(children))
+
+        names = list(name_ids)
+        if not names:
+            return names, np.zeros(0, dtype=np.int64), np.zeros(0, dtype=float), np.zeros(0, dtype=float)
+
+        parents = np.array(parents, dtype=np.int64)
+        levels = np.array(levels, dtype=np.int64)
+        offsets = np.array(offsets, dtype=float)
+        body_durations = np.array(body_durations, dtype=float)
+        repetition_counts = np.array(repetition_counts, dtype=np.int64)
+        measurement_nodes = np.array(measurement_nodes, dtype=np.int64)
+
+        # the nodes of a level are in depth first order so their parents are sorted as well
+        nodes_by_level = np.argsort(levels, kind='stable')
+        level_starts = np.searchsorted(levels[nodes_by_level], np.arange(levels.max() + 2))
+        nodes_per_level = [nodes_by_level[start:end] for start, end in zip(level_starts[:-1], level_starts[1:])]
+
+        # only nodes with measurements in their subtree need to be expanded
+        has_measurements = np.zeros(len(parents), dtype=bool)
+        has_measurements[measurement_nodes] = True
+        for level in range(len(nodes_per_level) - 1, 0, -1):
+            nodes = nodes_per_level[level][has_measurements[nodes_per_level[level]]]
+            has_measurements[parents[nodes]] = True
+            nodes_per_level[level] = nodes
+
+        # start times of all repetitions of the nodes. The repetitions of a node are contiguous and the nodes ascending
+        level_instance_nodes = np.zeros(repetition_counts[0], dtype=np.int64)
+        level_instance_starts = np.arange(repetition_counts[0]) * body_durations[0]
+        instance_nodes = [level_instance_nodes]
+        instance_starts = [level_instance_starts]
+        for nodes in nodes_per_level[1:]:
+            first_parent_instances = np.searchsorted(level_instance_nodes, parents[nodes], 'left')
+            end_parent_instances = np.searchsorted(level_instance_nodes, parents[nodes], 'right')
+            counts = (end_parent_instances - first_parent_instances) * repetition_counts[nodes]
+
+            parent_instances, repetitions = np.divmod(_expand_ranges(np.zeros(len(nodes), dtype=np.int64), counts),
+                                                      np.repeat(repetition_counts[nodes], counts))
+            parent_instances += np.repeat(first_parent_instances, counts)
+
+            level_instance_starts = (level_instance_starts[parent_instances]
+                                     + np.repeat(offsets[nodes], counts)
+                                     + repetitions * np.repeat(body_durations[nodes], counts))
+            level_instance_nodes = np.repeat(nodes, counts)
+            instance_nodes.append(level_instance_nodes)
+            instance_starts.append(level_instance_starts)
+
+        instance_nodes = np.concatenate(instance_nodes)
+        instance_starts = np.concatenate(instance_starts)
+        instance_order = np.argsort(instance_nodes, kind='stable')
+
+        first_instances = np.searchsorted(instance_nodes[instance_order], measurement_nodes, 'left')
+        instance_counts = np.searchsorted(instance_nodes[instance_order], measurement_nodes, 'right') - first_instances
+        instances = instance_order[_expand_ranges(first_instances, instance_counts)]
+
+        begins = instance_starts[instances] + np.repeat(np.array(measurement_begins, dtype=float), instance_counts)
+        lengths = np.repeat(np.array(measurement_lengths, dtype=float), instance_counts)
+        return names, np.repeat(np.array(measurement_name_ids, dtype=np.int64), instance_counts), begins, lengths
 
     def get_measurement_windows(self) -> Dict[str, Tuple[np.ndarray, np.ndarray]]:
-        return {mw_name: (begin_length_list[:, 0], begin_length_list[:, 1])
-                for mw_name, begin_length_list in self._get_measurement_windows().items()}
+        """Begins and lengths of all measurement windows by name. The windows of each name are sorted by begin and
+        length."""
+        names, name_ids, begins, lengths = self._get_measurement_windows()
+        order = np.lexsort((lengths, begins, name_ids))
+        name_ends = np.cumsum(np.bincount(name_ids, minlength=len(names)))
+        return {name: (begins[window_indices], lengths[window_indices])
+                for name, window_indices in zip(names, np.split(order, name_ends[:-1]))}
 
     def split_one_child(self, child_index=None) -> None:
         """Take the last child that has a repetition count larger one, decrease it's repetition count and insert a copy
@@ -472,22 +548,57 @@ class MultiChannelProgram:
         raise KeyError(item)
 
 
-def to_waveform(program: Loop) -> Waveform:
-    if program.is_leaf():
-        if program.repetition_count == 1:
-            return program.waveform
-        else:
-            return RepetitionWaveform(program.waveform, program.repetition_count)
-    else:
-        if len(program) == 1:
-            sequenced_waveform = to_waveform(cast(Loop, program[0]))
+class _WaveformBuilder:
+    """Converts loops into waveforms and returns the same waveform object for structurally identical loops.
+
+    Equal leaf waveforms are replaced by the first one that was seen. Sequence and repetition waveforms are then
+    identified by the identity of their (already shared) sub waveforms, so their compare keys are never compared. All
+    waveforms passed to get_repetition and get_sequence need to be returned by the same builder."""
+
+    def __init__(self):
+        self._leaf_waveforms = dict()  # type: Dict[Waveform, Waveform]
+        # the keys contain ids of waveforms that are kept alive by this builder
+        self._waveforms = dict()  # type: Dict[Tuple, Waveform]
+
+    def get_leaf(self, waveform: Optional[Waveform]) -> Optional[Waveform]:
+        if waveform is None:
+            return None
+        return self._leaf_waveforms.setdefault(waveform, waveform)
+
+    def get_repetition(self, body: Waveform, repetition_count: int) -> RepetitionWaveform:
+        key = (RepetitionWaveform, id(body), repetition_count)
+        waveform = self._waveforms.get(key, None)
+        if waveform is None:
+            waveform = self._waveforms[key] = RepetitionWaveform(body, repetition_count)
+        return waveform
+
+    def get_sequence(self, sub_waveforms: List[Waveform]) -> SequenceWaveform:
+        key = (SequenceWaveform, *map(id, sub_waveforms))
+        waveform = self._waveforms.get(key, None)
+        if waveform is None:
+            waveform = self._waveforms[key] = SequenceWaveform(sub_waveforms)
+        return waveform
+
+    def to_waveform(self, program: Loop) -> Waveform:
+        if program.is_leaf():
+            waveform = self.get_leaf(program.waveform)
+        elif len(program) == 1:
+            waveform = self.to_waveform(cast(Loop, program[0]))
         else:
-            sequenced_waveform = SequenceWaveform([to_waveform(cast(Loop, sub_program))
-                                                   for sub_program in program])
+            waveform = self.get_sequence([self.to_waveform(cast(Loop, sub_program)) for sub_program in program])
+
         if program.repetition_count > 1:
-            return RepetitionWaveform(sequenced_waveform, program.repetition_count)
+            return self.get_repetition(waveform, program.repetition_count)
         else:
-            return sequenced_waveform
+            return waveform
+
+
+def to_waveform(program: Loop, waveform_builder: Optional[_WaveformBuilder]=None) -> Waveform:
+    """Convert the program into a waveform. Structurally identical subtrees result in the same waveform object. Pass
+    a waveform builder to share waveforms between multiple calls."""
+    if waveform_builder is None:
+        waveform_builder = _WaveformBuilder()
+    return waveform_builder.to_waveform(program)
 
 
 class _CompatibilityLevel(Enum):
@@ -496,65 +607,98 @@ class _CompatibilityLevel(Enum):
     incompatible = 2
 
 
-def _is_compatible(program: Loop, min_len: int, quantum: int, sample_rate: TimeType) -> _CompatibilityLevel:
-    program_duration_in_samples = program.duration * sample_rate
+def _get_compatibility_levels(program: Loop, min_len: int, quantum: int,
+                              sample_rate: TimeType) -> Dict[int, Tuple[TimeType, _CompatibilityLevel]]:
+    """Duration in samples and compatibility level of all loops in program keyed by id. The loops are visited once
+    bottom up so the durations of the children are reused for their parents."""
+    levels = dict()
 
-    if program_duration_in_samples.denominator != 1:
-        return _CompatibilityLevel.incompatible
+    stack = [(program, False)]
+    while stack:
+        loop, children_visited = stack.pop()
 
-    if program_duration_in_samples < min_len or program_duration_in_samples % quantum > 0:
-        return _CompatibilityLevel.incompatible
-
-    if program.is_leaf():
-        waveform_duration_in_samples = program.body_duration * sample_rate
-        if waveform_duration_in_samples < min_len or (waveform_duration_in_samples / quantum).denominator != 1:
-            return _CompatibilityLevel.action_required
+        if loop.is_leaf():
+            body_duration_in_samples = loop.body_duration * sample_rate
+        elif children_visited:
+            body_duration_in_samples = sum((levels[id(child)][0] for child in loop), TimeType(0))
         else:
-            return _CompatibilityLevel.compatible
-    else:
-        if all(_is_compatible(cast(Loop, sub_program), min_len, quantum, sample_rate) == _CompatibilityLevel.compatible
-               for sub_program in program):
-            return _CompatibilityLevel.compatible
+            stack.append((loop, True))
+            stack.extend((child, False) for child in loop)
+            continue
+
+        duration_in_samples = body_duration_in_samples * loop.repetition_count
+
+        if duration_in_samples.denominator != 1 or duration_in_samples < min_len or duration_in_samples % quantum > 0:
+            level = _CompatibilityLevel.incompatible
+
+        elif loop.is_leaf():
+            if body_duration_in_samples < min_len or (body_duration_in_samples / quantum).denominator != 1:
+                level = _CompatibilityLevel.action_required
+            else:
+                level = _CompatibilityLevel.compatible
+
+        elif all(levels[id(child)][1] == _CompatibilityLevel.compatible for child in loop):
+            level = _CompatibilityLevel.compatible
         else:
-            return _CompatibilityLevel.action_required
+            level = _CompatibilityLevel.action_required
+
+        levels[id(loop)] = (duration_in_samples, level)
+    return levels
+
+
+def _is_compatible(program: Loop, min_len: int, quantum: int, sample_rate: TimeType) -> _CompatibilityLevel:
+    return _get_compatibility_levels(program, min_len, quantum, sample_rate)[id(program)][1]
 
 
-def _make_compatible(program: Loop, min_len: int, quantum: int, sample_rate: TimeType) -> None:
+def _make_compatible(program: Loop, min_len: int, quantum: int, sample_rate: TimeType,
+                     compatibility_levels: Optional[Dict[int, Tuple[TimeType, _CompatibilityLevel]]]=None,
+                     waveform_builder: Optional[_WaveformBuilder]=None) -> None:
+    """compatibility_levels is the result of _get_compatibility_levels for program or a loop containing it. It is
+    computed if not provided. The waveforms of collapsed loops are created by waveform_builder so identical loops in
+    different places share their waveform."""
+    if compatibility_levels is None:
+        compatibility_levels = _get_compatibility_levels(program, min_len, quantum, sample_rate)
+    if waveform_builder is None:
+        waveform_builder = _WaveformBuilder()
 
     if program.is_leaf():
-        program.waveform = to_waveform(program.copy_tree_structure())
+        program.waveform = to_waveform(program, waveform_builder)
         program.repetition_count = 1
 
     else:
-        comp_levels = np.array([_is_compatible(cast(Loop, sub_program), min_len, quantum, sample_rate)
-                                for sub_program in program])
-        incompatible = comp_levels == _CompatibilityLevel.incompatible
-        if np.any(incompatible):
-            single_run = program.duration * sample_rate / program.repetition_count
+        comp_levels = [compatibility_levels[id(sub_program)][1] for sub_program in program]
+        if _CompatibilityLevel.incompatible in comp_levels:
+            single_run = compatibility_levels[id(program)][0] / program.repetition_count
             if is_integer(single_run / quantum) and single_run >= min_len:
                 new_repetition_count = program.repetition_count
                 program.repetition_count = 1
             else:
                 new_repetition_count = 1
-            program.waveform = to_waveform(program.copy_tree_structure())
-            program.repetition_count = new_repetition_count
+            # to_waveform does not modify the program so there is no need to copy it
+            waveform = to_waveform(program, waveform_builder)
             program[:] = []
+            program.waveform = waveform
+            program.repetition_count = new_repetition_count
             return
         else:
             for sub_program, comp_level in zip(program, comp_levels):
                 if comp_level == _CompatibilityLevel.action_required:
-                    _make_compatible(sub_program, min_len, quantum, sample_rate)
+                    _make_compatible(sub_program, min_len, quantum, sample_rate,
+                                     compatibility_levels, waveform_builder)
 
 
 def make_compatible(program: Loop, minimal_waveform_length: int, waveform_quantum: int, sample_rate: TimeType):
-    comp_level = _is_compatible(program,
-                                min_len=minimal_waveform_length,
-                                quantum=waveform_quantum,
-                                sample_rate=sample_rate)
+    compatibility_levels = _get_compatibility_levels(program,
+                                                     min_len=minimal_waveform_length,
+                                                     quantum=waveform_quantum,
+                                                     sample_rate=sample_rate)
+    comp_level = compatibility_levels[id(program)][1]
     if comp_level == _CompatibilityLevel.incompatible:
         raise ValueError('The program cannot be made compatible to restrictions')
     elif comp_level == _CompatibilityLevel.action_required:
         _make_compatible(program,
                          min_len=minimal_waveform_length,
                          quantum=waveform_quantum,
-                         sample_rate=sample_rate)
+                         sample_rate=sample_rate,
+                         compatibility_levels=compatibility_levels,
+                         waveform_builder=_WaveformBuilder())
@@ -51,6 +51,8 @@ class InstructionPointer(Comparable):
     The target instruction is referenced by the instruction block it resides in and its offset
     within this block.
     """
+
+    __slots__ = ('__block', '__offset')
     
     def __init__(self, block: 'AbstractInstructionBlock', offset: int=0) -> None:
         """Create a new InstructionPointer instance.
@@ -89,6 +91,8 @@ class InstructionPointer(Comparable):
 class Instruction(Comparable, metaclass=ABCMeta):
     """A hardware instruction."""
 
+    __slots__ = ()
+
     def __init__(self) -> None:
         super().__init__()
 
@@ -101,6 +105,8 @@ class CJMPInstruction(Instruction):
     effect, the execution will continue with the following.
     """
 
+    __slots__ = ('trigger', 'target')
+
     def __init__(self, trigger: Trigger, target: InstructionPointer) -> None:
         """Create a new CJMPInstruction object.
 
@@ -126,6 +132,9 @@ class MEASInstruction(Instruction):
     """A measurement instruction.
 
     Cause a measurement to be executed. The instruction itself takes no time."""
+
+    __slots__ = ('measurements',)
+
     def __init__(self, measurements: List[MeasurementWindow]):
         super().__init__()
 
@@ -146,6 +155,8 @@ class REPJInstruction(Instruction):
     this REPJInstruction for the first n times this REPJInstruction is encountered, where n is
     a parameter."""
 
+    __slots__ = ('count', 'target')
+
     def __init__(self, count: int, target: InstructionPointer) -> None:
         """Create a new REPJInstruction object.
 
@@ -176,6 +187,8 @@ class GOTOInstruction(Instruction):
     Will cause the execution to jump to the instruction indicated by the InstructionPointer
     held by this GOTOInstruction.
     """
+
+    __slots__ = ('target',)
     
     def __init__(self, target: InstructionPointer) -> None:
         """Create a new GOTOInstruction object.
@@ -198,6 +211,8 @@ class GOTOInstruction(Instruction):
 class EXECInstruction(Instruction):
     """An instruction to execute/play back a waveform."""
 
+    __slots__ = ('waveform',)
+
     def __init__(self, waveform: Waveform) -> None:
         """Create a new EXECInstruction object.
 
@@ -218,6 +233,8 @@ class EXECInstruction(Instruction):
 class STOPInstruction(Instruction):
     """An instruction which indicates the end of the program."""
 
+    __slots__ = ()
+
     def __init__(self) -> None:
         """Create a new STOPInstruction object."""
         super().__init__()
@@ -237,6 +254,8 @@ class CHANInstruction(Instruction):
     switch statement.
     """
 
+    __slots__ = ('channel_to_instruction_block',)
+
     def __init__(self, channel_to_instruction_block: Dict[ChannelID, InstructionPointer]):
         self.channel_to_instruction_block = channel_to_instruction_block
 
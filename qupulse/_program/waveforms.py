@@ -4,10 +4,13 @@ Classes:
     - Waveform: An instantiated pulse which can be sampled to a raw voltage value array.
 """
 
+import hashlib
 import itertools
+import threading
 from abc import ABCMeta, abstractmethod
-from weakref import WeakValueDictionary, ref
-from typing import Union, Set, Sequence, NamedTuple, Tuple, Any, Iterable, FrozenSet, Optional
+from collections import OrderedDict
+from weakref import ref
+from typing import Union, Set, Sequence, NamedTuple, Tuple, Any, Iterable, FrozenSet, Optional, Dict, List
 
 import numpy as np
 
@@ -16,19 +19,156 @@ from qupulse.utils import checked_int_cast, isclose
 from qupulse.utils.types import TimeType, time_from_float
 from qupulse.comparable import Comparable
 from qupulse.expressions import ExpressionScalar
-from qupulse.pulses.interpolation import InterpolationStrategy
+from qupulse.utils.sympy import lambdify_cache
+from qupulse.pulses.interpolation import InterpolationStrategy, HoldInterpolationStrategy,\
+    JumpInterpolationStrategy, LinearInterpolationStrategy
 from qupulse._program.transformation import Transformation
 
 
 __all__ = ["Waveform", "TableWaveform", "TableWaveformEntry", "FunctionWaveform", "SequenceWaveform",
-           "MultiChannelWaveform", "RepetitionWaveform", "TransformingWaveform"]
+           "MultiChannelWaveform", "RepetitionWaveform", "TransformingWaveform", "SampleGrid", "SampleCache",
+           "SampleCacheStatistics"]
+
+
+class SampleGrid(NamedTuple('SampleGrid', [('start', float),
+                                           ('step', float),
+                                           ('count', int),
+                                           ('digest', bytes)])):
+    """Exact descriptor of sample times. Sample times that differ only by floating point rounding have different
+    digests so they do not share cached samples."""
+
+    @classmethod
+    def from_sample_times(cls, sample_times: np.ndarray) -> 'SampleGrid':
+        """Describe the sample times by their start, mean step, count and a digest of their binary representation."""
+        count = len(sample_times)
+        start = float(sample_times[0])
+        step = (float(sample_times[-1]) - start) / (count - 1) if count > 1 else 0.
+        digest = hashlib.blake2b(np.ascontiguousarray(sample_times, dtype=float), digest_size=16).digest()
+        return cls(start, step, count, digest)
+
+
+SampleCacheStatistics = NamedTuple('SampleCacheStatistics', [('hits', int),
+                                                             ('misses', int),
+                                                             ('evictions', int),
+                                                             ('n_entries', int),
+                                                             ('n_bytes', int),
+                                                             ('max_bytes', int)])
+
+
+class SampleCache:
+    """Least recently used cache of sampled waveforms with a memory budget.
+
+    Entries are identified by waveform, channel and the :class:`SampleGrid` of the sample times. The least recently
+    used entries are evicted if the total size of the cached arrays exceeds max_bytes. The waveforms are referenced
+    weakly and the entries of a garbage collected waveform are dropped on the next access of the cache. The cache may
+    be used from multiple threads."""
+
+    def __init__(self, max_bytes: int=2**28):
+        if max_bytes < 0:
+            raise ValueError('The byte budget of the sample cache must not be negative', max_bytes)
+        self._max_bytes = max_bytes
+        self._entries = OrderedDict()  # type: OrderedDict[Tuple[ref, ChannelID, SampleGrid], np.ndarray]
+        self._keys_by_waveform = dict()  # type: Dict[ref, Set[Tuple[ref, ChannelID, SampleGrid]]]
+        self._n_bytes = 0
+        self._lock = threading.Lock()
+
+        # the weakref callbacks only record the collected waveforms because they may run while the lock is held
+        self._collected = []  # type: List[ref]
+
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    @property
+    def max_bytes(self) -> int:
+        return self._max_bytes
+
+    @max_bytes.setter
+    def max_bytes(self, max_bytes: int):
+        if max_bytes < 0:
+            raise ValueError('The byte budget of the sample cache must not be negative', max_bytes)
+        with self._lock:
+            self._max_bytes = max_bytes
+            self._evict()
+
+    @property
+    def statistics(self) -> SampleCacheStatistics:
+        with self._lock:
+            self._remove_collected()
+            return SampleCacheStatistics(hits=self._hits, misses=self._misses, evictions=self._evictions,
+                                         n_entries=len(self._entries), n_bytes=self._n_bytes,
+                                         max_bytes=self._max_bytes)
+
+    def get(self, waveform: 'Waveform', channel: ChannelID, sample_grid: SampleGrid) -> Optional[np.ndarray]:
+        key = (ref(waveform), channel, sample_grid)
+        with self._lock:
+            self._remove_collected()
+            try:
+                sampled = self._entries[key]
+            except KeyError:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self._hits += 1
+            return sampled
+
+    def put(self, waveform: 'Waveform', channel: ChannelID, sample_grid: SampleGrid, sampled: np.ndarray) -> None:
+        if sampled.nbytes > self._max_bytes:
+            return
+        waveform_ref = ref(waveform)
+        key = (waveform_ref, channel, sample_grid)
+        with self._lock:
+            self._remove_collected()
+            previous = self._entries.pop(key, None)
+            if previous is not None:
+                self._n_bytes -= previous.nbytes
+            self._entries[key] = sampled
+            self._n_bytes += sampled.nbytes
+
+            waveform_keys = self._keys_by_waveform.get(waveform_ref)
+            if waveform_keys is None:
+                waveform_keys = self._keys_by_waveform[ref(waveform, self._collected.append)] = set()
+            waveform_keys.add(key)
+            self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._keys_by_waveform.clear()
+            self._collected.clear()
+            self._n_bytes = 0
+
+    def reset_statistics(self) -> None:
+        self._hits = self._misses = self._evictions = 0
+
+    def _evict(self) -> None:
+        while self._n_bytes > self._max_bytes:
+            key, sampled = self._entries.popitem(last=False)
+            self._n_bytes -= sampled.nbytes
+            self._evictions += 1
+
+            # references to collected waveforms only compare equal to themselves so their keys are not found here
+            waveform_keys = self._keys_by_waveform.get(key[0])
+            if waveform_keys is not None:
+                waveform_keys.discard(key)
+                if not waveform_keys:
+                    del self._keys_by_waveform[key[0]]
+
+    def _remove_collected(self) -> None:
+        while self._collected:
+            for key in self._keys_by_waveform.pop(self._collected.pop(), ()):
+                sampled = self._entries.pop(key, None)
+                if sampled is not None:
+                    self._n_bytes -= sampled.nbytes
 
 
 class Waveform(Comparable, metaclass=ABCMeta):
     """Represents an instantiated PulseTemplate which can be sampled to retrieve arrays of voltage
     values for the hardware."""
 
-    __sampled_cache = WeakValueDictionary()
+    __slots__ = ('_hash', '__weakref__')
+
+    _sample_cache = SampleCache()
 
     @property
     @abstractmethod
@@ -59,7 +199,7 @@ class Waveform(Comparable, metaclass=ABCMeta):
                     sample_times: np.ndarray,
                     output_array: Union[np.ndarray, None]=None) -> np.ndarray:
         """A wrapper to the unsafe_sample method which caches the result. This method enforces the constrains
-        unsafe_sample expects and caches the result to save memory.
+        unsafe_sample expects and caches the result to save memory (see :meth:`set_sample_cache`).
 
         Args/Result:
             sample_times: Times at which this Waveform will be sampled.
@@ -86,13 +226,19 @@ class Waveform(Comparable, metaclass=ABCMeta):
             raise KeyError('Channel not defined in this waveform: {}'.format(channel))
 
         if output_array is None:
-            # cache the result to save memory
+            # cache the result to avoid resampling
+            sample_cache = Waveform._sample_cache
+            if sample_cache is not None:
+                sample_grid = SampleGrid.from_sample_times(sample_times)
+                result = sample_cache.get(self, channel, sample_grid)
+                if result is not None:
+                    return result
+
             result = self.unsafe_sample(channel, sample_times)
             result.flags.writeable = False
-            key = hash(bytes(result))
-            if key not in self.__sampled_cache:
-                self.__sampled_cache[key] = result
-            return self.__sampled_cache[key]
+            if sample_cache is not None:
+                sample_cache.put(self, channel, sample_grid, result)
+            return result
         else:
             if len(output_array) != len(sample_times):
                 raise ValueError('Output array length and sample time length are different')
@@ -101,6 +247,20 @@ class Waveform(Comparable, metaclass=ABCMeta):
                                       sample_times=sample_times,
                                       output_array=output_array)
 
+    @staticmethod
+    def get_sample_cache() -> Optional[SampleCache]:
+        """The cache used by :meth:`get_sampled` of all waveforms."""
+        return Waveform._sample_cache
+
+    @staticmethod
+    def set_sample_cache(sample_cache: Optional[SampleCache]) -> None:
+        """Replace the cache used by :meth:`get_sampled` of all waveforms. None disables caching.
+
+        Args:
+            sample_cache: An object with the interface of :class:`SampleCache` or None
+        """
+        Waveform._sample_cache = sample_cache
+
     @property
     @abstractmethod
     def defined_channels(self) -> Set[ChannelID]:
@@ -111,6 +271,38 @@ class Waveform(Comparable, metaclass=ABCMeta):
     def unsafe_get_subset_for_channels(self, channels: Set[ChannelID]) -> 'Waveform':
         """Unsafe version of :func:`~qupulse.pulses.instructions.get_measurement_windows`."""
 
+    def __hash__(self) -> int:
+        """Waveforms are immutable so the hash of the compare key is computed once and stored. Composite waveforms
+        hash their sub waveforms which in turn use their stored hashes."""
+        waveform_hash = getattr(self, '_hash', None)
+        if waveform_hash is None:
+            waveform_hash = self._hash = hash(self.compare_key)
+        return waveform_hash
+
+    def __eq__(self, other: Any) -> bool:
+        """Identical waveforms are equal and waveforms with different hashes are not. Only the remaining pairs compare
+        their compare keys."""
+        if self is other:
+            return True
+        if not isinstance(other, self.__class__):
+            return False
+        if hash(self) != hash(other):
+            return False
+        return self.compare_key == other.compare_key
+
+    def __setstate__(self, state) -> None:
+        # string hashes depend on the hash seed of the interpreter session so the stored hash is not restored
+        if isinstance(state, tuple):
+            state, slot_state = state
+        else:
+            slot_state = None
+        if state:
+            self.__dict__.update(state)
+        if slot_state:
+            for name, value in slot_state.items():
+                if name != '_hash':
+                    setattr(self, name, value)
+
     def get_subset_for_channels(self, channels: Set[ChannelID]) -> 'Waveform':
         """Get a waveform that only describes the channels contained in `channels`.
 
@@ -133,6 +325,8 @@ class Waveform(Comparable, metaclass=ABCMeta):
 class TableWaveformEntry(NamedTuple('TableWaveformEntry', [('t', float),
                                                            ('v', float),
                                                            ('interp', InterpolationStrategy)])):
+    __slots__ = ()
+
     def __init__(self, t: float, v: float, interp: InterpolationStrategy):
         if not callable(interp):
             raise TypeError('{} is neither callable nor of type InterpolationStrategy'.format(interp))
@@ -142,6 +336,8 @@ class TableWaveform(Waveform):
     EntryInInit = Union[TableWaveformEntry, Tuple[float, float, InterpolationStrategy]]
 
     """Waveform obtained from instantiating a TablePulseTemplate."""
+    __slots__ = ('_table', '_channel_id', '_breakpoints')
+
     def __init__(self,
                  channel: ChannelID,
                  waveform_table: Sequence[EntryInInit]) -> None:
@@ -156,6 +352,9 @@ class TableWaveform(Waveform):
         self._table = self._validate_input(waveform_table)
         self._channel_id = channel
 
+        # breakpoint arrays for vectorized sampling. They are created on first use
+        self._breakpoints = None
+
     @staticmethod
     def _validate_input(input_waveform_table: Sequence[EntryInInit]) -> Tuple[TableWaveformEntry, ...]:
         """ Checks that:
@@ -207,16 +406,57 @@ class TableWaveform(Waveform):
                       channel: ChannelID,
                       sample_times: np.ndarray,
                       output_array: Union[np.ndarray, None]=None) -> np.ndarray:
+        # sample times are an object array if the caller subtracted an exact time offset
+        sample_times = np.asarray(sample_times, dtype=float)
         if output_array is None:
             output_array = np.empty_like(sample_times)
 
-        for entry1, entry2 in zip(self._table[:-1], self._table[1:]):
-            indices = slice(np.searchsorted(sample_times, entry1.t, 'left'),
-                            np.searchsorted(sample_times, entry2.t, 'right'))
-            output_array[indices] = \
-                entry2.interp((entry1.t, entry1.v), (entry2.t, entry2.v), sample_times[indices])
+        times, slopes, offsets, custom_segments = self._get_breakpoints()
+
+        # a sample at a breakpoint belongs to the segment starting there except for the last one
+        segments = np.searchsorted(times, sample_times, 'right') - 1
+        np.clip(segments, 0, len(times) - 2, out=segments)
+
+        # built-in strategies are all of the form slope * (t - t_start) + offset
+        np.multiply(slopes[segments], sample_times - times[segments], out=output_array)
+        output_array += offsets[segments]
+
+        if len(custom_segments):
+            starts = np.searchsorted(segments, custom_segments, 'left')
+            ends = np.searchsorted(segments, custom_segments, 'right')
+            for segment, start, end in zip(custom_segments.tolist(), starts.tolist(), ends.tolist()):
+                if start != end:
+                    entry1, entry2 = self._table[segment], self._table[segment + 1]
+                    output_array[start:end] = entry2.interp((entry1.t, entry1.v),
+                                                            (entry2.t, entry2.v),
+                                                            sample_times[start:end])
         return output_array
 
+    def _get_breakpoints(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Breakpoint times, per segment slope and offset arrays for the built-in interpolation strategies and the
+        indices of segments that use other interpolation strategies."""
+        if self._breakpoints is None:
+            times = np.array([entry.t for entry in self._table], dtype=float)
+            values = np.array([entry.v for entry in self._table], dtype=float)
+            n_segments = len(self._table) - 1
+
+            slopes = np.zeros(n_segments)
+            offsets = values[:-1].copy()
+            custom_segments = []
+            for segment, entry in enumerate(self._table[1:]):
+                interp_type = type(entry.interp)
+                if interp_type is LinearInterpolationStrategy:
+                    duration = times[segment + 1] - times[segment]
+                    if duration:
+                        slopes[segment] = (values[segment + 1] - values[segment]) / duration
+                elif interp_type is JumpInterpolationStrategy:
+                    offsets[segment] = values[segment + 1]
+                elif interp_type is not HoldInterpolationStrategy:
+                    custom_segments.append(segment)
+
+            self._breakpoints = times, slopes, offsets, np.array(custom_segments, dtype=np.int64)
+        return self._breakpoints
+
     @property
     def defined_channels(self) -> Set[ChannelID]:
         return {self._channel_id}
@@ -226,7 +466,14 @@ class TableWaveform(Waveform):
 
 
 class FunctionWaveform(Waveform):
-    """Waveform obtained from instantiating a FunctionPulseTemplate."""
+    """Waveform obtained from instantiating a FunctionPulseTemplate.
+
+    The expression is compiled into a numpy kernel on construction. Long sample time arrays are evaluated in chunks of
+    sample_chunk_size samples that are written into the output array to bound the size of temporary arrays."""
+
+    __slots__ = ('_expression', '_duration', '_channel_id', '_kernel')
+
+    sample_chunk_size = 2**16
 
     def __init__(self, expression: ExpressionScalar,
                  duration: float,
@@ -247,6 +494,16 @@ class FunctionWaveform(Waveform):
         self._expression = expression
         self._duration = time_from_float(duration)
         self._channel_id = channel
+        self._kernel = lambdify_cache.get_lambdified(expression.underlying_expression, expression.variables)
+
+    def __getstate__(self):
+        # the compiled kernel cannot be pickled and is rebuilt from the expression in __setstate__
+        return None, {'_expression': self._expression, '_duration': self._duration, '_channel_id': self._channel_id}
+
+    def __setstate__(self, state) -> None:
+        super().__setstate__(state)
+        self._kernel = lambdify_cache.get_lambdified(self._expression.underlying_expression,
+                                                     self._expression.variables)
 
     @property
     def defined_channels(self) -> Set[ChannelID]:
@@ -266,7 +523,13 @@ class FunctionWaveform(Waveform):
                       output_array: Union[np.ndarray, None] = None) -> np.ndarray:
         if output_array is None:
             output_array = np.empty(len(sample_times))
-        output_array[:] = self._expression.evaluate_numeric(t=sample_times)
+
+        if not self._expression.variables:
+            output_array[:] = self._kernel()
+        else:
+            chunk_size = self.sample_chunk_size
+            for start in range(0, len(sample_times), chunk_size):
+                output_array[start:start + chunk_size] = self._kernel(t=sample_times[start:start + chunk_size])
         return output_array
 
     def unsafe_get_subset_for_channels(self, channels: Set[ChannelID]) -> Waveform:
@@ -275,6 +538,9 @@ class FunctionWaveform(Waveform):
 
 class SequenceWaveform(Waveform):
     """This class allows putting multiple PulseTemplate together in one waveform on the hardware."""
+
+    __slots__ = ('_sequenced_waveforms', '_duration')
+
     def __init__(self, sub_waveforms: Iterable[Waveform]):
         """
 
@@ -356,6 +622,8 @@ class MultiChannelWaveform(Waveform):
         assigned more than one channel of any Waveform object it consists of
     """
 
+    __slots__ = ('_sub_waveforms', '__defined_channels')
+
     def __init__(self, sub_waveforms: Iterable[Waveform]) -> None:
         """Create a new MultiChannelWaveform instance.
 
@@ -458,12 +726,18 @@ class MultiChannelWaveform(Waveform):
 
 class RepetitionWaveform(Waveform):
     """This class allows putting multiple PulseTemplate together in one waveform on the hardware."""
+
+    __slots__ = ('_body', '_repetition_count', '_compare_key')
+
     def __init__(self, body: Waveform, repetition_count: int):
         self._body = body
         self._repetition_count = checked_int_cast(repetition_count)
         if repetition_count < 1 or not isinstance(repetition_count, int):
             raise ValueError('Repetition count must be an integer >0')
 
+        # the compare key contains the (possibly nested) compare key of the body and is only created once
+        self._compare_key = None
+
     @property
     def defined_channels(self) -> Set[ChannelID]:
         return self._body.defined_channels
@@ -474,20 +748,56 @@ class RepetitionWaveform(Waveform):
                       output_array: Union[np.ndarray, None]=None) -> np.ndarray:
         if output_array is None:
             output_array = np.empty_like(sample_times)
-        body_duration = self._body.duration
-        time = 0
-        for _ in range(self._repetition_count):
-            end = time + body_duration
-            indices = slice(*np.searchsorted(sample_times, (float(time), float(end)), 'left'))
-            self._body.unsafe_sample(channel=channel,
-                                     sample_times=sample_times[indices] - time,
-                                     output_array=output_array[indices])
-            time = end
+        repetition_count = self._repetition_count
+
+        # repetition k covers the sample times in [repetition_starts[k], repetition_starts[k + 1])
+        repetition_starts = self._get_repetition_starts()
+        bounds = np.searchsorted(sample_times, repetition_starts, 'left')
+        start, end = bounds[0], bounds[-1]
+        if start == end:
+            return output_array
+        samples_per_repetition = np.diff(bounds)
+
+        body_times = sample_times[start:end] - np.repeat(repetition_starts[:-1], samples_per_repetition)
+        target = output_array[start:end]
+
+        n_body_samples = samples_per_repetition[0]
+        if n_body_samples and np.all(samples_per_repetition == n_body_samples):
+            body_times = body_times.reshape((repetition_count, n_body_samples))
+            if np.array_equal(body_times, np.broadcast_to(body_times[0], body_times.shape)):
+                # all repetitions see the same body sample times: sample the body once and tile it
+                body_values = self._body.unsafe_sample(channel=channel, sample_times=body_times[0])
+                if target.flags.c_contiguous:
+                    target.reshape((repetition_count, n_body_samples))[:] = body_values
+                else:
+                    target[:] = np.tile(body_values, repetition_count)
+                return output_array
+            body_times = body_times.ravel()
+
+        # sample the body once at all distinct times that occur in any repetition
+        unique_body_times, inverse = np.unique(body_times, return_inverse=True)
+        body_values = self._body.unsafe_sample(channel=channel, sample_times=unique_body_times)
+        np.take(body_values, inverse, out=target)
         return output_array
 
+    def _get_repetition_starts(self) -> np.ndarray:
+        """Start times of all repetitions and the end of the last one as float."""
+        body_duration = self._body.duration
+        numerator = int(body_duration.numerator)
+        denominator = int(body_duration.denominator)
+
+        if max(self._repetition_count * numerator, denominator) < 2**53:
+            # both operands are exactly representable so the division is correctly rounded like float(time)
+            return np.arange(self._repetition_count + 1, dtype=np.int64) * numerator / denominator
+        else:
+            return np.array([float(body_duration * repetition)
+                             for repetition in range(self._repetition_count + 1)])
+
     @property
     def compare_key(self) -> Tuple[Any, int]:
-        return self._body.compare_key, self._repetition_count
+        if self._compare_key is None:
+            self._compare_key = self._body.compare_key, self._repetition_count
+        return self._compare_key
 
     @property
     def duration(self) -> TimeType:
@@ -499,14 +809,24 @@ class RepetitionWaveform(Waveform):
 
 
 class TransformingWaveform(Waveform):
+    __slots__ = ('_inner_waveform', '_transformation', '_cache')
+
     def __init__(self, inner_waveform: Waveform, transformation: Transformation):
         """"""
         self._inner_waveform = inner_waveform
         self._transformation = transformation
 
-        # cache data of inner channels based identified and invalidated by the sample times
-        self._cached_data = None
-        self._cached_times = lambda: None
+        # (weak reference to the sample times, sampled data) is replaced as a whole so concurrent samplers with
+        # different sample times never write into the data of each other
+        self._cache = None  # type: Optional[Tuple[ref, Dict[ChannelID, np.ndarray]]]
+
+    def __getstate__(self):
+        # the sample cache holds a weak reference and is not pickled
+        return None, {'_inner_waveform': self._inner_waveform, '_transformation': self._transformation}
+
+    def __setstate__(self, state) -> None:
+        super().__setstate__(state)
+        self._cache = None
 
     @property
     def inner_waveform(self) -> Waveform:
@@ -535,11 +855,13 @@ class TransformingWaveform(Waveform):
                       channel: ChannelID,
                       sample_times: np.ndarray,
                       output_array: Union[np.ndarray, None] = None) -> np.ndarray:
-        if self._cached_times() is not sample_times:
-            self._cached_data = dict()
-            self._cached_times = ref(sample_times)
+        cache = self._cache
+        if cache is None or cache[0]() is not sample_times:
+            cache = (ref(sample_times), dict())
+            self._cache = cache
+        cached_data = cache[1]
 
-        if channel not in self._cached_data:
+        if channel not in cached_data:
 
             inner_channels = self.transformation.get_input_channels({channel})
 
@@ -547,17 +869,19 @@ class TransformingWaveform(Waveform):
                           for inner_channel in inner_channels}
 
             outer_data = self.transformation(sample_times, inner_data)
-            self._cached_data.update(outer_data)
+            cached_data.update(outer_data)
 
         if output_array is None:
-            output_array = self._cached_data[channel]
+            output_array = cached_data[channel]
         else:
-            output_array[:] = self._cached_data[channel]
+            output_array[:] = cached_data[channel]
 
         return output_array
 
 
 class SubsetWaveform(Waveform):
+    __slots__ = ('_inner_waveform', '_channel_subset')
+
     def __init__(self, inner_waveform: Waveform, channel_subset: Set[ChannelID]):
         self._inner_waveform = inner_waveform
         self._channel_subset = frozenset(channel_subset)
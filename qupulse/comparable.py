@@ -17,6 +17,8 @@ class Comparable(metaclass=DocStringABCMeta):
     operators based on comparison of this key.
     """
 
+    __slots__ = ()
+
     @property
     @abstractmethod
     def compare_key(self) -> Any:
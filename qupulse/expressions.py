@@ -2,19 +2,24 @@
 This module defines the class Expression to represent mathematical expression as well as
 corresponding exception classes.
 """
-from typing import Any, Dict, Union, Sequence, Callable, TypeVar, Type
+from typing import Any, Dict, Union, Sequence, Callable, TypeVar, Type, Mapping, Optional, Hashable
 from numbers import Number
 import warnings
 import functools
 import array
 import itertools
+import fractions
+import math
+import re
+import weakref
+from abc import ABCMeta, abstractmethod
 
 import sympy
 import numpy
 
 from qupulse.serialization import AnonymousSerializable
 from qupulse.utils.sympy import sympify, to_numpy, recursive_substitution, evaluate_lambdified,\
-    get_most_simple_representation, get_variables
+    get_most_simple_representation, get_variables, lambdify_cache
 
 __all__ = ["Expression", "ExpressionVariableMissingException", "ExpressionScalar", "ExpressionVector"]
 
@@ -22,20 +27,34 @@ __all__ = ["Expression", "ExpressionVariableMissingException", "ExpressionScalar
 _ExpressionType = TypeVar('_ExpressionType', bound='Expression')
 
 
-class _ExpressionMeta(type):
-    """Metaclass that forwards calls to Expression(...) to Expression.make(...) to make subclass objects"""
+class _ExpressionMeta(ABCMeta):
+    """Metaclass that forwards calls to Expression(...) to Expression.make(...) to make subclass objects and returns
+    interned instances for classes that define an intern key"""
     def __call__(cls: Type[_ExpressionType], *args, **kwargs) -> _ExpressionType:
         if cls is Expression:
             return cls.make(*args, **kwargs)
-        else:
+
+        key = cls._get_intern_key(*args, **kwargs)
+        if key is None:
             return type.__call__(cls, *args, **kwargs)
 
+        interned = cls._interned.get(key)
+        if interned is None:
+            interned = cls._interned.setdefault(key, type.__call__(cls, *args, **kwargs))
+        return interned
+
 
 class Expression(AnonymousSerializable, metaclass=_ExpressionMeta):
     """Base class for expressions."""
     def __init__(self, *args, **kwargs):
         self._expression_lambda = None
 
+    @classmethod
+    def _get_intern_key(cls, *args, **kwargs) -> Optional[Hashable]:
+        """Key under which the instance created from the arguments is interned in cls._interned. None disables
+        interning."""
+        return None
+
     def _parse_evaluate_numeric_arguments(self, eval_args: Dict[str, Number]) -> Dict[str, Number]:
         try:
             return {v: eval_args[v] for v in self.variables}
@@ -76,6 +95,41 @@ class Expression(AnonymousSerializable, metaclass=_ExpressionMeta):
 
         return self._parse_evaluate_numeric_result(result, kwargs)
 
+    def evaluate_numeric_batch(self,
+                               parameters: Mapping[str, Union[Sequence[Number], numpy.ndarray, Number]],
+                               batch_size: Optional[int]=None) -> numpy.ndarray:
+        """Evaluate the expression for many parameter sets with a single call of the compiled expression.
+
+        Args:
+            parameters: Maps each variable to a sequence with one value per parameter set. Scalar values are used for
+                all parameter sets.
+            batch_size: Number of parameter sets. Only required if no variable is given as a sequence.
+
+        Returns:
+            Array with the result for the i-th parameter set at index i of the first axis
+        """
+        columns = {name: numpy.asarray(value)
+                   for name, value in self._parse_evaluate_numeric_arguments(parameters).items()}
+
+        column_lengths = set(len(column) for column in columns.values() if column.ndim > 0)
+        if batch_size is not None:
+            column_lengths.add(batch_size)
+        if len(column_lengths) != 1:
+            raise ValueError('Cannot determine the number of parameter sets', column_lengths)
+        batch_size, = column_lengths
+
+        result = self._evaluate_batch_lambdified(columns)
+        return self._parse_evaluate_numeric_result(self._broadcast_batch_result(result, batch_size), parameters)
+
+    def _evaluate_batch_lambdified(self, columns: Dict[str, numpy.ndarray]) -> Any:
+        result, self._expression_lambda = evaluate_lambdified(self.underlying_expression, self.variables,
+                                                              columns, lambdified=self._expression_lambda)
+        return result
+
+    @abstractmethod
+    def _broadcast_batch_result(self, result: Any, batch_size: int) -> numpy.ndarray:
+        """Broadcast the result of the compiled expression to an array with batch_size entries in the first axis."""
+
     def __float__(self):
         if self.variables:
             return NotImplemented
@@ -141,8 +195,7 @@ class ExpressionVector(Expression):
     @property
     def expression_lambda(self) -> Callable:
         if self._expression_lambda is None:
-            expression_lambda = sympy.lambdify(self.variables, self.underlying_expression,
-                                                     [{'ceiling': ceiling}, 'numpy'])
+            expression_lambda = lambdify_cache.get_lambdified(self.underlying_expression, self.variables)
 
             @functools.wraps(expression_lambda)
             def expression_wrapper(*args, **kwargs):
@@ -171,6 +224,21 @@ class ExpressionVector(Expression):
 
         return self._parse_evaluate_numeric_result(numpy.array(result), kwargs)
 
+    def _evaluate_batch_lambdified(self, columns: Dict[str, numpy.ndarray]) -> Any:
+        # the instance lambda may be the reshaping wrapper of expression_lambda
+        return lambdify_cache.get_lambdified(self.underlying_expression, self.variables)(**columns)
+
+    def _broadcast_batch_result(self, result: Any, batch_size: int) -> numpy.ndarray:
+        def flatten(nested, depth):
+            if depth == 0:
+                return [nested]
+            return [element for sub_sequence in nested for element in flatten(sub_sequence, depth - 1)]
+
+        shape = self._expression_vector.shape
+        elements = [numpy.broadcast_to(element, (batch_size,))
+                    for element in flatten(result, len(shape))]
+        return numpy.stack(elements, axis=-1).reshape((batch_size,) + shape)
+
     def get_serialization_data(self) -> Sequence[str]:
         def nested_get_most_simple_representation(list_or_expression):
             if isinstance(list_or_expression, list):
@@ -203,11 +271,188 @@ class ExpressionVector(Expression):
         return self._expression_vector
 
 
+_AffineNumber = Union[int, float, fractions.Fraction]
+
+
+@functools.lru_cache(maxsize=None)
+def _is_plain_symbol_name(name: str) -> bool:
+    """True if sympify parses the name as a plain symbol and not as a sympy function or constant."""
+    try:
+        sympified = sympify(name)
+    except (TypeError, ValueError, SyntaxError, sympy.SympifyError):
+        return False
+    return type(sympified) is sympy.Symbol and sympified.name == name
+
+
+class _AffineForm:
+    """Lightweight representation of ``constant + sum(coefficient * symbol)`` that ExpressionScalar uses instead of a
+    sympy expression until a nonlinear operation requires sympy. Exact rationals are kept as fractions.Fraction to
+    reproduce sympy's number semantics. Arithmetic with floats is left to sympy because its float operations round
+    differently."""
+    __slots__ = ('constant', 'terms', '_is_evaluation_exact')
+
+    _integer_pattern = re.compile(r'0|[1-9][0-9]*')
+
+    def __init__(self, constant: _AffineNumber, terms: Dict[str, _AffineNumber]):
+        self.constant = constant
+        self.terms = terms
+        self._is_evaluation_exact = None
+
+    @classmethod
+    def from_number(cls, value: Any) -> Optional['_AffineForm']:
+        if isinstance(value, (bool, numpy.bool_)):
+            return None
+        elif isinstance(value, (int, numpy.integer)):
+            return cls(int(value), {})
+        elif isinstance(value, (float, numpy.floating)) and math.isfinite(value):
+            # sympy has no negative zero
+            return cls(float(value) if value != 0 else 0., {})
+        else:
+            return None
+
+    @classmethod
+    def from_input(cls, value: Any) -> Optional['_AffineForm']:
+        """Parse numbers, integer literals and plain symbol names. Everything else returns None."""
+        if isinstance(value, str):
+            if cls._integer_pattern.fullmatch(value):
+                return cls(int(value), {})
+            elif value.isidentifier() and _is_plain_symbol_name(value):
+                return cls(0, {value: 1})
+            else:
+                return None
+        return cls.from_number(value)
+
+    @staticmethod
+    def _normalize(value: _AffineNumber) -> _AffineNumber:
+        """Apply sympy's simplification of arithmetic results: integral rationals and (float) zeros are integers"""
+        if value == 0:
+            return 0
+        if isinstance(value, fractions.Fraction) and value.denominator == 1:
+            return int(value)
+        return value
+
+    @staticmethod
+    def _to_sympy_number(value: _AffineNumber) -> sympy.Number:
+        if isinstance(value, fractions.Fraction):
+            return sympy.Rational(value.numerator, value.denominator)
+        return sympy.sympify(value)
+
+    @property
+    def is_constant(self) -> bool:
+        return not self.terms
+
+    @property
+    def has_float(self) -> bool:
+        return isinstance(self.constant, float) or any(isinstance(coefficient, float)
+                                                       for coefficient in self.terms.values())
+
+    @property
+    def is_evaluation_exact(self) -> bool:
+        """True if evaluate returns the same numbers as the lambdified sympy expression. lambdify prints floats with 15
+        significant digits and adds more than two summands in sympy's term order."""
+        if self._is_evaluation_exact is None:
+            numbers = [self.constant, *self.terms.values()]
+            self._is_evaluation_exact = len(self.terms) + (self.constant != 0) <= 2 and \
+                all(not isinstance(number, float) or float('%.15g' % number) == number for number in numbers)
+        return self._is_evaluation_exact
+
+    def add(self, other: '_AffineForm') -> '_AffineForm':
+        terms = dict(self.terms)
+        for name, coefficient in other.terms.items():
+            coefficient = self._normalize(terms.get(name, 0) + coefficient)
+            if coefficient == 0:
+                terms.pop(name, None)
+            else:
+                terms[name] = coefficient
+        return _AffineForm(self._normalize(self.constant + other.constant), terms)
+
+    def scale(self, factor: _AffineNumber) -> '_AffineForm':
+        if factor == 0:
+            return _AffineForm(0, {})
+        terms = {name: self._normalize(coefficient * factor) for name, coefficient in self.terms.items()}
+        return _AffineForm(self._normalize(self.constant * factor), terms)
+
+    def mul(self, other: '_AffineForm') -> Optional['_AffineForm']:
+        if other.is_constant:
+            return self.scale(other.constant)
+        elif self.is_constant:
+            return other.scale(self.constant)
+        else:
+            return None
+
+    def truediv(self, other: '_AffineForm') -> Optional['_AffineForm']:
+        if not other.is_constant or other.constant == 0:
+            return None
+        if isinstance(other.constant, float):
+            return self.scale(1 / other.constant)
+        else:
+            return self.scale(fractions.Fraction(1) / other.constant)
+
+    def identical(self, other: '_AffineForm') -> Optional[bool]:
+        """Structural equality like sympy's. Returns None if the number types differ and sympy has to decide."""
+        if self.terms.keys() != other.terms.keys():
+            return False
+        pairs = [(self.constant, other.constant)]
+        pairs.extend((coefficient, other.terms[name]) for name, coefficient in self.terms.items())
+        if any(type(lhs) is not type(rhs) for lhs, rhs in pairs):
+            return None
+        return all(lhs == rhs for lhs, rhs in pairs)
+
+    def get_structure_key(self) -> tuple:
+        """Hashable key that distinguishes the number types like sympy's structural equality"""
+        return (type(self.constant), self.constant,
+                tuple(sorted((name, type(coefficient), coefficient) for name, coefficient in self.terms.items())))
+
+    def evaluate(self, arguments: Mapping[str, Any]) -> Any:
+        summands = []
+        for name, coefficient in self.terms.items():
+            value = arguments[name]
+            if coefficient == 1 and isinstance(coefficient, int):
+                summands.append(value)
+            else:
+                summands.append((float(coefficient) if isinstance(coefficient, fractions.Fraction) else coefficient)
+                                * value)
+
+        constant = float(self.constant) if isinstance(self.constant, fractions.Fraction) else self.constant
+        if self.constant != 0 or not summands:
+            summands.append(constant)
+
+        result = summands[0]
+        for summand in summands[1:]:
+            result = result + summand
+        return result
+
+    def to_sympy(self) -> sympy.Expr:
+        result = self._to_sympy_number(self.constant)
+        for name, coefficient in self.terms.items():
+            result = result + self._to_sympy_number(coefficient) * sympy.Symbol(name)
+        return result
+
+
 class ExpressionScalar(Expression):
     """A scalar mathematical expression instantiated from a string representation.
         TODO: update doc!
         TODO: write tests!
+
+        Instances are interned: Creating an expression from the same input (or the same sympy/affine structure) returns
+        the existing object as long as it is referenced somewhere.
         """
+    _interned = weakref.WeakValueDictionary()  # type: weakref.WeakValueDictionary
+
+    @classmethod
+    def _get_intern_key(cls, ex: Union[str, Number, sympy.Expr, '_AffineForm']) -> Optional[Hashable]:
+        # The original input is part of the key because repr and the serialization reproduce it
+        if isinstance(ex, _AffineForm):
+            key = (cls, _AffineForm, ex.get_structure_key())
+        elif isinstance(ex, float):
+            key = (cls, float, ex, math.copysign(1., ex))
+        else:
+            key = (cls, type(ex), ex)
+        try:
+            hash(key)
+        except TypeError:
+            return None
+        return key
 
     def __init__(self, ex: Union[str, Number, sympy.Expr]) -> None:
         """Create an Expression object.
@@ -216,29 +461,60 @@ class ExpressionScalar(Expression):
         which will be parsed using py_expression_eval. For available operators, functions and
         constants see SymPy documentation
 
+        Numbers, integer literals, single symbols and affine combinations of them are represented without sympy until
+        a nonlinear operation or the sympy expression itself is required.
+
         Args:
             ex (string): The mathematical expression represented as a string
         """
         super().__init__()
 
-        if isinstance(ex, sympy.Expr):
+        if isinstance(ex, _AffineForm):
+            self._original_expression = None
+            self._sympified_expression = None
+            self._affine = ex
+        elif isinstance(ex, sympy.Expr):
             self._original_expression = str(ex)
             self._sympified_expression = ex
+            self._affine = None
         else:
             self._original_expression = ex
-            self._sympified_expression = sympify(ex)
+            self._affine = _AffineForm.from_input(ex)
+            self._sympified_expression = None if self._affine is not None else sympify(ex)
 
-        self._variables = get_variables(self._sympified_expression)
+        if self._affine is None:
+            self._variables = get_variables(self._sympified_expression)
+        else:
+            self._variables = tuple(self._affine.terms)
+        self._hash = None
 
     @property
     def underlying_expression(self) -> sympy.Expr:
-        return self._sympified_expression
+        return self.sympified_expression
+
+    def evaluate_numeric(self, **kwargs) -> Union[Number, numpy.ndarray]:
+        if self._affine is None or not self._affine.is_evaluation_exact:
+            return super().evaluate_numeric(**kwargs)
+        parsed_kwargs = self._parse_evaluate_numeric_arguments(kwargs)
+        return self._parse_evaluate_numeric_result(self._affine.evaluate(parsed_kwargs), kwargs)
+
+    def _evaluate_batch_lambdified(self, columns: Dict[str, numpy.ndarray]) -> Any:
+        if self._affine is None or not self._affine.is_evaluation_exact:
+            return super()._evaluate_batch_lambdified(columns)
+        return self._affine.evaluate(columns)
+
+    def _broadcast_batch_result(self, result: Any, batch_size: int) -> numpy.ndarray:
+        return numpy.array(numpy.broadcast_to(result, (batch_size,)))
 
     def __str__(self) -> str:
-        return str(self._sympified_expression)
+        if self._affine is not None and self._affine.constant == 0 and len(self._affine.terms) == 1:
+            (name, coefficient), = self._affine.terms.items()
+            if coefficient == 1 and isinstance(coefficient, int):
+                return name
+        return str(self.sympified_expression)
 
     def __repr__(self) -> str:
-        return 'Expression({})'.format(repr(self._original_expression))
+        return 'Expression({})'.format(repr(self.original_expression))
 
     @property
     def variables(self) -> Sequence[str]:
@@ -246,74 +522,156 @@ class ExpressionScalar(Expression):
 
     @classmethod
     def _sympify(cls, other: Union['ExpressionScalar', Number, sympy.Expr]) -> sympy.Expr:
-        return other._sympified_expression if isinstance(other, cls) else sympify(other)
+        return other.sympified_expression if isinstance(other, cls) else sympify(other)
+
+    @classmethod
+    def _get_affine(cls, other: Union['ExpressionScalar', Number, sympy.Expr]) -> Optional[_AffineForm]:
+        return other._affine if isinstance(other, cls) else _AffineForm.from_number(other)
+
+    def _compare_constants(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> Optional[tuple]:
+        affine = self._affine
+        if affine is None or affine.terms:
+            return None
+        other_affine = other._affine if isinstance(other, ExpressionScalar) else _AffineForm.from_number(other)
+        if other_affine is None or other_affine.terms:
+            return None
+        return affine.constant, other_affine.constant
 
     def __lt__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> Union[bool, None]:
-        result = self._sympified_expression < self._sympify(other)
+        constants = self._compare_constants(other)
+        if constants is not None:
+            return constants[0] < constants[1]
+        result = self.sympified_expression < self._sympify(other)
         return None if isinstance(result, sympy.Rel) else bool(result)
 
     def __gt__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> Union[bool, None]:
-        result = self._sympified_expression > self._sympify(other)
+        constants = self._compare_constants(other)
+        if constants is not None:
+            return constants[0] > constants[1]
+        result = self.sympified_expression > self._sympify(other)
         return None if isinstance(result, sympy.Rel) else bool(result)
 
     def __ge__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> Union[bool, None]:
-        result = self._sympified_expression >= self._sympify(other)
+        constants = self._compare_constants(other)
+        if constants is not None:
+            return constants[0] >= constants[1]
+        result = self.sympified_expression >= self._sympify(other)
         return None if isinstance(result, sympy.Rel) else bool(result)
 
     def __le__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> Union[bool, None]:
-        result = self._sympified_expression <= self._sympify(other)
+        constants = self._compare_constants(other)
+        if constants is not None:
+            return constants[0] <= constants[1]
+        result = self.sympified_expression <= self._sympify(other)
         return None if isinstance(result, sympy.Rel) else bool(result)
 
     def __eq__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> bool:
         """Enable comparisons with Numbers"""
-        return self._sympified_expression == self._sympify(other)
+        if self is other:
+            return True
+        constants = self._compare_constants(other)
+        if constants is not None:
+            return constants[0] == constants[1]
+        other_affine = self._get_affine(other)
+        if self._affine is not None and other_affine is not None:
+            identical = self._affine.identical(other_affine)
+            if identical is not None:
+                return identical
+        return self.sympified_expression == self._sympify(other)
 
     def __hash__(self) -> int:
-        return hash(self._sympified_expression)
+        if self._hash is None:
+            self._hash = hash(self.sympified_expression)
+        return self._hash
+
+    def __getstate__(self) -> Dict[str, Any]:
+        state = self.__dict__.copy()
+        # sympy hashes depend on the string hash seed of the interpreter session
+        state['_hash'] = None
+        return state
+
+    def _affine_operation(self, operation: str, lhs: Optional[_AffineForm],
+                          rhs: Optional[_AffineForm]) -> Optional['ExpressionScalar']:
+        if lhs is None or rhs is None or lhs.has_float or rhs.has_float:
+            return None
+        if operation == 'add':
+            result = lhs.add(rhs)
+        elif operation == 'sub':
+            result = lhs.add(rhs.scale(-1))
+        elif operation == 'mul':
+            result = lhs.mul(rhs)
+        else:
+            result = lhs.truediv(rhs)
+        return None if result is None else ExpressionScalar(result)
 
     def __add__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__add__(self._sympify(other)))
+        return self._affine_operation('add', self._affine, self._get_affine(other)) or \
+               self.make(self.sympified_expression.__add__(self._sympify(other)))
 
     def __radd__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympify(other).__radd__(self._sympified_expression))
+        return self._affine_operation('add', self._get_affine(other), self._affine) or \
+               self.make(self._sympify(other).__radd__(self.sympified_expression))
 
     def __sub__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__sub__(self._sympify(other)))
+        return self._affine_operation('sub', self._affine, self._get_affine(other)) or \
+               self.make(self.sympified_expression.__sub__(self._sympify(other)))
 
     def __rsub__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__rsub__(self._sympify(other)))
+        return self._affine_operation('sub', self._get_affine(other), self._affine) or \
+               self.make(self.sympified_expression.__rsub__(self._sympify(other)))
 
     def __mul__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__mul__(self._sympify(other)))
+        return self._affine_operation('mul', self._affine, self._get_affine(other)) or \
+               self.make(self.sympified_expression.__mul__(self._sympify(other)))
 
     def __rmul__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__rmul__(self._sympify(other)))
+        return self._affine_operation('mul', self._get_affine(other), self._affine) or \
+               self.make(self.sympified_expression.__rmul__(self._sympify(other)))
 
     def __truediv__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__truediv__(self._sympify(other)))
+        return self._affine_operation('truediv', self._affine, self._get_affine(other)) or \
+               self.make(self.sympified_expression.__truediv__(self._sympify(other)))
 
     def __rtruediv__(self, other: Union['ExpressionScalar', Number, sympy.Expr]) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__rtruediv__(self._sympify(other)))
+        return self._affine_operation('truediv', self._get_affine(other), self._affine) or \
+               self.make(self.sympified_expression.__rtruediv__(self._sympify(other)))
 
     def __neg__(self) -> 'ExpressionScalar':
-        return self.make(self._sympified_expression.__neg__())
+        if self._affine is not None and not self._affine.has_float:
+            return ExpressionScalar(self._affine.scale(-1))
+        return self.make(self.sympified_expression.__neg__())
 
     @property
     def original_expression(self) -> Union[str, Number]:
+        if self._original_expression is None:
+            self._original_expression = str(self.sympified_expression)
         return self._original_expression
 
     @property
     def sympified_expression(self) -> sympy.Expr:
+        if self._sympified_expression is None:
+            if self._original_expression is None:
+                self._sympified_expression = self._affine.to_sympy()
+            else:
+                self._sympified_expression = sympify(self._original_expression)
         return self._sympified_expression
 
     def get_serialization_data(self) -> Union[str, float, int]:
-        serialized = get_most_simple_representation(self._sympified_expression)
+        if self._affine is not None and self._affine.is_constant \
+                and not isinstance(self._affine.constant, fractions.Fraction):
+            return self._affine.constant
+        elif self._affine is not None and self._original_expression is not None and not self._affine.is_constant:
+            return self._original_expression
+        serialized = get_most_simple_representation(self.sympified_expression)
         if isinstance(serialized, str):
             return self.original_expression
         else:
             return serialized
 
     def is_nan(self) -> bool:
+        if self._affine is not None:
+            # only finite numbers are represented without sympy
+            return False
         return sympy.sympify('nan') == self._sympified_expression
 
 
@@ -1,10 +1,19 @@
 import fractions
 import sys
+import os
+import re
+import json
+import warnings
+import hashlib
+import bisect
 import functools
+import concurrent.futures
 import weakref
 import itertools
 import operator
+import time
 from typing import List, Tuple, Set, NamedTuple, Callable, Optional, Any, Sequence, cast, Generator, Union, Dict
+from contextlib import contextmanager
 from enum import Enum
 from collections import OrderedDict
 
@@ -17,7 +26,8 @@ import numpy as np
 from qupulse.utils.types import ChannelID
 from qupulse.pulses.multi_channel_pulse_template import MultiChannelWaveform
 from qupulse._program._loop import Loop, make_compatible
-from qupulse.hardware.util import voltage_to_uint16, make_combined_wave, find_positions
+from qupulse._program.waveforms import Waveform
+from qupulse.hardware.util import voltage_to_uint16, make_combined_wave
 from qupulse.hardware.awgs.base import AWG
 
 
@@ -28,9 +38,12 @@ __all__ = ['TaborAWGRepresentation', 'TaborChannelPair']
 
 
 class TaborSegment:
-    """Represents one segment of two channels on the device. Convenience class."""
+    """Represents one segment of two channels on the device. Convenience class.
 
-    __slots__ = ('ch_a', 'ch_b', 'marker_a', 'marker_b')
+    The segment data must not be modified after construction because the content digest is computed once in the
+    constructor."""
+
+    __slots__ = ('ch_a', 'ch_b', 'marker_a', 'marker_b', '_digest')
 
     def __init__(self,
                  ch_a: Optional[np.ndarray],
@@ -53,6 +66,33 @@ class TaborSegment:
         if marker_b is not None and len(marker_b)*2 != self.num_points:
             raise TaborException('Marker A has to have half of the channels length')
 
+        self._digest = self._calculate_digest()
+
+    def _calculate_digest(self) -> bytes:
+        """Missing markers are hashed like all zero markers because they compare equal."""
+        digest = hashlib.blake2b(digest_size=16)
+        for channel_data in (self.ch_a, self.ch_b):
+            if channel_data is None:
+                digest.update(b'\x00')
+            else:
+                digest.update(b'\x01')
+                digest.update(channel_data.tobytes())
+
+        no_marker = None
+        for marker_data in (self.marker_a, self.marker_b):
+            if marker_data is None:
+                if no_marker is None:
+                    no_marker = np.zeros(self.num_points // 2, dtype=bool).tobytes()
+                digest.update(no_marker)
+            else:
+                digest.update(marker_data.tobytes())
+        return digest.digest()
+
+    @property
+    def digest(self) -> bytes:
+        """128 bit blake2b digest of the segment content. It does not depend on the python process."""
+        return self._digest
+
     @classmethod
     def from_binary_segment(cls, segment_data: np.ndarray) -> 'TaborSegment':
         data_a = segment_data.reshape((-1, 16))[1::2, :].reshape((-1, ))
@@ -79,8 +119,7 @@ class TaborSegment:
                    marker_b=marker_b)
 
     def __hash__(self) -> int:
-        return hash(tuple(0 if data is None else bytes(data)
-                          for data in (self.ch_a, self.ch_b, self.marker_a, self.marker_b)))
+        return int.from_bytes(self._digest[:8], byteorder='little', signed=True)
 
     def __eq__(self, other: 'TaborSegment'):
         def compare_markers(marker_1, marker_2):
@@ -135,6 +174,107 @@ class TaborSegment:
         return make_combined_wave([self])
 
 
+def _sample_segment(waveform: MultiChannelWaveform,
+                    sample_rate: float,
+                    channels: Tuple[Optional[ChannelID], Optional[ChannelID]],
+                    markers: Tuple[Optional[ChannelID], Optional[ChannelID]],
+                    voltage_amplitude: Tuple[float, float],
+                    voltage_offset: Tuple[float, float],
+                    voltage_transformation: Tuple[Callable, Callable]) -> TaborSegment:
+    """Sample and quantize a single waveform. This is a module level function so it can be sent to worker
+    processes."""
+    time = np.arange(int(waveform.duration*sample_rate)) / sample_rate
+    # both markers are sampled at the same array so waveforms that cache by sample times can reuse the data
+    marker_time = time[::2]
+
+    def voltage_to_data(channel):
+        if channels[channel]:
+            return voltage_to_uint16(
+                voltage_transformation[channel](
+                    waveform.get_sampled(channel=channels[channel],
+                                         sample_times=time)),
+                voltage_amplitude[channel],
+                voltage_offset[channel],
+                resolution=14)
+        else:
+            return np.full_like(time, 8192, dtype=np.uint16)
+
+    def get_marker_data(marker):
+        if markers[marker]:
+            return waveform.get_sampled(channel=markers[marker], sample_times=marker_time) != 0
+        else:
+            return np.full_like(marker_time, False, dtype=bool)
+
+    segment_a = voltage_to_data(0)
+    segment_b = voltage_to_data(1)
+    assert (len(segment_a) == len(time))
+    assert (len(segment_b) == len(time))
+    marker_a = get_marker_data(0)
+    marker_b = get_marker_data(1)
+    return TaborSegment(ch_a=segment_a,
+                        ch_b=segment_b,
+                        marker_a=marker_a,
+                        marker_b=marker_b)
+
+
+def _timed_call(function: Callable, *args) -> Tuple[Any, float]:
+    """Call function and return the result together with the elapsed time in seconds."""
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+class _FreeSegmentIndex:
+    """Free segment slots sorted by capacity. Finding the best fitting slot is a binary search."""
+
+    def __init__(self, segment_capacity: np.ndarray, free_slots: Sequence[int]):
+        free_slots = np.asarray(free_slots, dtype=np.int64)
+        self._entries = sorted(zip(np.asarray(segment_capacity)[free_slots].tolist(), free_slots.tolist()))
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def pop_best_fit(self, length: int) -> Optional[int]:
+        """Remove and return the smallest slot with a capacity of at least length. Ties are broken by the lower slot
+        index. Returns None if no slot is large enough."""
+        position = bisect.bisect_left(self._entries, (int(length), -1))
+        if position == len(self._entries):
+            return None
+        return self._entries.pop(position)[1]
+
+    def remove(self, capacity: int, slot: int) -> None:
+        entry = (int(capacity), int(slot))
+        position = bisect.bisect_left(self._entries, entry)
+        if position == len(self._entries) or self._entries[position] != entry:
+            raise KeyError(slot)
+        del self._entries[position]
+
+    def add(self, capacity: int, slot: int) -> None:
+        bisect.insort(self._entries, (int(capacity), int(slot)))
+
+
+class _WaveformIndex:
+    """Assigns consecutive indices to distinct waveforms. Waveforms that were seen before are found by identity, so
+    waveforms shared by make_compatible are not hashed and compared again."""
+
+    def __init__(self):
+        self._indices = OrderedDict()  # type: Dict[Waveform, int]
+        # keeps the waveforms alive so their ids stay unique
+        self._indices_by_id = dict()  # type: Dict[int, Tuple[Waveform, int]]
+
+    def get_index(self, waveform: Waveform) -> int:
+        known = self._indices_by_id.get(id(waveform), None)
+        if known is None:
+            index = self._indices.setdefault(waveform, len(self._indices))
+            self._indices_by_id[id(waveform)] = (waveform, index)
+            return index
+        return known[1]
+
+    @property
+    def waveforms(self) -> Tuple[Waveform, ...]:
+        return tuple(self._indices.keys())
+
+
 class TaborSequencing(Enum):
     SINGLE = 1
     ADVANCED = 2
@@ -185,12 +325,17 @@ class TaborProgram:
     def channels(self) -> Tuple[Optional[ChannelID], Optional[ChannelID]]:
         return self._channels
 
-    def sampled_segments(self,
-                         sample_rate: fractions.Fraction,
-                         voltage_amplitude: Tuple[float, float],
-                         voltage_offset: Tuple[float, float],
-                         voltage_transformation: Tuple[Callable, Callable]) -> Tuple[Sequence[TaborSegment],
-                                                                                     Sequence[int]]:
+    @property
+    def waveforms(self) -> Sequence[MultiChannelWaveform]:
+        """Unique waveforms of the program. The sequencer tables refer to them by index."""
+        return self._waveforms
+
+    def get_segment_lengths(self, sample_rate: fractions.Fraction) -> np.ndarray:
+        """Lengths of the segments in waveform order at the given sample rate in samples per second.
+
+        Raises:
+            TaborException: If a segment length is no integer, smaller 192 or not a multiple of 16
+        """
         sample_rate = fractions.Fraction(sample_rate, 10**9)
 
         segment_lengths = [waveform.duration*sample_rate for waveform in self._waveforms]
@@ -201,61 +346,69 @@ class TaborProgram:
 
         if np.any(segment_lengths % 16 > 0) or np.any(segment_lengths < 192):
             raise TaborException('At least one waveform has a length that is smaller 192 or not a multiple of 16')
-        sample_rate = float(sample_rate)
-        time_array = np.arange(np.max(segment_lengths)) / sample_rate
-
-        def voltage_to_data(waveform, time, channel):
-            if self._channels[channel]:
-                return voltage_to_uint16(
-                    voltage_transformation[channel](
-                        waveform.get_sampled(channel=self._channels[channel],
-                                             sample_times=time)),
-                    voltage_amplitude[channel],
-                    voltage_offset[channel],
-                    resolution=14)
-            else:
-                return np.full_like(time, 8192, dtype=np.uint16)
+        return segment_lengths
+
+    def _get_segment_sampler(self,
+                             sample_rate: fractions.Fraction,
+                             voltage_amplitude: Tuple[float, float],
+                             voltage_offset: Tuple[float, float],
+                             voltage_transformation: Tuple[Callable, Callable]) -> Callable[[Any], TaborSegment]:
+        """Picklable callable that converts one of the program's waveforms into a TaborSegment."""
+        return functools.partial(_sample_segment,
+                                 sample_rate=float(fractions.Fraction(sample_rate, 10**9)),
+                                 channels=self._channels,
+                                 markers=self._markers,
+                                 voltage_amplitude=voltage_amplitude,
+                                 voltage_offset=voltage_offset,
+                                 voltage_transformation=voltage_transformation)
 
-        def get_marker_data(waveform: MultiChannelWaveform, time, marker):
-            if self._markers[marker]:
-                markerID = self._markers[marker]
-                return waveform.get_sampled(channel=markerID, sample_times=time) != 0
-            else:
-                return np.full_like(time, False, dtype=bool)
+    def sampled_segments(self,
+                         sample_rate: fractions.Fraction,
+                         voltage_amplitude: Tuple[float, float],
+                         voltage_offset: Tuple[float, float],
+                         voltage_transformation: Tuple[Callable, Callable],
+                         executor: Optional[concurrent.futures.Executor]=None) -> Tuple[Sequence[TaborSegment],
+                                                                                        Sequence[int]]:
+        """Sample and quantize all waveforms of the program.
+
+        Args:
+            sample_rate: Sample rate in samples per second
+            voltage_amplitude: Half of the peak to peak output range of both channels
+            voltage_offset: Output offset of both channels
+            voltage_transformation: Transformations applied to the sampled voltages before quantization
+            executor: If given, the segments are sampled concurrently by this executor. A process pool requires
+                waveforms and voltage transformations to be picklable. The segment order does not depend on the
+                executor.
+
+        Returns:
+            The segments in waveform order and their lengths
+        """
+        segment_lengths = self.get_segment_lengths(sample_rate)
+        sample_segment = self._get_segment_sampler(sample_rate, voltage_amplitude, voltage_offset,
+                                                   voltage_transformation)
 
         segments = np.empty_like(self._waveforms, dtype=TaborSegment)
-        for i, waveform in enumerate(self._waveforms):
-            t = time_array[:int(waveform.duration*sample_rate)]
-            marker_time = t[::2]
-            segment_a = voltage_to_data(waveform, t, 0)
-            segment_b = voltage_to_data(waveform, t, 1)
-            assert (len(segment_a) == len(t))
-            assert (len(segment_b) == len(t))
-            marker_a = get_marker_data(waveform, marker_time, 0)
-            marker_b = get_marker_data(waveform, marker_time, 1)
-            segments[i] = TaborSegment(ch_a=segment_a,
-                                       ch_b=segment_b,
-                                       marker_a=marker_a,
-                                       marker_b=marker_b)
+        if executor is None:
+            sampled = map(sample_segment, self._waveforms)
+        else:
+            # map returns the results in submission order
+            sampled = executor.map(sample_segment, self._waveforms)
+        for i, segment in enumerate(sampled):
+            segments[i] = segment
         return segments, segment_lengths
 
     def setup_single_sequence_mode(self) -> None:
         assert self.program.depth() == 1
 
         sequencer_table = []
-        waveforms = OrderedDict()
+        waveforms = _WaveformIndex()
 
         for waveform, repetition_count in ((waveform_loop.waveform.get_subset_for_channels(self.__used_channels),
                                             waveform_loop.repetition_count)
                                            for waveform_loop in self.program):
-            if waveform in waveforms:
-                waveform_index = waveforms[waveform]
-            else:
-                waveform_index = len(waveforms)
-                waveforms[waveform] = waveform_index
-            sequencer_table.append((repetition_count, waveform_index, 0))
+            sequencer_table.append((repetition_count, waveforms.get_index(waveform), 0))
 
-        self._waveforms = tuple(waveforms.keys())
+        self._waveforms = waveforms.waveforms
         self._sequencer_tables = [sequencer_table]
         self._advanced_sequencer_table = [(self.program.repetition_count, 1, 0)]
 
@@ -332,18 +485,13 @@ class TaborProgram:
 
         advanced_sequencer_table = []
         sequencer_tables = []
-        waveforms = OrderedDict()
+        waveforms = _WaveformIndex()
         for sequencer_table_loop in self.program:
             current_sequencer_table = []
             for waveform, repetition_count in ((waveform_loop.waveform.get_subset_for_channels(self.__used_channels),
                                                 waveform_loop.repetition_count)
                                                for waveform_loop in sequencer_table_loop):
-                if waveform in waveforms:
-                    wf_index = waveforms[waveform]
-                else:
-                    wf_index = len(waveforms)
-                    waveforms[waveform] = wf_index
-                current_sequencer_table.append((repetition_count, wf_index, 0))
+                current_sequencer_table.append((repetition_count, waveforms.get_index(waveform), 0))
 
             if current_sequencer_table in sequencer_tables:
                 sequence_no = sequencer_tables.index(current_sequencer_table) + 1
@@ -355,7 +503,7 @@ class TaborProgram:
 
         self._advanced_sequencer_table = advanced_sequencer_table
         self._sequencer_tables = sequencer_tables
-        self._waveforms = tuple(waveforms.keys())
+        self._waveforms = waveforms.waveforms
 
     @property
     def program(self) -> Loop:
@@ -373,18 +521,57 @@ class TaborProgram:
         return self.__waveform_mode
 
 
+class _RestoredTaborProgram:
+    """Sequencing information of a program that was restored from a memory snapshot. It provides the part of the
+    TaborProgram interface that is required to arm the program. The original Loop is not stored."""
+
+    def __init__(self,
+                 sequencer_tables: List[List[Tuple[int, int, int]]],
+                 advanced_sequencer_table: List[Tuple[int, int, int]],
+                 waveform_mode: TaborSequencing):
+        self._sequencer_tables = sequencer_tables
+        self._advanced_sequencer_table = advanced_sequencer_table
+        self._waveform_mode = waveform_mode
+
+    def get_sequencer_tables(self) -> List[List[Tuple[int, int, int]]]:
+        return self._sequencer_tables
+
+    def get_advanced_sequencer_table(self) -> List[Tuple[int, int, int]]:
+        return self._advanced_sequencer_table
+
+    @property
+    def waveform_mode(self) -> TaborSequencing:
+        return self._waveform_mode
+
+
 class TaborAWGRepresentation:
-    def __init__(self, instr_addr=None, paranoia_level=1, external_trigger=False, reset=False, mirror_addresses=()):
+    max_batch_commands = 10
+
+    def __init__(self, instr_addr=None, paranoia_level=1, external_trigger=False, reset=False, mirror_addresses=(),
+                 memory_snapshot_directory=None, read_back_segments=4):
         """
         :param instr_addr:        Instrument address that is forwarded to teawag
         :param paranoia_level:    Paranoia level that is forwarded to teawg
         :param external_trigger:  Not supported yet
         :param reset:
         :param mirror_addresses:
+        :param memory_snapshot_directory: Directory in which the channel pairs keep their memory snapshots. The
+                                  device memory is restored from existing snapshots instead of being cleared if reset
+                                  is False.
+        :param read_back_segments: Number of segments that are read back from the device to verify a snapshot. None
+                                  reads back all segments. 0 trusts the snapshot without checking the device which
+                                  plays wrong waveforms if the device memory was changed by someone else.
         """
         self._instr = teawg.TEWXAwg(instr_addr, paranoia_level)
         self._mirrors = tuple(teawg.TEWXAwg(address, paranoia_level) for address in mirror_addresses)
 
+        # mirrors are driven concurrently by this executor which is created on first use
+        self._mirror_executor = None  # type: Optional[concurrent.futures.ThreadPoolExecutor]
+
+        # commands queued by command_batch
+        self._command_batch_depth = 0
+        self._command_queue = []  # type: List[Tuple[str, Optional[int]]]
+
         self._clock_marker = [0, 0, 0, 0]
 
         if external_trigger:
@@ -395,8 +582,18 @@ class TaborAWGRepresentation:
 
         self.initialize()
 
-        self._channel_pair_AB = TaborChannelPair(self, (1, 2), str(instr_addr) + '_AB')
-        self._channel_pair_CD = TaborChannelPair(self, (3, 4), str(instr_addr) + '_CD')
+        channel_pairs = []
+        for channels, identifier in (((1, 2), str(instr_addr) + '_AB'), ((3, 4), str(instr_addr) + '_CD')):
+            if memory_snapshot_directory is None:
+                memory_snapshot = None
+            else:
+                memory_snapshot = os.path.join(memory_snapshot_directory,
+                                               re.sub(r'[^\w\-]', '_', identifier) + '.json')
+            channel_pairs.append(TaborChannelPair(self, channels, identifier,
+                                                  memory_snapshot=memory_snapshot,
+                                                  restore_memory=not reset,
+                                                  read_back_segments=read_back_segments))
+        self._channel_pair_AB, self._channel_pair_CD = channel_pairs
 
     @property
     def channel_pair_AB(self) -> 'TaborChannelPair':
@@ -431,31 +628,97 @@ class TaborAWGRepresentation:
     def all_devices(self) -> Sequence[teawg.TEWXAwg]:
         return (self._instr, ) + self._mirrors
 
+    def __del__(self):
+        mirror_executor = getattr(self, '_mirror_executor', None)
+        if mirror_executor is not None:
+            mirror_executor.shutdown(wait=False)
+
+    def _call_on_all_devices(self, method_name: str, *args, **kwargs) -> Tuple:
+        """Call the method on the main instrument and all mirrors. The mirrors are driven concurrently. Exceptions are
+        raised after all devices finished."""
+        if not self._mirrors:
+            return getattr(self._instr, method_name)(*args, **kwargs),
+
+        if self._mirror_executor is None:
+            self._mirror_executor = concurrent.futures.ThreadPoolExecutor(max_workers=len(self.all_devices))
+        futures = [self._mirror_executor.submit(getattr(instr, method_name), *args, **kwargs)
+                   for instr in self.all_devices]
+        concurrent.futures.wait(futures)
+        return tuple(future.result() for future in futures)
+
+    @contextmanager
+    def command_batch(self) -> Generator[None, None, None]:
+        """Queue the commands sent via send_cmd in this context and send them in combined writes of at most
+        max_batch_commands commands. Only the last write is checked according to the paranoia level. Queries, binary
+        transfers and table downloads flush the queue first to keep the order. Batches can be nested."""
+        self._command_batch_depth += 1
+        try:
+            yield
+        except BaseException as exception:
+            self._command_batch_depth -= 1
+            if self._command_batch_depth == 0:
+                # the queued commands may restore the device state (e.g. leave the configuration mode) so they are
+                # sent anyway. A device error is chained to the original exception instead of replacing it
+                try:
+                    self.flush_commands()
+                except Exception as flush_exception:
+                    raise exception from flush_exception
+            raise
+        else:
+            self._command_batch_depth -= 1
+            if self._command_batch_depth == 0:
+                self.flush_commands()
+
+    def flush_commands(self) -> None:
+        """Send the commands queued by command_batch. Device errors are raised according to the paranoia level."""
+        if not self._command_queue:
+            return
+        commands, self._command_queue = self._command_queue, []
+
+        explicit_levels = [paranoia_level for _, paranoia_level in commands if paranoia_level is not None]
+        final_paranoia_level = max(explicit_levels) if explicit_levels else None
+
+        # the device resolves relative commands against the previous command of a combined write
+        commands = [(cmd_str if cmd_str.startswith((':', '*')) else ':' + cmd_str, paranoia_level)
+                    for cmd_str, paranoia_level in commands]
+
+        chunks = [commands[chunk_start:chunk_start + self.max_batch_commands]
+                  for chunk_start in range(0, len(commands), self.max_batch_commands)]
+        for chunk_idx, chunk in enumerate(chunks):
+            # errors accumulate in the error queue of the device so checking the last write is sufficient
+            paranoia_level = final_paranoia_level if chunk_idx == len(chunks) - 1 else 0
+            self._call_on_all_devices('send_cmd',
+                                      cmd_str='; '.join(cmd_str for cmd_str, _ in chunk),
+                                      paranoia_level=paranoia_level)
+
     def send_cmd(self, cmd_str, paranoia_level=None):
-        for instr in self.all_devices:
-            instr.send_cmd(cmd_str=cmd_str, paranoia_level=paranoia_level)
+        if self._command_batch_depth:
+            self._command_queue.append((cmd_str, paranoia_level))
+        else:
+            self._call_on_all_devices('send_cmd', cmd_str=cmd_str, paranoia_level=paranoia_level)
 
     def send_query(self, query_str, query_mirrors=False) -> Any:
+        self.flush_commands()
         if query_mirrors:
-            return tuple(instr.send_query(query_str) for instr in self.all_devices)
+            return self._call_on_all_devices('send_query', query_str)
         else:
             return self._instr.send_query(query_str)
 
     def send_binary_data(self, pref, bin_dat, paranoia_level=None):
-        for instr in self.all_devices:
-            instr.send_binary_data(pref, bin_dat=bin_dat, paranoia_level=paranoia_level)
+        self.flush_commands()
+        self._call_on_all_devices('send_binary_data', pref, bin_dat=bin_dat, paranoia_level=paranoia_level)
 
     def download_segment_lengths(self, seg_len_list, pref=':SEGM:DATA', paranoia_level=None):
-        for instr in self.all_devices:
-            instr.download_segment_lengths(seg_len_list, pref=pref, paranoia_level=paranoia_level)
+        self.flush_commands()
+        self._call_on_all_devices('download_segment_lengths', seg_len_list, pref=pref, paranoia_level=paranoia_level)
 
     def download_sequencer_table(self, seq_table, pref=':SEQ:DATA', paranoia_level=None):
-        for instr in self.all_devices:
-            instr.download_sequencer_table(seq_table, pref=pref, paranoia_level=paranoia_level)
+        self.flush_commands()
+        self._call_on_all_devices('download_sequencer_table', seq_table, pref=pref, paranoia_level=paranoia_level)
 
     def download_adv_seq_table(self, seq_table, pref=':ASEQ:DATA', paranoia_level=None):
-        for instr in self.all_devices:
-            instr.download_adv_seq_table(seq_table, pref=pref, paranoia_level=paranoia_level)
+        self.flush_commands()
+        self._call_on_all_devices('download_adv_seq_table', seq_table, pref=pref, paranoia_level=paranoia_level)
 
     make_combined_wave = staticmethod(teawg.TEWXAwg.make_combined_wave)
 
@@ -600,6 +863,7 @@ class TaborAWGRepresentation:
         self.send_cmd(':TRIG')
 
     def get_readable_device(self, simulator=True) -> teawg.TEWXAwg:
+        self.flush_commands()
         for device in self.all_devices:
             if device.fw_ver >= 3.0:
                 if simulator:
@@ -614,6 +878,88 @@ TaborProgramMemory = NamedTuple('TaborProgramMemory', [('waveform_to_segment', n
                                                        ('program', TaborProgram)])
 
 
+UploadTimings = NamedTuple('UploadTimings', [('sampling', float),
+                                             ('sampling_wait', float),
+                                             ('placement', float),
+                                             ('transfer', float),
+                                             ('total', float)])
+UploadTimings.__doc__ = """Durations in seconds of the stages of a streaming upload. sampling is the summed time the
+workers spent sampling and sampling_wait the wall clock time the upload was blocked waiting for sampled segments. The
+latter includes the worker start-up and is not bounded by sampling. The stages overlap so their sum can exceed total."""
+
+
+CompactionPlan = NamedTuple('CompactionPlan', [('moves', List[Tuple[int, int]]),
+                                               ('repack_start', Optional[int]),
+                                               ('transferred_points', int),
+                                               ('free_points_at_end', int)])
+CompactionPlan.__doc__ = """Segment relocations that reduce the fragmentation of the segment memory. moves are
+(source, target) segment index pairs that are executed in order. Each copies the last segment into an unused slot in
+front of it. If repack_start is not None all referenced segments from this index on are rewritten contiguously instead.
+free_points_at_end is the contiguous free memory behind the last segment after the compaction."""
+
+
+def plan_compaction(segment_capacity: np.ndarray,
+                    segment_lengths: np.ndarray,
+                    segment_references: np.ndarray,
+                    total_capacity: int,
+                    required_points: Optional[int]=None) -> CompactionPlan:
+    """Plan the segment transfers that free at least required_points at the end of the memory. Moving the trailing
+    segments into unused slots is preferred because each move only transfers one segment. If this is not sufficient
+    all segments behind the first gap are rewritten contiguously.
+
+    Args:
+        segment_capacity: Capacity of each segment slot
+        segment_lengths: Length of the segment stored in each slot
+        segment_references: Reference count of each slot. Unreferenced slots are free.
+        total_capacity: Size of the segment memory
+        required_points: Contiguous free points required at the end. None removes all gaps.
+
+    Returns:
+        The plan. Its free_points_at_end is smaller than required_points if the memory is too small.
+    """
+    capacity = np.asarray(segment_capacity, dtype=np.int64)
+    lengths = np.asarray(segment_lengths, dtype=np.int64)
+    reserved = np.asarray(segment_references) > 0
+
+    def end_of(reserved_mask) -> int:
+        reserved_indices = np.flatnonzero(reserved_mask)
+        return int(reserved_indices[-1]) + 1 if len(reserved_indices) else 0
+
+    compact_free_points = total_capacity - int(np.sum(lengths[reserved]))
+    if required_points is None:
+        required_points = compact_free_points
+
+    # move the last segment into the best fitting unused slot in front of it as long as there is one
+    moves = []
+    moved_points = 0
+    reserved_after_moves = reserved.copy()
+    end = end_of(reserved_after_moves)
+    while end > 0 and total_capacity - int(np.sum(capacity[:end])) < required_points:
+        source = end - 1
+        candidates = np.flatnonzero(~reserved_after_moves[:source] & (capacity[:source] >= lengths[source]))
+        if len(candidates) == 0:
+            break
+        target = int(candidates[np.argmin(capacity[candidates])])
+        moves.append((source, target))
+        moved_points += int(lengths[source])
+        reserved_after_moves[target] = True
+        reserved_after_moves[source] = False
+        end = end_of(reserved_after_moves)
+
+    free_points_after_moves = total_capacity - int(np.sum(capacity[:end]))
+    if free_points_after_moves >= required_points:
+        return CompactionPlan(moves, None, moved_points, free_points_after_moves)
+
+    end = end_of(reserved)
+    gaps = np.flatnonzero(~reserved[:end] | (capacity[:end] > lengths[:end]))
+    if len(gaps) == 0:
+        return CompactionPlan([], None, 0, total_capacity - int(np.sum(capacity[:end])))
+
+    repack_start = int(gaps[0])
+    repacked_points = int(np.sum(lengths[repack_start:][reserved[repack_start:]]))
+    return CompactionPlan([], repack_start, repacked_points, compact_free_points)
+
+
 def with_configuration_guard(function_object: Callable[['TaborChannelPair', Any], Any]) -> Callable[['TaborChannelPair'],
                                                                                                Any]:
     """This decorator assures that the AWG is in configuration mode while the decorated method runs."""
@@ -643,6 +989,17 @@ def with_select(function_object: Callable[['TaborChannelPair', Any], Any]) -> Ca
     return selector
 
 
+def with_command_batch(function_object: Callable[['TaborChannelPair', Any], Any]) -> Callable[['TaborChannelPair'],
+                                                                                               Any]:
+    """Queues the commands sent by the wrapped function in a command batch of the device"""
+    @functools.wraps(function_object)
+    def batched(channel_pair: 'TaborChannelPair', *args, **kwargs) -> Any:
+        with channel_pair.device.command_batch():
+            return function_object(channel_pair, *args, **kwargs)
+
+    return batched
+
+
 class PlottableProgram:
     TableEntry = NamedTuple('TableEntry', [('repetition_count', int),
                                            ('element_number', int),
@@ -771,7 +1128,28 @@ class PlottableProgram:
 
 
 class TaborChannelPair(AWG):
-    def __init__(self, tabor_device: TaborAWGRepresentation, channels: Tuple[int, int], identifier: str):
+    MEMORY_SNAPSHOT_VERSION = 1
+
+    # change_armed_program only downloads the sequencer tables that are not on the device if this is True. This skips
+    # the SEQ:DEL:ALL and ASEQ:DEL workaround for the device bug so it is opt-in. All tables are deleted and downloaded
+    # again by default.
+    incremental_sequencer_tables = False
+
+    def __init__(self, tabor_device: TaborAWGRepresentation, channels: Tuple[int, int], identifier: str,
+                 memory_snapshot: Optional[str]=None,
+                 restore_memory: bool=True,
+                 read_back_segments: Optional[int]=4):
+        """
+        Args:
+            memory_snapshot: Path of a file in which the memory layout and the known programs are saved after each
+                change. If it exists and restore_memory is True the state is restored from it instead of clearing the
+                device memory. The memory is cleared if the snapshot does not match the device.
+            restore_memory: Restore the state from an existing memory snapshot.
+            read_back_segments: Number of randomly chosen segments that are read back from the device to verify the
+                snapshot. None reads back all segments. Reading back requires a readable device, otherwise the memory
+                is cleared. 0 trusts the snapshot without any check. Only use it if nothing else can change the
+                device memory because the programs would silently play wrong waveforms otherwise.
+        """
         super().__init__(identifier)
         self._device =  weakref.ref(tabor_device)
 
@@ -801,7 +1179,21 @@ class TaborChannelPair(AWG):
         self._sequencer_tables = None
         self._advanced_sequence_table = None
 
-        self.clear()
+        self._last_upload_timings = None  # type: Optional[UploadTimings]
+
+        # sampling parameters of the known programs to resample their segments during compaction
+        self._sampling_parameters = dict()  # type: Dict[str, Tuple]
+
+        self._memory_snapshot = memory_snapshot
+
+        if memory_snapshot is not None and restore_memory and os.path.isfile(memory_snapshot):
+            try:
+                self.load_memory_snapshot(memory_snapshot, read_back_segments=read_back_segments)
+            except TaborException as err:
+                warnings.warn('Clearing memory of {} as the snapshot cannot be restored: {}'.format(identifier, err))
+                self.clear()
+        else:
+            self.clear()
 
     def select(self) -> None:
         self.device.send_cmd(':INST:SEL {}'.format(self._channels[0]))
@@ -818,9 +1210,11 @@ class TaborChannelPair(AWG):
         if name is None:
             raise TaborException('Removing "None" program is forbidden.')
         program = self._known_programs.pop(name)
+        self._sampling_parameters.pop(name, None)
         self._segment_references[program.waveform_to_segment] -= 1
         if self._current_program == name:
             self.change_armed_program(None)
+        self._update_memory_snapshot()
         return program
 
     def _restore_program(self, name: str, program: TaborProgram) -> None:
@@ -837,6 +1231,17 @@ class TaborChannelPair(AWG):
     def _free_points_in_total(self) -> int:
         return self.total_capacity - np.sum(self._segment_capacity[self._segment_reserved])
 
+    @property
+    def _first_free_index(self) -> int:
+        """Index of the first segment behind the last reserved one"""
+        reserved_index = np.flatnonzero(self._segment_reserved)
+        return reserved_index[-1] + 1 if len(reserved_index) else 0
+
+    @property
+    def last_upload_timings(self) -> Optional[UploadTimings]:
+        """Stage durations of the last streaming upload"""
+        return self._last_upload_timings
+
     @property
     def _free_points_at_end(self) -> int:
         reserved_index = np.flatnonzero(self._segment_reserved)
@@ -847,13 +1252,15 @@ class TaborChannelPair(AWG):
 
     @with_select
     def read_waveforms(self) -> List[np.ndarray]:
+        return self._read_segments(np.flatnonzero(self._segment_references))
+
+    def _read_segments(self, segment_indices: Sequence[int]) -> List[np.ndarray]:
         device = self.device.get_readable_device(simulator=True)
 
         old_segment = device.send_query(':TRAC:SEL?')
         waveforms = []
-        uploaded_waveform_indices = np.flatnonzero(self._segment_references) + 1
-        for segment in uploaded_waveform_indices:
-            device.send_cmd(':TRAC:SEL {}'.format(segment))
+        for segment_index in segment_indices:
+            device.send_cmd(':TRAC:SEL {}'.format(segment_index + 1))
             waveforms.append(device.read_act_seg_dat())
         device.send_cmd(':TRAC:SEL {}'.format(old_segment))
         return waveforms
@@ -880,6 +1287,7 @@ class TaborChannelPair(AWG):
                                                self.read_sequence_tables(),
                                                self.read_advanced_sequencer_table())
 
+    @with_command_batch
     @with_configuration_guard
     @with_select
     def upload(self, name: str,
@@ -887,10 +1295,26 @@ class TaborChannelPair(AWG):
                channels: Tuple[Optional[ChannelID], Optional[ChannelID]],
                markers: Tuple[Optional[ChannelID], Optional[ChannelID]],
                voltage_transformation: Tuple[Callable, Callable],
-               force: bool=False) -> None:
+               force: bool=False,
+               sampling_workers: int=1,
+               sampling_executor_type: Callable[..., concurrent.futures.Executor]=concurrent.futures.ThreadPoolExecutor,
+               streaming: bool=False) -> None:
         """Upload a program to the AWG.
 
-        The policy is to prefer amending the unknown waveforms to overwriting old ones."""
+        The policy is to prefer amending the unknown waveforms to overwriting old ones.
+
+        Args:
+            sampling_workers: Number of workers that sample and quantize the segments concurrently. The segments are
+                sampled in the calling thread if it is 1 and streaming is False.
+            sampling_executor_type: Executor class that is instantiated with max_workers=sampling_workers. Use
+                concurrent.futures.ProcessPoolExecutor if the waveforms and voltage transformations are picklable
+                and sampling is limited by the global interpreter lock.
+            streaming: Place and transfer each segment as soon as it is sampled while the workers sample the
+                following segments. Segments that do not fit into a free slot are amended in one transfer at the end.
+                The stage durations are available via last_upload_timings afterwards. The program is sampled
+                completely before placing it like without streaming if its segments could exceed the free memory
+                at the end.
+        """
 
         if len(channels) != self.num_channels:
             raise ValueError('Channel ID not specified')
@@ -919,6 +1343,9 @@ class TaborChannelPair(AWG):
             else:
                 raise ValueError('{} is already known on {}'.format(name, self.identifier))
 
+        # segments whose reference count was increased for the new program
+        referenced = None
+
         try:
             # parse to tabor program
             tabor_program = TaborProgram(program,
@@ -932,33 +1359,68 @@ class TaborChannelPair(AWG):
 
             voltage_amplitudes = (ranges[0]/2, ranges[1]/2)
             voltage_offsets = (0, 0)
-            segments, segment_lengths = tabor_program.sampled_segments(sample_rate=sample_rate,
-                                                                       voltage_amplitude=voltage_amplitudes,
-                                                                       voltage_offset=voltage_offsets,
-                                                                       voltage_transformation=voltage_transformation)
 
-            waveform_to_segment, to_amend, to_insert = self._find_place_for_segments_in_memory(segments,
-                                                                                               segment_lengths)
+            if streaming:
+                # the segments already in memory are only known after sampling. Streaming could overwrite free slots
+                # before the amended segments turn out not to fit, so it requires room for all segments at the end
+                free_points_at_end = self.total_capacity - np.sum(self._segment_capacity[:self._first_free_index])
+                streaming = np.sum(tabor_program.get_segment_lengths(sample_rate) + 16) <= free_points_at_end
+
+            if streaming:
+                waveform_to_segment = self._upload_segments_streaming(tabor_program,
+                                                                      sample_rate=sample_rate,
+                                                                      voltage_amplitude=voltage_amplitudes,
+                                                                      voltage_offset=voltage_offsets,
+                                                                      voltage_transformation=voltage_transformation,
+                                                                      sampling_workers=sampling_workers,
+                                                                      sampling_executor_type=sampling_executor_type)
+                referenced = waveform_to_segment
+            elif sampling_workers > 1:
+                with sampling_executor_type(max_workers=sampling_workers) as executor:
+                    segments, segment_lengths = tabor_program.sampled_segments(
+                        sample_rate=sample_rate,
+                        voltage_amplitude=voltage_amplitudes,
+                        voltage_offset=voltage_offsets,
+                        voltage_transformation=voltage_transformation,
+                        executor=executor)
+            else:
+                segments, segment_lengths = tabor_program.sampled_segments(
+                    sample_rate=sample_rate,
+                    voltage_amplitude=voltage_amplitudes,
+                    voltage_offset=voltage_offsets,
+                    voltage_transformation=voltage_transformation)
+
+            if not streaming:
+                waveform_to_segment, to_amend, to_insert = self._find_place_for_segments_in_memory(segments,
+                                                                                                   segment_lengths)
+
+                self._segment_references[waveform_to_segment[waveform_to_segment >= 0]] += 1
+                referenced = waveform_to_segment
+
+                for wf_index in np.flatnonzero(to_insert >= 0):
+                    segment_index = to_insert[wf_index]
+                    self._upload_segment(to_insert[wf_index], segments[wf_index])
+                    waveform_to_segment[wf_index] = segment_index
+
+                if np.any(to_amend):
+                    segments_to_amend = segments[to_amend]
+                    waveform_to_segment[to_amend] = self._amend_segments(segments_to_amend)
+
+            # the device reports errors of the batched commands when they are sent
+            self.device.flush_commands()
         except:
+            if referenced is not None:
+                self._segment_references[referenced[referenced >= 0]] -= 1
             if to_restore:
                 self._restore_program(*to_restore)
                 if to_restore_was_armed:
                     self.change_armed_program(name)
             raise
 
-        self._segment_references[waveform_to_segment[waveform_to_segment >= 0]] += 1
-
-        for wf_index in np.flatnonzero(to_insert > 0):
-            segment_index = to_insert[wf_index]
-            self._upload_segment(to_insert[wf_index], segments[wf_index])
-            waveform_to_segment[wf_index] = segment_index
-
-        if np.any(to_amend):
-            segments_to_amend = segments[to_amend]
-            waveform_to_segment[to_amend] = self._amend_segments(segments_to_amend)
-
         self._known_programs[name] = TaborProgramMemory(waveform_to_segment=waveform_to_segment,
                                                         program=tabor_program)
+        self._sampling_parameters[name] = (sample_rate, voltage_amplitudes, voltage_offsets, voltage_transformation)
+        self._update_memory_snapshot()
 
     @with_configuration_guard
     @with_select
@@ -983,21 +1445,163 @@ class TaborChannelPair(AWG):
         self._sequencer_tables = []
 
         self._known_programs = dict()
+        self._sampling_parameters = dict()
+        self.change_armed_program(None)
+        self._update_memory_snapshot()
+
+    def _get_memory_snapshot(self) -> dict:
+        programs = {}
+        for name, (waveform_to_segment, program) in self._known_programs.items():
+            programs[name] = dict(
+                waveform_to_segment=waveform_to_segment.tolist(),
+                sequencer_tables=[[tuple(map(int, entry)) for entry in sequencer_table]
+                                  for sequencer_table in program.get_sequencer_tables()],
+                advanced_sequencer_table=[tuple(map(int, entry))
+                                          for entry in program.get_advanced_sequencer_table()],
+                waveform_mode=program.waveform_mode.name)
+
+        return dict(version=self.MEMORY_SNAPSHOT_VERSION,
+                    model_name=self.device.dev_properties['model_name'],
+                    serial_num=self.device.dev_properties['serial_num'],
+                    channels=list(self._channels),
+                    segment_lengths=self._segment_lengths.tolist(),
+                    segment_capacity=self._segment_capacity.tolist(),
+                    segment_hashes=self._segment_hashes.tolist(),
+                    programs=programs)
+
+    def save_memory_snapshot(self, path: Optional[str]=None) -> None:
+        """Save the memory layout, the segment hashes and the sequencing information of all known programs.
+
+        Args:
+            path: Target file. Defaults to the memory snapshot path the channel pair was created with.
+        """
+        if path is None:
+            path = self._memory_snapshot
+            if path is None:
+                raise ValueError('No memory snapshot path given')
+
+        snapshot = self._get_memory_snapshot()
+
+        # replace the old snapshot atomically so an interrupted save does not leave a truncated file
+        temporary_path = path + '.tmp'
+        with open(temporary_path, 'w') as snapshot_file:
+            json.dump(snapshot, snapshot_file)
+        os.replace(temporary_path, path)
+
+    def _update_memory_snapshot(self) -> None:
+        if self._memory_snapshot is not None:
+            try:
+                self.save_memory_snapshot(self._memory_snapshot)
+            except OSError as err:
+                warnings.warn('Could not save memory snapshot of {}: {}'.format(self.identifier, err))
+
+    @with_configuration_guard
+    @with_select
+    def load_memory_snapshot(self, path: str, read_back_segments: Optional[int]=4) -> None:
+        """Restore the memory layout and the known programs from a snapshot instead of clearing the device memory.
+        Segments are not transferred. Programs restored this way can be armed and removed but their Loop is not
+        available.
+
+        Args:
+            path: Snapshot file written by save_memory_snapshot
+            read_back_segments: Number of randomly chosen referenced segments that are read back from the device and
+                compared to the stored hashes. None reads back all referenced segments and 0 trusts the snapshot
+                without any check.
+
+        Raises:
+            TaborException: if the snapshot cannot be read or does not match the device. The state is not changed
+                in that case.
+        """
+        try:
+            with open(path, 'r') as snapshot_file:
+                snapshot = json.load(snapshot_file)
+        except (OSError, ValueError) as err:
+            raise TaborException('Could not read memory snapshot', path) from err
+
+        try:
+            if snapshot['version'] != self.MEMORY_SNAPSHOT_VERSION:
+                raise TaborException('Unknown memory snapshot version', snapshot['version'])
+            if (snapshot['model_name'], snapshot['serial_num']) != (self.device.dev_properties['model_name'],
+                                                                    self.device.dev_properties['serial_num']):
+                raise TaborException('Memory snapshot was taken on a different device')
+            if tuple(snapshot['channels']) != self._channels:
+                raise TaborException('Memory snapshot was taken on different channels', snapshot['channels'])
+
+            segment_lengths = np.array(snapshot['segment_lengths'], dtype=np.uint32)
+            segment_capacity = np.array(snapshot['segment_capacity'], dtype=np.uint32)
+            segment_hashes = np.array(snapshot['segment_hashes'], dtype=np.int64)
+
+            n_segments = len(segment_lengths)
+            if n_segments == 0 or len(segment_capacity) != n_segments or len(segment_hashes) != n_segments:
+                raise TaborException('Inconsistent segment information in memory snapshot')
+            if np.any(segment_lengths > segment_capacity) or np.sum(segment_capacity) > self.total_capacity:
+                raise TaborException('Memory snapshot does not fit into the device memory')
+            if segment_hashes[0] != hash(self._idle_segment):
+                raise TaborException('Memory snapshot does not start with the idle segment')
+
+            # the idle segment is always referenced
+            segment_references = np.zeros(n_segments, dtype=np.uint32)
+            segment_references[0] = 1
+
+            known_programs = dict()
+            for name, program in snapshot['programs'].items():
+                waveform_to_segment = np.array(program['waveform_to_segment'], dtype=np.int64)
+                if np.any(waveform_to_segment < 0) or np.any(waveform_to_segment >= n_segments):
+                    raise TaborException('Program references unknown segments', name)
+                # free_program removes one reference per distinct segment
+                segment_references[np.unique(waveform_to_segment)] += 1
+
+                restored_program = _RestoredTaborProgram(
+                    sequencer_tables=[[tuple(entry) for entry in sequencer_table]
+                                      for sequencer_table in program['sequencer_tables']],
+                    advanced_sequencer_table=[tuple(entry) for entry in program['advanced_sequencer_table']],
+                    waveform_mode=TaborSequencing[program['waveform_mode']])
+                known_programs[name] = TaborProgramMemory(waveform_to_segment=waveform_to_segment,
+                                                          program=restored_program)
+        except (KeyError, TypeError, ValueError) as err:
+            raise TaborException('Malformed memory snapshot', path) from err
+
+        if read_back_segments != 0:
+            referenced = np.flatnonzero(segment_references)
+            if read_back_segments is not None and read_back_segments < len(referenced):
+                referenced = np.sort(np.random.choice(referenced, size=read_back_segments, replace=False))
+
+            for segment_index, segment_data in zip(referenced, self._read_segments(referenced)):
+                if hash(TaborSegment.from_binary_segment(segment_data)) != segment_hashes[segment_index]:
+                    raise TaborException('Segment on device differs from memory snapshot', segment_index)
+
+        self._segment_lengths = segment_lengths
+        self._segment_capacity = segment_capacity
+        self._segment_hashes = segment_hashes
+        self._segment_references = segment_references
+        self._known_programs = known_programs
+
+        # the sequencer tables on the device are unknown
+        self._sequencer_tables = None
         self.change_armed_program(None)
 
+    def _get_segment_index_by_hash(self) -> Dict[int, int]:
+        """Map the content hashes of the segments in memory to the index of their first occurrence."""
+        segment_index_by_hash = {}
+        for segment_index, segment_hash in enumerate(self._segment_hashes.tolist()):
+            segment_index_by_hash.setdefault(segment_hash, segment_index)
+        return segment_index_by_hash
+
     def _find_place_for_segments_in_memory(self, segments: Sequence, segment_lengths: Sequence) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
         """
         1. Find known segments
-        2. Find empty spaces with fitting length
-        3. Find empty spaces with bigger length
-        4. Amend remaining segments
+        2. Find the best fitting empty space for the remaining segments starting with the largest one
+        3. Amend remaining segments
         :param segments:
         :param segment_lengths:
         :return:
         """
         segment_hashes = np.fromiter((hash(segment) for segment in segments), count=len(segments), dtype=np.int64)
 
-        waveform_to_segment = find_positions(self._segment_hashes, segment_hashes)
+        segment_index_by_hash = self._get_segment_index_by_hash()
+        waveform_to_segment = np.fromiter((segment_index_by_hash.get(segment_hash, -1)
+                                           for segment_hash in segment_hashes.tolist()),
+                                          count=len(segments), dtype=np.int64)
 
         # separate into known and unknown
         unknown = (waveform_to_segment == -1)
@@ -1024,40 +1628,19 @@ class TaborChannelPair(AWG):
         reserved_indices = np.flatnonzero(new_reference_counter > 0)
         first_free = reserved_indices[-1] + 1 if len(reserved_indices) else 0
 
-        free_segments = new_reference_counter[:first_free] == 0
-        free_segment_count = np.sum(free_segments)
+        free_segments = _FreeSegmentIndex(self._segment_capacity,
+                                          np.flatnonzero(new_reference_counter[:first_free] == 0))
 
-        # look for a free segment place with the same length
-        for segment_idx in np.flatnonzero(to_amend):
-            if free_segment_count == 0:
+        # best fit decreasing: the largest segments are placed first into the smallest free slot they fit in
+        unknown_indices = sorted(np.flatnonzero(to_amend).tolist(), key=lambda idx: -int(segment_lengths[idx]))
+        for segment_idx in unknown_indices:
+            if not free_segments:
                 break
 
-            pos_of_same_length = np.logical_and(free_segments, segment_lengths[segment_idx] == self._segment_capacity[:first_free])
-            idx_same_length = np.argmax(pos_of_same_length)
-            if pos_of_same_length[idx_same_length]:
-                free_segments[idx_same_length] = False
-                free_segment_count -= 1
-
+            slot = free_segments.pop_best_fit(segment_lengths[segment_idx])
+            if slot is not None:
                 to_amend[segment_idx] = False
-                to_insert[segment_idx] = idx_same_length
-
-        # try to find places that are larger than the segments to fit in starting with the large segments and large
-        # free spaces
-        segment_indices = np.flatnonzero(to_amend)[np.argsort(segment_lengths[to_amend])[::-1]]
-        capacities = self._segment_capacity[:first_free]
-        for segment_idx in segment_indices:
-            free_capacities = capacities[free_segments]
-            free_segments_indices = np.flatnonzero(free_segments)[np.argsort(free_capacities)[::-1]]
-
-            if len(free_segments_indices) == 0:
-                break
-
-            fitting_segment = np.argmax((free_capacities >= segment_lengths[segment_idx])[::-1])
-            fitting_segment = free_segments_indices[fitting_segment]
-            if self._segment_capacity[fitting_segment] >= segment_lengths[segment_idx]:
-                free_segments[fitting_segment] = False
-                to_amend[segment_idx] = False
-                to_insert[segment_idx] = fitting_segment
+                to_insert[segment_idx] = slot
 
         free_points_at_end = self.total_capacity - np.sum(self._segment_capacity[:first_free])
         if np.sum(segment_lengths[to_amend] + 16) > free_points_at_end:
@@ -1068,6 +1651,124 @@ class TaborChannelPair(AWG):
 
         return waveform_to_segment, to_amend, to_insert
 
+    def _upload_segments_streaming(self,
+                                   tabor_program: TaborProgram,
+                                   sample_rate: fractions.Fraction,
+                                   voltage_amplitude: Tuple[float, float],
+                                   voltage_offset: Tuple[float, float],
+                                   voltage_transformation: Tuple[Callable, Callable],
+                                   sampling_workers: int,
+                                   sampling_executor_type: Callable[..., concurrent.futures.Executor]) -> np.ndarray:
+        """Sample the program's segments in background workers and place and transfer each one as soon as it arrives.
+
+        Segments already in memory are referenced, the others are uploaded into the best fitting free slot in front of
+        the last reserved segment. The remaining segments are amended in one transfer after the last one was sampled.
+        All reference changes are undone if the upload fails before amending.
+
+        Returns:
+            waveform_to_segment
+        """
+        start_time = time.perf_counter()
+        sampling_time = sampling_wait_time = placement_time = transfer_time = 0.
+
+        segment_lengths = tabor_program.get_segment_lengths(sample_rate)
+        sample_segment = tabor_program._get_segment_sampler(sample_rate, voltage_amplitude, voltage_offset,
+                                                            voltage_transformation)
+
+        waveform_to_segment = np.full(len(segment_lengths), -1, dtype=np.int64)
+
+        segment_index_by_hash = self._get_segment_index_by_hash()
+
+        reserved_indices = np.flatnonzero(self._segment_references > 0)
+        first_free = reserved_indices[-1] + 1 if len(reserved_indices) else 0
+        free_slots = set(np.flatnonzero(self._segment_references[:first_free] == 0).tolist())
+        free_segments = _FreeSegmentIndex(self._segment_capacity, sorted(free_slots))
+
+        # every segment is referenced once per program like in _upload_segments
+        referenced = set()
+        to_amend = OrderedDict()  # segment hash -> (segment, waveform indices)
+        try:
+            with sampling_executor_type(max_workers=max(1, sampling_workers)) as executor:
+                sampled = executor.map(functools.partial(_timed_call, sample_segment), tabor_program.waveforms)
+
+                for wf_index in range(len(segment_lengths)):
+                    wait_start = time.perf_counter()
+                    segment, segment_sampling_time = next(sampled)
+                    placement_start = time.perf_counter()
+                    sampling_wait_time += placement_start - wait_start
+                    sampling_time += segment_sampling_time
+
+                    segment_hash = hash(segment)
+                    segment_index = segment_index_by_hash.get(segment_hash, -1)
+                    if segment_index >= 0 and segment_index not in free_slots:
+                        if segment_index not in referenced:
+                            self._segment_references[segment_index] += 1
+                            referenced.add(segment_index)
+                        waveform_to_segment[wf_index] = segment_index
+                        placement_time += time.perf_counter() - placement_start
+                        continue
+
+                    if segment_hash in to_amend:
+                        to_amend[segment_hash][1].append(wf_index)
+                        placement_time += time.perf_counter() - placement_start
+                        continue
+
+                    segment_length = segment_lengths[wf_index]
+                    if segment_index >= 0:
+                        # the segment is still on the device but not referenced anymore
+                        slot = segment_index
+                        free_segments.remove(self._segment_capacity[slot], slot)
+                    else:
+                        slot = free_segments.pop_best_fit(segment_length)
+
+                    if slot is None:
+                        to_amend[segment_hash] = (segment, [wf_index])
+                        placement_time += time.perf_counter() - placement_start
+                        continue
+
+                    free_slots.remove(slot)
+                    placement_time += time.perf_counter() - placement_start
+
+                    transfer_start = time.perf_counter()
+                    if segment_index >= 0:
+                        self._segment_references[slot] = 1
+                    else:
+                        old_hash = self._segment_hashes[slot]
+                        if segment_index_by_hash.get(old_hash) == slot:
+                            del segment_index_by_hash[old_hash]
+                        self._upload_segment(slot, segment)
+                        segment_index_by_hash.setdefault(segment_hash, slot)
+                    referenced.add(slot)
+                    waveform_to_segment[wf_index] = slot
+                    transfer_time += time.perf_counter() - transfer_start
+
+            if to_amend:
+                amend_lengths = np.fromiter((segment.num_points for segment, _ in to_amend.values()),
+                                            count=len(to_amend), dtype=np.uint64)
+                free_points_at_end = self.total_capacity - np.sum(self._segment_capacity[:self._first_free_index])
+                if np.sum(amend_lengths + 16) > free_points_at_end:
+                    raise MemoryError('Fragmentation does not allow upload.',
+                                      np.sum(amend_lengths + 16),
+                                      free_points_at_end,
+                                      self._free_points_at_end)
+        except:
+            self._segment_references[list(referenced)] -= 1
+            raise
+
+        if to_amend:
+            transfer_start = time.perf_counter()
+            amended = self._amend_segments([segment for segment, _ in to_amend.values()])
+            for segment_index, (_, wf_indices) in zip(amended, to_amend.values()):
+                waveform_to_segment[wf_indices] = segment_index
+            transfer_time += time.perf_counter() - transfer_start
+
+        self._last_upload_timings = UploadTimings(sampling=sampling_time,
+                                                  sampling_wait=sampling_wait_time,
+                                                  placement=placement_time,
+                                                  transfer=transfer_time,
+                                                  total=time.perf_counter() - start_time)
+        return waveform_to_segment
+
     @with_select
     @with_configuration_guard
     def _upload_segment(self, segment_index: int, segment: TaborSegment) -> None:
@@ -1149,6 +1850,116 @@ class TaborChannelPair(AWG):
                                                for i in range(chunk_start, min(chunk_start+chunk_size, old_end))))
         except Exception as e:
             raise TaborUndefinedState('Error during cleanup. Device is in undefined state.', device=self) from e
+        self._update_memory_snapshot()
+
+    def _get_segments(self, segment_indices: Sequence[int]) -> List[TaborSegment]:
+        """Get the data of uploaded segments. Segments of programs uploaded in this session are resampled. The others
+        are read back from the device."""
+        segments = dict()
+        for name, (waveform_to_segment, program) in self._known_programs.items():
+            if name not in self._sampling_parameters or not isinstance(program, TaborProgram):
+                continue
+            sample_segment = None
+            for segment_index in segment_indices:
+                if segment_index in segments:
+                    continue
+                wf_indices = np.flatnonzero(waveform_to_segment == segment_index)
+                if len(wf_indices):
+                    if sample_segment is None:
+                        sample_segment = program._get_segment_sampler(*self._sampling_parameters[name])
+                    segments[segment_index] = sample_segment(program.waveforms[wf_indices[0]])
+
+        to_read = [segment_index for segment_index in segment_indices if segment_index not in segments]
+        if to_read:
+            for segment_index, segment_data in zip(to_read, self._read_segments(to_read)):
+                segments[segment_index] = TaborSegment.from_binary_segment(segment_data)
+        return [segments[segment_index] for segment_index in segment_indices]
+
+    def _remap_segments(self, old_indices: Sequence[int], new_indices: Sequence[int]) -> None:
+        """Change the segment indices of all known programs"""
+        mapping = np.arange(max(len(self._segment_lengths), np.max(old_indices) + 1, np.max(new_indices) + 1))
+        mapping[old_indices] = new_indices
+        for waveform_to_segment, _ in self._known_programs.values():
+            waveform_to_segment[:] = mapping[waveform_to_segment]
+
+    @with_command_batch
+    @with_select
+    @with_configuration_guard
+    def compact(self,
+                required_points: Optional[int]=None,
+                time_budget: Optional[float]=None,
+                segment_source: Optional[Callable[[Sequence[int]], List[TaborSegment]]]=None) -> bool:
+        """Reduce the fragmentation of the segment memory without clearing it. The transfers are planned with
+        plan_compaction. The segment indices of all known programs are updated and the armed program is rearmed.
+
+        Args:
+            required_points: Contiguous free points required at the end of the memory. None removes all gaps.
+            time_budget: Time in seconds after which no further transfer is started. The memory map is consistent
+                after each transfer. Repacking is a single transfer.
+            segment_source: Callable that returns the data of the segments with the given indices. By default
+                segments of programs uploaded in this session are resampled and the others are read back.
+
+        Returns:
+            True if the planned compaction was executed completely
+
+        Raises:
+            MemoryError: if required_points cannot be freed even by compaction
+        """
+        start_time = time.perf_counter()
+        plan = plan_compaction(self._segment_capacity, self._segment_lengths, self._segment_references,
+                               self.total_capacity, required_points)
+        if required_points is not None and plan.free_points_at_end < required_points:
+            raise MemoryError('Not enough memory even after compaction.', required_points, plan.free_points_at_end)
+
+        if segment_source is None:
+            segment_source = self._get_segments
+
+        def get_checked_segments(segment_indices):
+            segments = segment_source(segment_indices)
+            for segment_index, segment in zip(segment_indices, segments):
+                if hash(segment) != self._segment_hashes[segment_index]:
+                    raise TaborException('Segment data does not match the memory map', segment_index)
+            return segments
+
+        def within_budget():
+            return time_budget is None or time.perf_counter() - start_time < time_budget
+
+        completed = True
+        current_program = self._current_program
+        for source, target in plan.moves:
+            if not within_budget():
+                completed = False
+                break
+            segment, = get_checked_segments([source])
+            self._upload_segment(target, segment)
+            self._segment_references[target] = self._segment_references[source]
+            self._segment_references[source] = 0
+            self._remap_segments([source], [target])
+
+        if plan.repack_start is not None:
+            if within_budget():
+                to_repack = plan.repack_start + np.flatnonzero(self._segment_references[plan.repack_start:])
+                segments = get_checked_segments(to_repack)
+                references = self._segment_references[to_repack]
+
+                # the armed program may reference segments that are deleted
+                self.change_armed_program(None)
+                self._segment_references[plan.repack_start:] = 0
+                self.cleanup()
+
+                try:
+                    repacked = self._amend_segments(segments)
+                except Exception as e:
+                    raise TaborUndefinedState('Error during compaction. Device is in undefined state.',
+                                              device=self) from e
+                self._segment_references[repacked] = references
+                self._remap_segments(to_repack, repacked)
+            else:
+                completed = False
+
+        self.change_armed_program(current_program)
+        self.cleanup()
+        return completed
 
     def remove(self, name: str) -> None:
         """Remove a program from the AWG.
@@ -1223,24 +2034,81 @@ class TaborChannelPair(AWG):
         while len(advanced_sequencer_table) < self.device.dev_properties['min_aseq_len']:
             advanced_sequencer_table.append((1, 1, 0))
 
-        # reset sequencer and advanced sequencer tables to fix bug which occurs when switching between some programs
-        self.device.send_cmd('SEQ:DEL:ALL')
-        self._sequencer_tables = []
-        self.device.send_cmd('ASEQ:DEL')
-        self._advanced_sequence_table = []
+        slots = None
+        if self.incremental_sequencer_tables and self._sequencer_tables:
+            slots = self._get_sequencer_table_slots(sequencer_tables)
+
+        if slots is None:
+            # reset sequencer and advanced sequencer tables to fix bug which occurs when switching between some
+            # programs
+            self.device.send_cmd('SEQ:DEL:ALL')
+            self._sequencer_tables = []
+            self.device.send_cmd('ASEQ:DEL')
+            self._advanced_sequence_table = []
+
+            # download all sequence tables
+            for i, sequencer_table in enumerate(sequencer_tables):
+                self.device.send_cmd('SEQ:SEL {}'.format(i+1))
+                self.device.download_sequencer_table(sequencer_table)
+            self._sequencer_tables = sequencer_tables
+            self.device.send_cmd('SEQ:SEL 1')
 
-        # download all sequence tables
-        for i, sequencer_table in enumerate(sequencer_tables):
-            self.device.send_cmd('SEQ:SEL {}'.format(i+1))
-            self.device.download_sequencer_table(sequencer_table)
-        self._sequencer_tables = sequencer_tables
-        self.device.send_cmd('SEQ:SEL 1')
+            self.device.download_adv_seq_table(advanced_sequencer_table)
+            self._advanced_sequence_table = advanced_sequencer_table
+
+        else:
+            # only download the tables that are not on the device yet
+            for sequencer_table, slot in zip(sequencer_tables, slots):
+                if slot == len(self._sequencer_tables):
+                    self._sequencer_tables.append(None)
+                if self._sequencer_tables[slot] != sequencer_table:
+                    self.device.send_cmd('SEQ:SEL {}'.format(slot + 1))
+                    self.device.download_sequencer_table(sequencer_table)
+                    self._sequencer_tables[slot] = sequencer_table
+            self.device.send_cmd('SEQ:SEL 1')
 
-        self.device.download_adv_seq_table(advanced_sequencer_table)
-        self._advanced_sequence_table = advanced_sequencer_table
+            advanced_sequencer_table = [(rep_count, slots[seq_no - 1] + 1, jump_flag)
+                                        for rep_count, seq_no, jump_flag in advanced_sequencer_table]
+            if advanced_sequencer_table != self._advanced_sequence_table:
+                self.device.download_adv_seq_table(advanced_sequencer_table)
+                self._advanced_sequence_table = advanced_sequencer_table
 
         self._current_program = name
 
+    def _get_sequencer_table_slots(self, sequencer_tables: List[List[Tuple[int, int, int]]]) -> Optional[List[int]]:
+        """Find the device slot of each sequencer table. Tables that are on the device already keep their slot. The
+        others replace tables that are not needed anymore or are appended.
+
+        Returns:
+            The slot index of each table or None if the idle table is not in the first slot or the tables do not fit
+        """
+        slot_by_content = dict()
+        for slot, device_table in enumerate(self._sequencer_tables):
+            slot_by_content.setdefault(tuple(device_table), slot)
+
+        contents = [tuple(sequencer_table) for sequencer_table in sequencer_tables]
+        slots = [slot_by_content.get(content) for content in contents]
+
+        used_slots = set(slot for slot in slots if slot is not None)
+        unused_slots = (slot for slot in range(len(self._sequencer_tables)) if slot not in used_slots)
+        n_slots = len(self._sequencer_tables)
+        for table_idx, content in enumerate(contents):
+            if slots[table_idx] is None:
+                slot = next(unused_slots, None)
+                if slot is None:
+                    slot = n_slots
+                    n_slots += 1
+                slots[table_idx] = slot
+
+                # identical tables of the new program share the slot
+                for other_idx in range(table_idx + 1, len(contents)):
+                    if slots[other_idx] is None and contents[other_idx] == content:
+                        slots[other_idx] = slot
+
+        if slots[0] != 0 or n_slots > self.device.dev_properties['max_num_seq']:
+            return None
+        return slots
+
     @with_select
     def run_current_program(self) -> None:
         if self._current_program:
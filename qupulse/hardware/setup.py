@@ -115,11 +115,15 @@ class HardwareSetup:
         while temp_measurement_windows:
             mw_name, begins_lengths_deque = temp_measurement_windows.popitem()
 
-            begins, lengths = zip(*begins_lengths_deque)
-            measurement_windows[mw_name] = (
-                np.concatenate(begins),
-                np.concatenate(lengths)
-            )
+            if len(begins_lengths_deque) == 1:
+                # the windows of a single program are already sorted
+                measurement_windows[mw_name] = begins_lengths_deque[0]
+            else:
+                begins, lengths = zip(*begins_lengths_deque)
+                begins = np.concatenate(begins)
+                lengths = np.concatenate(lengths)
+                order = np.lexsort((lengths, begins))
+                measurement_windows[mw_name] = (begins[order], lengths[order])
 
         affected_dacs = defaultdict(dict)
         for measurement_name, begins_lengths in measurement_windows.items():
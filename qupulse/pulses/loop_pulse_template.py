@@ -14,7 +14,7 @@ from qupulse._program._loop import Loop
 from qupulse.expressions import ExpressionScalar
 from qupulse.utils import checked_int_cast
 from qupulse.pulses.parameters import Parameter, ConstantParameter, InvalidParameterNameException, ParameterConstrainer, ParameterNotProvidedException
-from qupulse.pulses.pulse_template import PulseTemplate, ChannelID
+from qupulse.pulses.pulse_template import PulseTemplate, ChannelID, _ProgramRecorder
 from qupulse.pulses.conditions import Condition, ConditionMissingException
 from qupulse._program.instructions import InstructionBlock
 from qupulse.pulses.sequencing import Sequencer
@@ -251,13 +251,40 @@ class ForLoopPulseTemplate(LoopPulseTemplate, MeasurementDefiner, ParameterConst
             if measurements:
                 parent_loop.add_measurements(measurements)
 
+            # consecutive iterations that result in the same program are merged into a single repeated loop
+            previous_iteration, repetition_count = None, 0
             for local_parameters in self._body_parameter_generator(parameters, forward=True):
+                iteration = _ProgramRecorder()
                 self.body._create_program(parameters=local_parameters,
                                           measurement_mapping=measurement_mapping,
                                           channel_mapping=channel_mapping,
                                           global_transformation=global_transformation,
                                           to_single_waveform=to_single_waveform,
-                                          parent_loop=parent_loop)
+                                          parent_loop=iteration)
+                if previous_iteration is not None and iteration.events == previous_iteration.events:
+                    repetition_count += 1
+                else:
+                    self._append_iterations(parent_loop, previous_iteration, repetition_count)
+                    previous_iteration, repetition_count = iteration, 1
+            self._append_iterations(parent_loop, previous_iteration, repetition_count)
+
+    @staticmethod
+    def _append_iterations(parent_loop: Loop, iteration: Optional[_ProgramRecorder], repetition_count: int) -> None:
+        """Append the program of an iteration that is repeated repetition_count times to parent_loop."""
+        if iteration is None or not iteration.events:
+            return
+        if repetition_count == 1:
+            iteration.replay(parent_loop, copy=False)
+            return
+
+        if len(iteration.events) == 1 and iteration.events[0][0] == 'child':
+            # copy because the recorded loop may be shared with the create_program memo
+            repeated = iteration.events[0][1].copy_tree_structure(new_parent=None)
+            repeated.repetition_count = repeated.repetition_count * repetition_count
+        else:
+            repeated = Loop(repetition_count=repetition_count)
+            iteration.replay(repeated, copy=False)
+        parent_loop.append_child(loop=repeated)
 
     def build_waveform(self, parameters: Dict[str, Parameter]) -> ForLoopWaveform:
         return ForLoopWaveform([self.body.build_waveform(local_parameters)
@@ -7,12 +7,15 @@ Classes:
         directly translated into a waveform.
 """
 from abc import abstractmethod
-from typing import Dict, Tuple, Set, Optional, Union, List, Callable, Any, Generic, TypeVar, Mapping
+from typing import Dict, Tuple, Set, Optional, Union, List, Callable, Any, Generic, TypeVar, Mapping, Hashable
 import itertools
 import collections
+import threading
 from numbers import Real
 
-from qupulse.utils.types import ChannelID, DocStringABCMeta
+import numpy
+
+from qupulse.utils.types import ChannelID, DocStringABCMeta, MeasurementWindow
 from qupulse.serialization import Serializable
 from qupulse.expressions import ExpressionScalar, Expression
 from qupulse._program._loop import Loop, to_waveform
@@ -34,6 +37,37 @@ MappingTuple = Union[Tuple['PulseTemplate'],
                      Tuple['PulseTemplate', Dict, Dict, Dict]]
 
 
+class _ProgramRecorder:
+    """Stand-in for the parent loop in _create_program. It records the measurements and child loops a template adds so
+    they can be replayed into parent loops."""
+
+    def __init__(self):
+        self.events = []  # type: List[Tuple[str, Any]]
+
+    def add_measurements(self, measurements: List[MeasurementWindow]) -> None:
+        self.events.append(('measurements', list(measurements)))
+
+    def append_child(self, loop: Optional[Loop]=None, **kwargs) -> None:
+        if loop is None:
+            loop = Loop(**kwargs)
+        elif kwargs:
+            raise ValueError("Cannot pass a Loop object and Loop constructor arguments at the same time in append_child")
+        self.events.append(('child', loop))
+
+    def replay(self, parent_loop: Loop, copy: bool) -> None:
+        """Add the recorded measurements and children to parent_loop. The children are moved if copy is False."""
+        for kind, value in self.events:
+            if kind == 'measurements':
+                parent_loop.add_measurements(value)
+            else:
+                parent_loop.append_child(loop=value.copy_tree_structure(new_parent=None) if copy else value)
+
+
+# (root template, memo) of the currently running create_program call. The memo maps the memo key of a subtemplate to
+# its recording
+_create_program_memo = threading.local()
+
+
 class PulseTemplate(Serializable, SequencingElement, metaclass=DocStringABCMeta):
     """A PulseTemplate represents the parametrized general structure of a pulse.
 
@@ -43,7 +77,12 @@ class PulseTemplate(Serializable, SequencingElement, metaclass=DocStringABCMeta)
     and differ only in concrete values for the parameters.
     Obtaining an actual pulse which can be executed by specifying values for these parameters is
     called instantiation of the PulseTemplate and achieved by invoking the sequencing process.
+
+    create_program memoizes the program parts of (sub)templates: Instantiating a template with the same relevant
+    parameter values, channel mapping, measurement mapping and transformation again copies the previously created
+    loops which share their waveforms. Set memoize_create_program to False to disable this.
     """
+    memoize_create_program = True
 
     def __init__(self, *,
                  identifier: Optional[str]) -> None:
@@ -144,13 +183,19 @@ class PulseTemplate(Serializable, SequencingElement, metaclass=DocStringABCMeta)
                 parameters[key] = ConstantParameter(value)
 
         root_loop = Loop()
-        # call subclass specific implementation
-        self._create_program(parameters=parameters,
-                             measurement_mapping=measurement_mapping,
-                             channel_mapping=channel_mapping,
-                             global_transformation=global_transformation,
-                             to_single_waveform=to_single_waveform,
-                             parent_loop=root_loop)
+        previous_memo = getattr(_create_program_memo, 'state', None)
+        # only subtemplates can profit from the memo
+        _create_program_memo.state = (self, dict()) if self.memoize_create_program else None
+        try:
+            # call subclass specific implementation
+            self._create_program(parameters=parameters,
+                                 measurement_mapping=measurement_mapping,
+                                 channel_mapping=channel_mapping,
+                                 global_transformation=global_transformation,
+                                 to_single_waveform=to_single_waveform,
+                                 parent_loop=root_loop)
+        finally:
+            _create_program_memo.state = previous_memo
 
         if root_loop.waveform is None and len(root_loop.children) == 0:
             return None # return None if no program
@@ -185,8 +230,76 @@ class PulseTemplate(Serializable, SequencingElement, metaclass=DocStringABCMeta)
                         global_transformation: Optional[Transformation],
                         to_single_waveform: Set[Union[str, 'PulseTemplate']],
                         parent_loop: Loop):
-        """Generic part of create program. This method handles to_single_waveform and the configuration of the
-        transformer."""
+        """Generic part of create program. This method handles to_single_waveform, the configuration of the
+        transformer and the memoization of the created program parts."""
+        root_template, memo = getattr(_create_program_memo, 'state', None) or (None, None)
+        if memo is None or root_template is self:
+            key = None
+        else:
+            key = self._get_create_program_memo_key(parameters=parameters,
+                                                    measurement_mapping=measurement_mapping,
+                                                    channel_mapping=channel_mapping,
+                                                    global_transformation=global_transformation,
+                                                    to_single_waveform=to_single_waveform)
+        if key is None:
+            self._create_program_unmemoized(parameters=parameters,
+                                            measurement_mapping=measurement_mapping,
+                                            channel_mapping=channel_mapping,
+                                            global_transformation=global_transformation,
+                                            to_single_waveform=to_single_waveform,
+                                            parent_loop=parent_loop)
+            return
+
+        recorder = memo.get(key, None)
+        if recorder is None:
+            recorder = _ProgramRecorder()
+            self._create_program_unmemoized(parameters=parameters,
+                                            measurement_mapping=measurement_mapping,
+                                            channel_mapping=channel_mapping,
+                                            global_transformation=global_transformation,
+                                            to_single_waveform=to_single_waveform,
+                                            parent_loop=recorder)
+            memo[key] = recorder
+            # the recorded children are not modified during create_program so later hits can copy them from the tree
+            recorder.replay(parent_loop, copy=False)
+        else:
+            recorder.replay(parent_loop, copy=True)
+
+    def _get_create_program_memo_key(self, *,
+                                     parameters: Dict[str, Parameter],
+                                     measurement_mapping: Dict[str, Optional[str]],
+                                     channel_mapping: Dict[ChannelID, Optional[ChannelID]],
+                                     global_transformation: Optional[Transformation],
+                                     to_single_waveform: Set[Union[str, 'PulseTemplate']]) -> Optional[Hashable]:
+        """Key of everything the created program part depends on or None if it cannot be determined (missing or
+        unhashable parameter values)."""
+        def hashable_value(value):
+            if isinstance(value, numpy.ndarray):
+                # HashableNumpyArray compares element wise
+                return type(value), value.dtype.str, value.shape, value.tobytes()
+            return type(value), value
+
+        try:
+            parameter_values = frozenset((parameter_name, hashable_value(parameters[parameter_name].get_value()))
+                                         for parameter_name in self.parameter_names)
+            key = (self,
+                   parameter_values,
+                   frozenset((channel, channel_mapping.get(channel, channel)) for channel in self.defined_channels),
+                   frozenset((name, measurement_mapping.get(name, name)) for name in self.measurement_names),
+                   global_transformation,
+                   frozenset(to_single_waveform))
+            hash(key)
+        except (KeyError, TypeError):
+            return None
+        return key
+
+    def _create_program_unmemoized(self, *,
+                                   parameters: Dict[str, Parameter],
+                                   measurement_mapping: Dict[str, Optional[str]],
+                                   channel_mapping: Dict[ChannelID, Optional[ChannelID]],
+                                   global_transformation: Optional[Transformation],
+                                   to_single_waveform: Set[Union[str, 'PulseTemplate']],
+                                   parent_loop: Loop):
         if self.identifier in to_single_waveform or self in to_single_waveform:
             root = Loop()
 
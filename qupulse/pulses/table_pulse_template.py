@@ -7,7 +7,7 @@ Classes:
         declared parameters.
 """
 
-from typing import Union, Dict, List, Set, Optional, Any, Tuple, Sequence, NamedTuple
+from typing import Union, Dict, List, Set, Optional, Any, Tuple, Sequence, NamedTuple, Mapping
 import numbers
 import itertools
 import warnings
@@ -23,7 +23,7 @@ from qupulse.pulses.pulse_template import AtomicPulseTemplate, MeasurementDeclar
 from qupulse.pulses.interpolation import InterpolationStrategy, LinearInterpolationStrategy, \
     HoldInterpolationStrategy, JumpInterpolationStrategy
 from qupulse._program.waveforms import TableWaveform, TableWaveformEntry
-from qupulse.expressions import ExpressionScalar, Expression
+from qupulse.expressions import ExpressionScalar, ExpressionVector, Expression
 from qupulse.pulses.multi_channel_pulse_template import MultiChannelWaveform
 from qupulse.pulses.conditions import Condition
 
@@ -104,6 +104,7 @@ class TablePulseTemplate(AtomicPulseTemplate, ParameterConstrainer):
                 self._add_entry(channel, TableEntry(*entry))
 
         self._duration = self.calculate_duration()
+        self._entry_values = None  # type: Optional[ExpressionVector]
         self._table_parameters = set(
             var
             for channel_entries in self.entries.values()
@@ -155,24 +156,26 @@ class TablePulseTemplate(AtomicPulseTemplate, ParameterConstrainer):
     def entries(self) -> Dict[ChannelID, List[TableEntry]]:
         return self._entries
 
-    def get_entries_instantiated(self, parameters: Dict[str, numbers.Real]) \
-            -> Dict[ChannelID, List[TableWaveformEntry]]:
-        """Compute an instantiated list of the table's entries.
-
-        Args:
-            parameters (Dict(str -> Parameter)): A mapping of parameter names to Parameter objects.
-        Returns:
-             (float, float)-list of all table entries with concrete values provided by the given
-                parameters.
-        """
-        if not (self.table_parameters <= set(parameters.keys())):
-            raise ParameterNotProvidedException((self.table_parameters - set(parameters.keys())).pop())
-
+    def _get_entry_values(self) -> Optional[ExpressionVector]:
+        """All entry times and voltages as one expression vector [t_0, v_0, t_1, v_1, ...] in channel order or None if
+        a voltage is not scalar."""
+        if self._entry_values is None:
+            entries = [entry for channel_entries in self._entries.values() for entry in channel_entries]
+            if not all(isinstance(entry.v, ExpressionScalar) for entry in entries):
+                return None
+            self._entry_values = ExpressionVector([expression.underlying_expression
+                                                   for entry in entries
+                                                   for expression in (entry.t, entry.v)])
+        return self._entry_values
+
+    def _create_instantiated_entries(self, values: Sequence[numbers.Real]) -> Dict[ChannelID, List[TableWaveformEntry]]:
+        """Create the waveform entries from the flat [t_0, v_0, t_1, v_1, ...] values of one parameter set."""
         instantiated_entries = dict()  # type: Dict[ChannelID,List[TableWaveformEntry]]
 
+        values = iter(values)
         for channel, channel_entries in self._entries.items():
-            instantiated = [entry.instantiate(parameters)
-                            for entry in channel_entries]
+            instantiated = [TableWaveformEntry(t, v, entry.interp)
+                            for entry, t, v in zip(channel_entries, values, values)]
 
             # Add (0, v) entry if wf starts at finite time
             if instantiated[0].t > 0:
@@ -193,6 +196,56 @@ class TablePulseTemplate(AtomicPulseTemplate, ParameterConstrainer):
             instantiated_entries[channel] = instantiated
         return instantiated_entries
 
+    def get_entries_instantiated(self, parameters: Dict[str, numbers.Real]) \
+            -> Dict[ChannelID, List[TableWaveformEntry]]:
+        """Compute an instantiated list of the table's entries.
+
+        Args:
+            parameters (Dict(str -> Parameter)): A mapping of parameter names to Parameter objects.
+        Returns:
+             (float, float)-list of all table entries with concrete values provided by the given
+                parameters.
+        """
+        if not (self.table_parameters <= set(parameters.keys())):
+            raise ParameterNotProvidedException((self.table_parameters - set(parameters.keys())).pop())
+
+        entry_values = self._get_entry_values()
+        if entry_values is None:
+            values = [value
+                      for channel_entries in self._entries.values()
+                      for entry in channel_entries
+                      for value in entry.instantiate(parameters)[:2]]
+        else:
+            values = entry_values.evaluate_numeric_batch(parameters, batch_size=1)[0].tolist()
+        return self._create_instantiated_entries(values)
+
+    def get_entries_instantiated_batch(self,
+                                       parameters: Mapping[str, Union[Sequence[numbers.Real], numbers.Real]],
+                                       batch_size: Optional[int]=None) -> List[Dict[ChannelID,
+                                                                                    List[TableWaveformEntry]]]:
+        """Compute the instantiated entries for many parameter sets at once. All entry times and voltages are evaluated
+        with a single call of the compiled expression.
+
+        Args:
+            parameters: Maps each parameter name to a sequence with one value per parameter set. Scalar values are
+                used for all parameter sets.
+            batch_size: Number of parameter sets. Only required if no parameter is given as a sequence.
+        Returns:
+            The instantiated entries of each parameter set like get_entries_instantiated
+        Raises:
+            ValueError: If a voltage is not a scalar expression
+        """
+        if not (self.table_parameters <= set(parameters.keys())):
+            raise ParameterNotProvidedException((self.table_parameters - set(parameters.keys())).pop())
+
+        entry_values = self._get_entry_values()
+        if entry_values is None:
+            raise ValueError('Batch instantiation requires scalar voltages. Use get_entries_instantiated for each '
+                             'parameter set instead.')
+
+        return [self._create_instantiated_entries(values)
+                for values in entry_values.evaluate_numeric_batch(parameters, batch_size=batch_size).tolist()]
+
     @property
     def table_parameters(self) -> Set[str]:
         return self._table_parameters
@@ -257,13 +310,16 @@ class TablePulseTemplate(AtomicPulseTemplate, ParameterConstrainer):
                for channel in self.defined_channels):
             return None
 
-        instantiated = [(channel_mapping[channel], instantiated_channel)
-                        for channel, instantiated_channel in self.get_entries_instantiated(parameters).items()
-                        if channel_mapping[channel] is not None]
+        instantiated_entries = self.get_entries_instantiated(parameters)
 
-        if self.duration.evaluate_numeric(**parameters) == 0:
+        # all channels are padded to the duration
+        if next(iter(instantiated_entries.values()))[-1].t == 0:
             return None
 
+        instantiated = [(channel_mapping[channel], instantiated_channel)
+                        for channel, instantiated_channel in instantiated_entries.items()
+                        if channel_mapping[channel] is not None]
+
         waveforms = [TableWaveform(*ch_instantiated)
                      for ch_instantiated in instantiated]
 
@@ -1,7 +1,9 @@
-from typing import Union, Dict, Tuple, Any, Sequence, Optional
+from typing import Union, Dict, Tuple, Any, Sequence, Optional, NamedTuple, Callable, Hashable
 from numbers import Number
 from types import CodeType
+from collections import OrderedDict
 import warnings
+import threading
 
 import builtins
 import math
@@ -20,7 +22,8 @@ except ImportError:
 
 
 __all__ = ["sympify", "substitute_with_eval", "to_numpy", "get_variables", "get_free_symbols", "recursive_substitution",
-           "evaluate_lambdified", "get_most_simple_representation"]
+           "evaluate_lambdified", "get_most_simple_representation", "CacheStatistics", "LambdifyCache",
+           "lambdify_cache", "SympifyCache", "sympify_cache"]
 
 
 Sympifyable = Union[str, Number, sympy.Expr, numpy.str_]
@@ -120,6 +123,12 @@ def sympify(expr: Union[str, Number, sympy.Expr, numpy.str_], **kwargs) -> sympy
         # putting numpy.str_ in sympy.sympify behaves unexpected in version 1.1.1
         # It seems to ignore the locals argument
         expr = str(expr)
+    if isinstance(expr, str) and not kwargs:
+        return sympify_cache.get_sympified(expr)
+    return _sympify(expr, **kwargs)
+
+
+def _sympify(expr: Union[str, Number, sympy.Expr], **kwargs) -> sympy.Expr:
     try:
         return sympy.sympify(expr, **kwargs, locals=sympify_namespace)
     except TypeError as err:
@@ -219,11 +228,121 @@ def evaluate_compiled(expression: sympy.Expr,
     return result, compiled
 
 
+CacheStatistics = NamedTuple('CacheStatistics', [('hits', int),
+                                                 ('misses', int),
+                                                 ('evictions', int),
+                                                 ('n_entries', int),
+                                                 ('max_size', int)])
+
+
+class _LRUCache:
+    """Thread safe LRU cache with hit/miss/eviction counters. A max_size of 0 disables caching."""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries = OrderedDict()  # type: OrderedDict[Hashable, Any]
+        self._lock = threading.Lock()
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def _get_or_create(self, key: Hashable, create: Callable[[], Any]) -> Any:
+        with self._lock:
+            value = self._entries.get(key, None)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self._hits += 1
+                return value
+            self._misses += 1
+
+        value = create()
+
+        with self._lock:
+            if self._max_size > 0 and self._is_cacheable(value):
+                self._entries[key] = value
+                while len(self._entries) > self._max_size:
+                    self._entries.popitem(last=False)
+                    self._evictions += 1
+        return value
+
+    def _is_cacheable(self, value: Any) -> bool:
+        return True
+
+    @property
+    def max_size(self) -> int:
+        return self._max_size
+
+    @max_size.setter
+    def max_size(self, max_size: int):
+        if max_size < 0:
+            raise ValueError('max_size must not be negative', max_size)
+        with self._lock:
+            self._max_size = max_size
+            while len(self._entries) > self._max_size:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    @property
+    def statistics(self) -> CacheStatistics:
+        with self._lock:
+            return CacheStatistics(hits=self._hits, misses=self._misses, evictions=self._evictions,
+                                   n_entries=len(self._entries), max_size=self._max_size)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+    def reset_statistics(self) -> None:
+        with self._lock:
+            self._hits = self._misses = self._evictions = 0
+
+
+class SympifyCache(_LRUCache):
+    """Process wide LRU cache of the sympy expressions parsed from strings by sympify. sympy expressions are immutable
+    so the cached objects can be shared. Set max_size to 0 to disable the cache."""
+
+    def __init__(self, max_size: int=16384):
+        super().__init__(max_size)
+
+    def _is_cacheable(self, value: Any) -> bool:
+        # strings like '[1, 2]' are parsed to mutable python containers
+        return isinstance(value, sympy.Basic)
+
+    def get_sympified(self, expression: str) -> sympy.Expr:
+        return self._get_or_create(expression, lambda: _sympify(expression))
+
+
+sympify_cache = SympifyCache()
+
+
+class LambdifyCache(_LRUCache):
+    """Process wide LRU cache of lambdified expressions keyed by the expression and the variable tuple."""
+
+    def __init__(self, max_size: int=4096):
+        super().__init__(max_size)
+
+    @staticmethod
+    def _get_key(expression: Union[sympy.Expr, numpy.ndarray], variables: Sequence[str]) -> Hashable:
+        if isinstance(expression, numpy.ndarray):
+            expression_key = (expression.shape, tuple((type(element), element) for element in expression.flat))
+        else:
+            # sympy.Integer(1) == sympy.Float(1) but they lambdify to different result types
+            expression_key = (type(expression), expression)
+        return expression_key, tuple(variables)
+
+    def get_lambdified(self, expression: Union[sympy.Expr, numpy.ndarray], variables: Sequence[str]) -> Callable:
+        return self._get_or_create(self._get_key(expression, variables),
+                                   lambda: sympy.lambdify(variables, expression, _lambdify_modules))
+
+
+lambdify_cache = LambdifyCache()
+
+
 def evaluate_lambdified(expression: Union[sympy.Expr, numpy.ndarray],
                         variables: Sequence[str],
                         parameters: Dict[str, Union[numpy.ndarray, Number]],
                         lambdified) -> Tuple[Any, Any]:
-    lambdified = lambdified or sympy.lambdify(variables, expression, _lambdify_modules)
+    lambdified = lambdified or lambdify_cache.get_lambdified(expression, variables)
 
     return lambdified(**parameters), lambdified
 
@@ -17,6 +17,9 @@ _NodeType = TypeVar('_NodeType', bound='Node')
 
 
 class Node(Comparable):
+    # the parent is stored as a weak reference so nodes need to be weakly referenceable
+    __slots__ = ('__parent', '__children', '__parent_index', '__weakref__')
+
     debug = False
 
     def __init__(self: _NodeType,
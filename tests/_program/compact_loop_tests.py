@@ -0,0 +1,101 @@
+import unittest
+
+import numpy as np
+
+from qupulse._program._loop import Loop, to_waveform
+from qupulse._program._compact_loop import CompactLoop
+from tests.pulses.sequencing_dummies import DummyWaveform
+from tests._program import loop_tests
+
+
+class CompactLoopTests(unittest.TestCase):
+    def setUp(self):
+        self.waveforms = [DummyWaveform(duration=duration, sample_output=np.arange(4) + duration)
+                          for duration in (1, 2, 4)]
+
+    def get_test_loop(self) -> Loop:
+        waveforms = iter(self.waveforms * 4)
+        loop = loop_tests.LoopTests.get_test_loop(lambda: next(waveforms))
+        loop.add_measurements([('a', 0, 1)])
+        loop[1].add_measurements([('b', 1, 2), ('a', 3, 1)])
+        loop[2][0][1].add_measurements([('b', .5, 1)])
+        loop[4][1][0].add_measurements([('a', 0, 1)])
+        return loop
+
+    def test_init_invalid(self):
+        with self.assertRaisesRegex(ValueError, 'root'):
+            CompactLoop([], [], [], [], [], [0], [], [], [], [])
+        with self.assertRaisesRegex(ValueError, 'same length'):
+            CompactLoop([-1], [1], [1, 1], [-1], [], [0, 0], [], [], [], [])
+
+    def test_from_loop(self):
+        wf_1, wf_2, _ = self.waveforms
+        loop = Loop(children=[Loop(waveform=wf_1, repetition_count=3, measurements=[('m', 1, 2)]),
+                              Loop(children=[Loop(waveform=wf_2), Loop(waveform=wf_1)], repetition_count=2)],
+                    measurements=[('n', 0, 1), ('m', 2, 1)])
+        compact = CompactLoop.from_loop(loop)
+
+        self.assertEqual(5, len(compact))
+        np.testing.assert_equal(compact.parents, [-1, 0, 0, 2, 2])
+        np.testing.assert_equal(compact.subtree_ends, [5, 2, 5, 4, 5])
+        np.testing.assert_equal(compact.repetition_counts, [1, 3, 2, 1, 1])
+        np.testing.assert_equal(compact.waveform_ids, [-1, 0, -1, 1, 0])
+        self.assertEqual((wf_1, wf_2), compact.waveforms)
+        self.assertEqual(('n', 'm'), compact.measurement_names)
+
+        self.assertEqual([1, 2], compact.get_children(0))
+        self.assertEqual([3, 4], compact.get_children(2))
+        self.assertTrue(compact.is_leaf(1))
+        self.assertFalse(compact.is_leaf(2))
+        self.assertEqual([('n', 0, 1), ('m', 2, 1)], compact.get_measurements(0))
+        self.assertEqual([('m', 1, 2)], compact.get_measurements(1))
+        self.assertEqual([], compact.get_measurements(2))
+
+        np.testing.assert_equal(compact.body_durations, [9, 1, 3, 2, 1])
+        self.assertEqual(9, compact.duration)
+
+    def test_to_loop(self):
+        loop = self.get_test_loop()
+        self.assertEqual(loop, CompactLoop.from_loop(loop).to_loop())
+
+        leaf = Loop(waveform=self.waveforms[0], repetition_count=4)
+        self.assertEqual(leaf, CompactLoop.from_loop(leaf).to_loop())
+
+    def test_get_measurement_windows(self):
+        loop = self.get_test_loop()
+        expected = loop.get_measurement_windows()
+        measurement_windows = CompactLoop.from_loop(loop).get_measurement_windows()
+
+        self.assertEqual(expected.keys(), measurement_windows.keys())
+        for name, (begins, lengths) in expected.items():
+            np.testing.assert_equal(begins, measurement_windows[name][0])
+            np.testing.assert_equal(lengths, measurement_windows[name][1])
+
+        self.assertEqual({}, CompactLoop.from_loop(Loop(waveform=self.waveforms[0])).get_measurement_windows())
+
+    def test_flatten_and_balance(self):
+        loop = self.get_test_loop()
+        loop[1][0].encapsulate()
+        compact = CompactLoop.from_loop(loop)
+
+        for depth in range(6):
+            expected = loop.copy_tree_structure()
+            expected.flatten_and_balance(depth)
+
+            balanced = compact.flatten_and_balance(depth)
+            self.assertEqual(expected, balanced.to_loop())
+            self.assertEqual(compact.waveforms, balanced.waveforms)
+
+    def test_to_waveform(self):
+        loop = self.get_test_loop()
+        self.assertEqual(to_waveform(loop), CompactLoop.from_loop(loop).to_waveform())
+        self.assertEqual(to_waveform(loop[1]), CompactLoop.from_loop(loop[1]).to_waveform())
+        self.assertIs(self.waveforms[0], CompactLoop.from_loop(Loop(waveform=self.waveforms[0])).to_waveform())
+
+    def test_to_waveform_shares_identical_subtrees(self):
+        wf_1, wf_2, _ = self.waveforms
+        loop = Loop(children=[Loop(children=[Loop(waveform=wf_1), Loop(waveform=wf_2)], repetition_count=2),
+                              Loop(waveform=wf_1),
+                              Loop(children=[Loop(waveform=wf_1), Loop(waveform=wf_2)], repetition_count=2)])
+        first, _, third = CompactLoop.from_loop(loop).to_waveform()._sequenced_waveforms
+        self.assertIs(first, third)
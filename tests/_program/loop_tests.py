@@ -4,8 +4,11 @@ import itertools
 
 from string import ascii_uppercase
 
-from qupulse.utils.types import time_from_float
-from qupulse._program._loop import Loop, MultiChannelProgram, _make_compatible, _is_compatible, _CompatibilityLevel, RepetitionWaveform, SequenceWaveform, make_compatible
+import numpy as np
+
+from qupulse.utils.types import time_from_float, TimeType
+from qupulse._program._loop import Loop, MultiChannelProgram, _make_compatible, _is_compatible, _CompatibilityLevel, RepetitionWaveform, SequenceWaveform, make_compatible,\
+    _get_compatibility_levels, to_waveform
 from qupulse._program.instructions import InstructionBlock, ImmutableInstructionBlock
 from tests.pulses.sequencing_dummies import DummyWaveform
 from qupulse.pulses.multi_channel_pulse_template import MultiChannelWaveform
@@ -390,6 +393,37 @@ LOOP 1 times:
         with self.assertWarnsRegex(UserWarning, 'Dropping measurement since there is no waveform in children'):
             root.cleanup()
 
+    def test_get_measurement_windows(self):
+        wf_1 = DummyWaveform(duration=1)
+        wf_2 = DummyWaveform(duration=2)
+        root = Loop(children=[Loop(waveform=wf_1, measurements=[('a', 0.5, 0.25)]),
+                              Loop(children=[Loop(waveform=wf_2, repetition_count=2, measurements=[('b', 1, 1)]),
+                                             Loop(waveform=wf_1)],
+                                   repetition_count=2, measurements=[('a', 0, 1), ('a', 0, 0.5)])],
+                    repetition_count=2, measurements=[('b', 0, 3)])
+
+        measurement_windows = root.get_measurement_windows()
+        self.assertEqual({'a', 'b'}, measurement_windows.keys())
+
+        # sorted by begin and length
+        np.testing.assert_equal(measurement_windows['a'], ([0.5, 1, 1, 6, 6, 11.5, 12, 12, 17, 17],
+                                                           [0.25, 0.5, 1, 0.5, 1, 0.25, 0.5, 1, 0.5, 1]))
+        np.testing.assert_equal(measurement_windows['b'], ([0, 2, 4, 7, 9, 11, 13, 15, 18, 20],
+                                                           [3, 1, 1, 1, 1, 3, 1, 1, 1, 1]))
+
+        self.assertEqual({}, Loop(children=[Loop(waveform=wf_1)]).get_measurement_windows())
+
+    def test_get_measurement_windows_offset_precision(self):
+        wf = DummyWaveform()
+        wf.duration_ = TimeType(1, 3)
+        n_children = 30000
+        root = Loop(children=[Loop(waveform=wf, measurements=[('m', 0, 1)]) for _ in range(n_children)])
+
+        begins, lengths = root.get_measurement_windows()['m']
+        self.assertEqual(len(begins), n_children)
+        self.assertEqual(begins[-1], float(TimeType(n_children - 1, 3)))
+        np.testing.assert_equal(begins, [float(TimeType(i, 3)) for i in range(n_children)])
+
 
 class MultiChannelTests(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -629,16 +663,81 @@ class ProgramWaveformCompatibilityTest(unittest.TestCase):
                           sample_rate=time_from_float(1.))
         priv_kwargs = dict(min_len=5, quantum=10, sample_rate=time_from_float(1.))
 
-        with mock.patch('qupulse._program._loop._is_compatible',
-                        return_value=_CompatibilityLevel.incompatible) as mocked:
+        levels = {id(program): (TimeType(0), _CompatibilityLevel.incompatible)}
+        with mock.patch('qupulse._program._loop._get_compatibility_levels', return_value=levels) as mocked:
             with self.assertRaisesRegex(ValueError, 'cannot be made compatible'):
                 make_compatible(program, **pub_kwargs)
             mocked.assert_called_once_with(program, **priv_kwargs)
 
-        with mock.patch('qupulse._program._loop._is_compatible',
-                        return_value=_CompatibilityLevel.action_required) as is_compat:
+        levels = {id(program): (TimeType(0), _CompatibilityLevel.action_required)}
+        with mock.patch('qupulse._program._loop._get_compatibility_levels', return_value=levels) as get_levels:
             with mock.patch('qupulse._program._loop._make_compatible') as make_compat:
                 make_compatible(program, **pub_kwargs)
 
-                is_compat.assert_called_once_with(program, **priv_kwargs)
-                make_compat.assert_called_once_with(program, **priv_kwargs)
+                get_levels.assert_called_once_with(program, **priv_kwargs)
+                make_compat.assert_called_once_with(program, **priv_kwargs, compatibility_levels=levels,
+                                                    waveform_builder=mock.ANY)
+
+    def test_get_compatibility_levels(self):
+        wf1 = DummyWaveform(duration=1.5)
+        wf2 = DummyWaveform(duration=2.0)
+
+        program = Loop(children=[Loop(children=[Loop(waveform=wf1, repetition_count=2),
+                                                Loop(waveform=wf2)], repetition_count=2),
+                                 Loop(waveform=wf2, repetition_count=3)])
+        levels = _get_compatibility_levels(program, min_len=1, quantum=1, sample_rate=time_from_float(1.))
+
+        self.assertEqual({id(loop) for loop in program.get_breadth_first_iterator()}, set(levels.keys()))
+        self.assertEqual((16, _CompatibilityLevel.action_required), levels[id(program)])
+        self.assertEqual((10, _CompatibilityLevel.action_required), levels[id(program[0])])
+        self.assertEqual((3, _CompatibilityLevel.action_required), levels[id(program[0][0])])
+        self.assertEqual((2, _CompatibilityLevel.compatible), levels[id(program[0][1])])
+        self.assertEqual((6, _CompatibilityLevel.compatible), levels[id(program[1])])
+
+        for loop in program.get_breadth_first_iterator():
+            self.assertEqual(_is_compatible(loop, min_len=1, quantum=1, sample_rate=time_from_float(1.)),
+                             levels[id(loop)][1])
+
+    def test_make_compatible_reuses_levels(self):
+        wf1 = DummyWaveform(duration=1.5)
+        wf2 = DummyWaveform(duration=2.0)
+
+        program = Loop(children=[Loop(children=[Loop(children=[Loop(waveform=wf1, repetition_count=2),
+                                                               Loop(waveform=wf2)])]),
+                                 Loop(waveform=wf2)])
+        expected = Loop(children=[Loop(children=[Loop(children=[Loop(waveform=RepetitionWaveform(wf1, 2)),
+                                                                Loop(waveform=wf2)])]),
+                                  Loop(waveform=wf2)])
+
+        with mock.patch('qupulse._program._loop._get_compatibility_levels',
+                        wraps=_get_compatibility_levels) as get_levels:
+            make_compatible(program, minimal_waveform_length=1, waveform_quantum=1, sample_rate=time_from_float(1.))
+            get_levels.assert_called_once()
+        self.assertEqual(expected, program)
+
+    def test_to_waveform_shares_identical_subtrees(self):
+        wf1 = DummyWaveform(duration=1, sample_output=[1, 2])
+        wf2 = DummyWaveform(duration=2, sample_output=[3, 4])
+        wf1_copy = DummyWaveform(duration=1, sample_output=[1, 2])
+
+        program = Loop(children=[Loop(children=[Loop(waveform=wf1), Loop(waveform=wf2)], repetition_count=3),
+                                 Loop(children=[Loop(waveform=wf1_copy), Loop(waveform=wf2)], repetition_count=3),
+                                 Loop(waveform=wf2)])
+        waveform = to_waveform(program)
+
+        expected_part = RepetitionWaveform(SequenceWaveform([wf1, wf2]), 3)
+        self.assertEqual(SequenceWaveform([expected_part, expected_part, wf2]), waveform)
+        first, second, third = waveform._sequenced_waveforms
+        self.assertIs(first, second)
+        self.assertIs(wf2, third)
+
+    def test_make_compatible_shares_waveforms(self):
+        wf1 = DummyWaveform(duration=1.5, sample_output=[1, 2])
+        wf2 = DummyWaveform(duration=2.0, sample_output=[3, 4])
+
+        program = Loop(children=[Loop(children=[Loop(waveform=wf1, repetition_count=2), Loop(waveform=wf2)]),
+                                 Loop(children=[Loop(waveform=wf1, repetition_count=2), Loop(waveform=wf2)])])
+        make_compatible(program, minimal_waveform_length=1, waveform_quantum=1, sample_rate=time_from_float(1.))
+
+        self.assertEqual(RepetitionWaveform(wf1, 2), program[0][0].waveform)
+        self.assertIs(program[0][0].waveform, program[1][0].waveform)
@@ -1,4 +1,7 @@
 import unittest
+import pickle
+import gc
+import weakref
 from unittest import mock
 
 import numpy
@@ -7,9 +10,12 @@ import numpy as np
 from qupulse.utils.types import time_from_float
 from qupulse.pulses.interpolation import HoldInterpolationStrategy, LinearInterpolationStrategy,\
     JumpInterpolationStrategy
+from qupulse.expressions import ExpressionScalar
+from qupulse._program import waveforms as waveforms_module
 from qupulse._program.waveforms import MultiChannelWaveform, RepetitionWaveform, SequenceWaveform,\
-    TableWaveformEntry, TableWaveform, TransformingWaveform, SubsetWaveform
-from qupulse._program.transformation import Transformation
+    TableWaveformEntry, TableWaveform, TransformingWaveform, SubsetWaveform, Waveform, SampleGrid, SampleCache,\
+    FunctionWaveform
+from qupulse._program.transformation import Transformation, IdentityTransformation
 
 from tests.pulses.sequencing_dummies import DummyWaveform, DummyInterpolationStrategy
 from tests._program.transformation_tests import TransformationStub
@@ -43,6 +49,33 @@ class WaveformTest(unittest.TestCase):
         self.assertIs(wf.get_sampled('A', sample_times=numpy.arange(2)),
                       wf.get_sampled('A', sample_times=numpy.arange(2)))
 
+    def test_get_sampled_sample_cache(self):
+        previous_cache = Waveform.get_sample_cache()
+        try:
+            cache = SampleCache()
+            Waveform.set_sample_cache(cache)
+            wf = DummyWaveform(duration=2., defined_channels={'A'})
+
+            sampled = wf.get_sampled('A', sample_times=numpy.linspace(0, 2, num=5))
+            self.assertFalse(sampled.flags.writeable)
+            self.assertIs(sampled, wf.get_sampled('A', sample_times=numpy.arange(5) / 2.))
+            self.assertEqual(len(wf.sample_calls), 1)
+            self.assertEqual((cache.statistics.hits, cache.statistics.misses), (1, 1))
+
+            # sample times that differ by rounding are sampled again
+            wf.get_sampled('A', sample_times=numpy.array([0., 0.5, 1., 1.5, numpy.nextafter(2., 0.)]))
+            self.assertEqual(len(wf.sample_calls), 2)
+
+            wf.get_sampled('A', sample_times=numpy.array([0., 1., 1.5]))
+            wf.get_sampled('A', sample_times=numpy.array([0., 1., 1.5]))
+            self.assertEqual(len(wf.sample_calls), 3)
+
+            Waveform.set_sample_cache(None)
+            self.assertIsNone(Waveform.get_sample_cache())
+            self.assertIsNot(sampled, wf.get_sampled('A', sample_times=numpy.linspace(0, 2, num=5)))
+        finally:
+            Waveform.set_sample_cache(previous_cache)
+
     def test_get_sampled_empty(self):
         wf = DummyWaveform(duration=2., defined_channels={'A', 'B'})
 
@@ -90,6 +123,156 @@ class WaveformTest(unittest.TestCase):
         wf_sub = wf_ab.get_subset_for_channels({'A'})
         self.assertEqual(wf_sub.defined_channels, {'A'})
 
+    def test_hash_is_cached(self):
+        wf = SequenceWaveform([DummyWaveform(duration=1., sample_output=[1, 2]),
+                               DummyWaveform(duration=2., sample_output=[3, 4])])
+
+        with mock.patch.object(SequenceWaveform, 'compare_key',
+                               new_callable=mock.PropertyMock, return_value=wf.compare_key) as compare_key:
+            self.assertEqual(hash(wf), hash(wf))
+            compare_key.assert_called_once_with()
+
+            self.assertEqual(wf, wf)
+            compare_key.assert_called_once_with()
+
+    def test_eq_hash_shortcut(self):
+        wf_1 = RepetitionWaveform(DummyWaveform(duration=1., sample_output=[1, 2]), 2)
+        wf_2 = RepetitionWaveform(DummyWaveform(duration=1., sample_output=[1, 2]), 3)
+        wf_3 = RepetitionWaveform(DummyWaveform(duration=1., sample_output=[1, 2]), 2)
+
+        hash(wf_1), hash(wf_2)
+        with mock.patch.object(RepetitionWaveform, 'compare_key', new_callable=mock.PropertyMock) as compare_key:
+            self.assertNotEqual(wf_1, wf_2)
+            compare_key.assert_not_called()
+        self.assertEqual(wf_1, wf_3)
+
+    def test_pickle(self):
+        wf = SequenceWaveform([DummyWaveform(duration=1., sample_output=[1, 2]),
+                               RepetitionWaveform(DummyWaveform(duration=2., sample_output=[3, 4]), 2)])
+        hash(wf)
+        unpickled = pickle.loads(pickle.dumps(wf))
+        self.assertFalse(hasattr(unpickled, '_hash'))
+        self.assertEqual(wf, unpickled)
+        self.assertEqual(hash(wf), hash(unpickled))
+
+        # every waveform class of the module
+        table_a = TableWaveform('A', [(0, 0, HoldInterpolationStrategy()), (1, 1, LinearInterpolationStrategy())])
+        table_b = TableWaveform('B', [(0, 1, HoldInterpolationStrategy()), (1, 0, LinearInterpolationStrategy())])
+        transformed = TransformingWaveform(table_a, IdentityTransformation())
+        sample_times = numpy.linspace(0, 1, num=5)
+        # fills the sample cache
+        transformed.unsafe_sample('A', sample_times)
+
+        waveforms = [table_a,
+                     FunctionWaveform(ExpressionScalar('sin(2*pi*t)'), 1, 'A'),
+                     SequenceWaveform([table_a, table_a]),
+                     MultiChannelWaveform([table_a, table_b]),
+                     RepetitionWaveform(table_a, 2),
+                     transformed,
+                     SubsetWaveform(MultiChannelWaveform([table_a, table_b]), {'A'})]
+        self.assertEqual({type(wf) for wf in waveforms},
+                         {cls for cls in vars(waveforms_module).values()
+                          if isinstance(cls, type) and issubclass(cls, Waveform) and cls is not Waveform})
+
+        for wf in waveforms:
+            hash(wf)
+            unpickled = pickle.loads(pickle.dumps(wf))
+            self.assertFalse(hasattr(unpickled, '_hash'), type(wf))
+            self.assertEqual(wf, unpickled)
+            self.assertEqual(hash(wf), hash(unpickled))
+            np.testing.assert_equal(unpickled.get_sampled('A', sample_times), wf.get_sampled('A', sample_times))
+
+    def test_slots(self):
+        table_wf = TableWaveform('A', [(0, 0, HoldInterpolationStrategy()), (1, 1, HoldInterpolationStrategy())])
+        for wf in (table_wf, SequenceWaveform([table_wf, table_wf]), RepetitionWaveform(table_wf, 2),
+                   MultiChannelWaveform([table_wf]), SubsetWaveform(table_wf, {'A'})):
+            self.assertFalse(hasattr(wf, '__dict__'), type(wf))
+
+
+class SampleGridTests(unittest.TestCase):
+    def test_from_sample_times(self):
+        self.assertEqual(SampleGrid.from_sample_times(numpy.array([3.]))[:3], (3., 0., 1))
+        self.assertEqual(SampleGrid.from_sample_times(numpy.array([1., 3.]))[:3], (1., 2., 2))
+        self.assertEqual(SampleGrid.from_sample_times(numpy.arange(11) / 2.)[:3], (0., 0.5, 11))
+        self.assertEqual(SampleGrid.from_sample_times(numpy.arange(11) / 2.),
+                         SampleGrid.from_sample_times(numpy.linspace(0, 5, num=11)))
+        self.assertEqual(SampleGrid.from_sample_times(numpy.arange(0, 20, 2) / 2.4),
+                         SampleGrid.from_sample_times((numpy.arange(20) / 2.4)[::2]))
+
+        # equal up to rounding
+        divided_times = numpy.arange(1000) / 1e9
+        multiplied_times = numpy.arange(1000) * 1e-9
+        self.assertFalse(numpy.array_equal(divided_times, multiplied_times))
+        numpy.testing.assert_allclose(divided_times, multiplied_times)
+        self.assertNotEqual(SampleGrid.from_sample_times(divided_times),
+                            SampleGrid.from_sample_times(multiplied_times))
+        self.assertNotEqual(SampleGrid.from_sample_times(numpy.array([0., 1.])),
+                            SampleGrid.from_sample_times(numpy.array([0., numpy.nextafter(1., 2.)])))
+
+
+class SampleCacheTests(unittest.TestCase):
+    def test_lru_eviction(self):
+        cache = SampleCache(max_bytes=2 * 8 * 10)
+        wf_a = DummyWaveform(duration=1., defined_channels={'A'})
+        wf_b = DummyWaveform(duration=2., defined_channels={'A'})
+        grid = SampleGrid.from_sample_times(numpy.arange(10) / 10)
+
+        data_a = numpy.zeros(10)
+        data_b = numpy.ones(10)
+        data_c = numpy.full(10, 2.)
+
+        self.assertIsNone(cache.get(wf_a, 'A', grid))
+        cache.put(wf_a, 'A', grid, data_a)
+        cache.put(wf_b, 'A', grid, data_b)
+        self.assertIs(cache.get(wf_a, 'A', grid), data_a)
+
+        cache.put(wf_a, 'B', grid, data_c)
+        self.assertIsNone(cache.get(wf_b, 'A', grid))
+        self.assertIs(cache.get(wf_a, 'A', grid), data_a)
+        self.assertIs(cache.get(wf_a, 'B', grid), data_c)
+
+        self.assertEqual(tuple(cache.statistics), (3, 2, 1, 2, 160, 160))
+
+        cache.max_bytes = 80
+        self.assertEqual(cache.statistics.evictions, 2)
+        self.assertIsNone(cache.get(wf_a, 'A', grid))
+
+        cache.put(wf_b, 'A', grid, numpy.zeros(11))
+        self.assertEqual(cache.statistics.n_entries, 1)
+
+        cache.clear()
+        cache.reset_statistics()
+        self.assertEqual(tuple(cache.statistics), (0, 0, 0, 0, 0, 80))
+
+        with self.assertRaises(ValueError):
+            SampleCache(-1)
+
+    def test_weak_waveform_references(self):
+        cache = SampleCache()
+        wf_a = DummyWaveform(duration=1., defined_channels={'A'})
+        wf_b = DummyWaveform(duration=2., defined_channels={'A'})
+        grid = SampleGrid.from_sample_times(numpy.arange(10) / 10)
+
+        cache.put(wf_a, 'A', grid, numpy.zeros(10))
+        cache.put(wf_a, 'B', grid, numpy.zeros(10))
+        cache.put(wf_b, 'A', grid, numpy.ones(10))
+        self.assertEqual(cache.statistics.n_entries, 3)
+
+        # the cache does not keep waveforms alive and forgets their samples
+        wf_a_ref = weakref.ref(wf_a)
+        del wf_a
+        gc.collect()
+        self.assertIsNone(wf_a_ref())
+        self.assertEqual(cache.statistics.n_entries, 1)
+        self.assertEqual(cache.statistics.n_bytes, 80)
+        numpy.testing.assert_equal(cache.get(wf_b, 'A', grid), numpy.ones(10))
+
+        # evicted entries of collected waveforms are not removed twice
+        cache.max_bytes = 0
+        del wf_b
+        gc.collect()
+        self.assertEqual(tuple(cache.statistics)[3:5], (0, 0))
+
 
 class MultiChannelWaveformTest(unittest.TestCase):
     def test_init_no_args(self) -> None:
@@ -262,6 +445,39 @@ class RepetitionWaveformTest(unittest.TestCase):
         self.assertIs(output_expected, output_received)
         np.testing.assert_equal(output_received, inner_sample_times)
 
+    def test_unsafe_sample_tiled(self):
+        body_wf = DummyWaveform(duration=8)
+        rwf = RepetitionWaveform(body=body_wf, repetition_count=1000)
+
+        sample_times = np.arange(8000.)
+        result = rwf.unsafe_sample(channel='A', sample_times=sample_times)
+        np.testing.assert_equal(result, np.tile(np.arange(8.), 1000))
+        self.assertEqual(len(body_wf.sample_calls), 1)
+        self.assertEqual(body_wf.sample_calls[0][1], list(np.arange(8.)))
+
+    def test_unsafe_sample_non_uniform(self):
+        body = TableWaveform('A', [(0, 0., HoldInterpolationStrategy()),
+                                   (0.3, 1., LinearInterpolationStrategy()),
+                                   (1.1, -1., JumpInterpolationStrategy())])
+        rwf = RepetitionWaveform(body=body, repetition_count=17)
+        sample_times = np.sort(np.random.RandomState(42).uniform(0, float(rwf.duration), size=1000))
+
+        expected = np.empty_like(sample_times)
+        time = 0
+        for _ in range(17):
+            end = time + body.duration
+            indices = slice(*np.searchsorted(sample_times, (float(time), float(end)), 'left'))
+            body.unsafe_sample(channel='A', sample_times=sample_times[indices] - float(time),
+                               output_array=expected[indices])
+            time = end
+
+        np.testing.assert_equal(rwf.unsafe_sample(channel='A', sample_times=sample_times), expected)
+
+        output_array = np.full(1002, np.nan)
+        rwf.unsafe_sample(channel='A', sample_times=sample_times, output_array=output_array[1:-1])
+        np.testing.assert_equal(output_array[1:-1], expected)
+        self.assertTrue(np.isnan(output_array[0]) and np.isnan(output_array[-1]))
+
 
 class SequenceWaveformTest(unittest.TestCase):
     def __init__(self, *args, **kwargs) -> None:
@@ -418,6 +634,40 @@ class TableWaveformTests(unittest.TestCase):
         self.assertIs(output_expected, output_received)
         numpy.testing.assert_equal(expected_result, output_received)
 
+    def test_unsafe_sample_builtin_strategies(self) -> None:
+        hold, linear, jump = HoldInterpolationStrategy(), LinearInterpolationStrategy(), JumpInterpolationStrategy()
+        dummy = DummyInterpolationStrategy()
+        entries = [TableWaveformEntry(0, 1., hold),
+                   TableWaveformEntry(1, 2., linear),
+                   TableWaveformEntry(2, -1., jump),
+                   TableWaveformEntry(2, 3., hold),
+                   TableWaveformEntry(3.5, 0., linear),
+                   TableWaveformEntry(4, 2., dummy),
+                   TableWaveformEntry(5, 2.5, hold)]
+        waveform = TableWaveform('A', entries)
+        sample_times = numpy.linspace(0, 5, num=21)
+
+        expected = numpy.empty_like(sample_times)
+        for entry1, entry2 in zip(waveform._table[:-1], waveform._table[1:]):
+            indices = slice(numpy.searchsorted(sample_times, entry1.t, 'left'),
+                            numpy.searchsorted(sample_times, entry2.t, 'right'))
+            expected[indices] = entry2.interp((entry1.t, entry1.v), (entry2.t, entry2.v), sample_times[indices])
+
+        result = waveform.unsafe_sample('A', sample_times)
+        numpy.testing.assert_equal(expected, result)
+        self.assertEqual(dummy.call_arguments[-1], ((3.5, 0.), (4, 2.), [3.5, 3.75]))
+
+        output_array = numpy.full_like(sample_times, numpy.nan)
+        self.assertIs(output_array, waveform.unsafe_sample('A', sample_times, output_array=output_array))
+        numpy.testing.assert_equal(expected, output_array)
+
+        # sample times with an exact time offset subtracted are an object array
+        object_sample_times = sample_times + time_from_float(0.) - time_from_float(0.)
+        self.assertEqual(object_sample_times.dtype, object)
+        numpy.testing.assert_equal(expected, waveform.unsafe_sample('A', object_sample_times))
+        numpy.testing.assert_equal(expected, waveform.unsafe_sample('A', object_sample_times,
+                                                                    output_array=numpy.empty_like(sample_times)))
+
     def test_simple_properties(self):
         interp = DummyInterpolationStrategy()
         entries = [TableWaveformEntry(0, 0, interp),
@@ -0,0 +1,53 @@
+"""Compares memory usage and traversal time of Loop and CompactLoop for a large scan program.
+
+The program has n_outer repetitions of a scan line with n_inner points. Each point has its own waveform and a
+measurement window. Memory is measured with tracemalloc while the program is built.
+
+Run with ``python -m tests.benchmarks.compact_loop_benchmark``."""
+import time
+import tracemalloc
+
+from qupulse._program._loop import Loop
+from qupulse._program._compact_loop import CompactLoop
+from tests.pulses.sequencing_dummies import DummyWaveform
+
+
+def create_scan_program(n_outer: int, n_inner: int) -> Loop:
+    waveforms = [DummyWaveform(duration=16 * (1 + i % 7)) for i in range(n_inner)]
+    return Loop(children=[Loop(children=[Loop(waveform=waveform, measurements=[('m', 2, 4)])
+                                         for waveform in waveforms],
+                               measurements=[('line', 0, 8)])
+                          for _ in range(n_outer)])
+
+
+def measure_memory(function):
+    tracemalloc.start()
+    result = function()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated
+
+
+def measure_time(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run_benchmark(sizes=((100, 100), (100, 1000), (1000, 1000))):
+    print('{:>8} {:>14} {:>17} {:>14} {:>12} {:>15}'.format('nodes', 'Loop [B/node]', 'Compact [B/node]',
+                                                            'from_loop [s]', 'Loop MW [s]', 'Compact MW [s]'))
+    for n_outer, n_inner in sizes:
+        loop, loop_memory = measure_memory(lambda: create_scan_program(n_outer, n_inner))
+        compact, compact_memory = measure_memory(lambda: CompactLoop.from_loop(loop))
+        n_nodes = len(compact)
+
+        print('{:>8} {:>14.1f} {:>17.1f} {:>14.3f} {:>12.3f} {:>15.3f}'.format(
+            n_nodes, loop_memory / n_nodes, compact_memory / n_nodes,
+            measure_time(lambda: CompactLoop.from_loop(loop)),
+            measure_time(loop.get_measurement_windows),
+            measure_time(compact.get_measurement_windows)))
+
+
+if __name__ == '__main__':
+    run_benchmark()
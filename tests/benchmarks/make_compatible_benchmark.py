@@ -0,0 +1,111 @@
+"""Compares make_compatible with the former implementation that recomputed the compatibility of every subtree on each
+level of the recursion.
+
+The synthetic programs are trees with the given depth and branching factor. Two thirds of the leaves repeat a waveform
+whose length is not a multiple of the waveform quantum so every inner loop requires action.
+
+Run with ``python -m tests.benchmarks.make_compatible_benchmark``."""
+import timeit
+
+import numpy as np
+
+from qupulse.utils import is_integer
+from qupulse.utils.types import TimeType
+from qupulse._program._loop import Loop, make_compatible, to_waveform, _CompatibilityLevel
+from tests.pulses.sequencing_dummies import DummyWaveform
+
+
+def former_is_compatible(program: Loop, min_len: int, quantum: int, sample_rate: TimeType) -> _CompatibilityLevel:
+    program_duration_in_samples = program.duration * sample_rate
+
+    if program_duration_in_samples.denominator != 1:
+        return _CompatibilityLevel.incompatible
+
+    if program_duration_in_samples < min_len or program_duration_in_samples % quantum > 0:
+        return _CompatibilityLevel.incompatible
+
+    if program.is_leaf():
+        waveform_duration_in_samples = program.body_duration * sample_rate
+        if waveform_duration_in_samples < min_len or (waveform_duration_in_samples / quantum).denominator != 1:
+            return _CompatibilityLevel.action_required
+        else:
+            return _CompatibilityLevel.compatible
+    else:
+        if all(former_is_compatible(sub_program, min_len, quantum, sample_rate) == _CompatibilityLevel.compatible
+               for sub_program in program):
+            return _CompatibilityLevel.compatible
+        else:
+            return _CompatibilityLevel.action_required
+
+
+def former_make_compatible_recursion(program: Loop, min_len: int, quantum: int, sample_rate: TimeType) -> None:
+    if program.is_leaf():
+        program.waveform = to_waveform(program.copy_tree_structure())
+        program.repetition_count = 1
+
+    else:
+        comp_levels = np.array([former_is_compatible(sub_program, min_len, quantum, sample_rate)
+                                for sub_program in program])
+        incompatible = comp_levels == _CompatibilityLevel.incompatible
+        if np.any(incompatible):
+            single_run = program.duration * sample_rate / program.repetition_count
+            if is_integer(single_run / quantum) and single_run >= min_len:
+                new_repetition_count = program.repetition_count
+                program.repetition_count = 1
+            else:
+                new_repetition_count = 1
+            program.waveform = to_waveform(program.copy_tree_structure())
+            program.repetition_count = new_repetition_count
+            program[:] = []
+            return
+        else:
+            for sub_program, comp_level in zip(program, comp_levels):
+                if comp_level == _CompatibilityLevel.action_required:
+                    former_make_compatible_recursion(sub_program, min_len, quantum, sample_rate)
+
+
+def former_make_compatible(program: Loop, minimal_waveform_length: int, waveform_quantum: int,
+                           sample_rate: TimeType) -> None:
+    comp_level = former_is_compatible(program, minimal_waveform_length, waveform_quantum, sample_rate)
+    if comp_level == _CompatibilityLevel.incompatible:
+        raise ValueError('The program cannot be made compatible to restrictions')
+    elif comp_level == _CompatibilityLevel.action_required:
+        former_make_compatible_recursion(program, minimal_waveform_length, waveform_quantum, sample_rate)
+
+
+def create_program(depth: int, branching: int) -> Loop:
+    waveforms = [DummyWaveform(duration=8 * (1 + i % 3), sample_output=np.full(8, i)) for i in range(branching)]
+
+    def create_subprogram(level: int) -> Loop:
+        if level == depth:
+            return Loop(children=[Loop(waveform=waveform, repetition_count=2) for waveform in waveforms])
+        return Loop(children=[create_subprogram(level + 1) for _ in range(branching)], repetition_count=2)
+    return create_subprogram(1)
+
+
+def run_benchmark(shapes=((2, 100), (4, 10), (8, 3), (12, 2), (200, 1)), repeat: int = 3):
+    kwargs = dict(minimal_waveform_length=16, waveform_quantum=16, sample_rate=TimeType(1))
+
+    print('{:>6} {:>10} {:>8} {:>12} {:>12} {:>8}'.format('depth', 'branching', 'loops',
+                                                          'former [s]', 'new [s]', 'speedup'))
+    for depth, branching in shapes:
+        expected = create_program(depth, branching)
+        former_make_compatible(expected, **kwargs)
+        program = create_program(depth, branching)
+        make_compatible(program, **kwargs)
+        assert program == expected
+
+        n_loops = sum(1 for _ in create_program(depth, branching).get_breadth_first_iterator())
+        former_time = min(timeit.repeat(lambda: former_make_compatible(create_program(depth, branching), **kwargs),
+                                        number=1, repeat=repeat))
+        new_time = min(timeit.repeat(lambda: make_compatible(create_program(depth, branching), **kwargs),
+                                     number=1, repeat=repeat))
+        build_time = min(timeit.repeat(lambda: create_program(depth, branching), number=1, repeat=repeat))
+        former_time -= build_time
+        new_time -= build_time
+        print('{:>6} {:>10} {:>8} {:>12.4f} {:>12.4f} {:>8.1f}'.format(depth, branching, n_loops,
+                                                                       former_time, new_time, former_time / new_time))
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,95 @@
+"""Compares Loop.get_measurement_windows with the former implementation that concatenated and tiled the windows of
+every node recursively.
+
+The synthetic program has n_outer repetitions of a scan line with n_inner points. Each point is repeated twice and has
+a measurement window. Each scan line has a measurement window as well.
+
+Run with ``python -m tests.benchmarks.measurement_windows_benchmark``."""
+import time
+from collections import defaultdict
+from typing import DefaultDict
+
+import numpy as np
+
+from qupulse.utils.types import TimeType
+from qupulse._program._loop import Loop
+from tests.pulses.sequencing_dummies import DummyWaveform
+
+
+def former_get_measurement_windows_recursion(program: Loop) -> DefaultDict[str, np.ndarray]:
+    temp_meas_windows = defaultdict(list)
+    if program._measurements:
+        for (mw_name, begin, length) in program._measurements:
+            temp_meas_windows[mw_name].append((begin, length))
+
+        for mw_name, begin_length_list in temp_meas_windows.items():
+            temp_meas_windows[mw_name] = [np.asarray(begin_length_list, dtype=float)]
+
+    if program.is_leaf():
+        body_duration = float(program.body_duration)
+    else:
+        offset = TimeType(0)
+        for child in program:
+            for mw_name, begins_length_array in former_get_measurement_windows_recursion(child).items():
+                begins_length_array[:, 0] += float(offset)
+                temp_meas_windows[mw_name].append(begins_length_array)
+            offset += child.duration
+
+        body_duration = float(offset)
+
+    for mw_name, begin_length_list in temp_meas_windows.items():
+        temp_begin_length_array = np.concatenate(begin_length_list)
+
+        begin_length_array = np.tile(temp_begin_length_array, (program.repetition_count, 1))
+
+        shaped_begin_length_array = np.reshape(begin_length_array, (program.repetition_count, -1, 2))
+
+        shaped_begin_length_array[:, :, 0] += (np.arange(program.repetition_count) * body_duration)[:, np.newaxis]
+
+        temp_meas_windows[mw_name] = begin_length_array
+
+    return temp_meas_windows
+
+
+def former_get_measurement_windows(program: Loop):
+    return {mw_name: (begin_length_list[:, 0], begin_length_list[:, 1])
+            for mw_name, begin_length_list in former_get_measurement_windows_recursion(program).items()}
+
+
+def create_scan_program(n_outer: int, n_inner: int) -> Loop:
+    waveforms = [DummyWaveform(duration=16 * (1 + i % 7)) for i in range(n_inner)]
+    return Loop(children=[Loop(children=[Loop(waveform=waveform, repetition_count=2, measurements=[('m', 2, 4)])
+                                         for waveform in waveforms],
+                               measurements=[('line', 0, 8)])
+                          for _ in range(n_outer)])
+
+
+def measure_time(function) -> float:
+    start = time.perf_counter()
+    function()
+    return time.perf_counter() - start
+
+
+def run_benchmark(sizes=((10, 1000), (100, 1000), (1000, 1000))):
+    print('{:>8} {:>10} {:>12} {:>12} {:>8}'.format('nodes', 'windows', 'former [s]', 'new [s]', 'speedup'))
+    for n_outer, n_inner in sizes:
+        program = create_scan_program(n_outer, n_inner)
+        # fill the duration caches so both implementations measure the traversal only
+        program.duration
+
+        expected = former_get_measurement_windows(program)
+        measurement_windows = program.get_measurement_windows()
+        for name, (begins, lengths) in expected.items():
+            order = np.lexsort((lengths, begins))
+            np.testing.assert_equal(begins[order], measurement_windows[name][0])
+            np.testing.assert_equal(lengths[order], measurement_windows[name][1])
+
+        former_time = measure_time(lambda: former_get_measurement_windows(program))
+        new_time = measure_time(program.get_measurement_windows)
+        n_windows = sum(len(begins) for begins, _ in measurement_windows.values())
+        print('{:>8} {:>10} {:>12.3f} {:>12.3f} {:>8.1f}'.format(1 + n_outer * (1 + n_inner), n_windows,
+                                                                former_time, new_time, former_time / new_time))
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,59 @@
+"""Measures the memory footprint of a large scan program built from Loop, TableWaveform and instruction objects.
+
+The program has n_outer repetitions of a scan line with n_inner points. Each point has its own TableWaveform with three
+entries. Memory is measured with tracemalloc while the objects are built. Run this benchmark on two revisions to compare
+their memory usage.
+
+Run with ``python -m tests.benchmarks.slots_memory_benchmark``."""
+import tracemalloc
+
+from qupulse.pulses.interpolation import HoldInterpolationStrategy, LinearInterpolationStrategy
+from qupulse._program._loop import Loop
+from qupulse._program.waveforms import TableWaveform
+from qupulse._program.instructions import EXECInstruction, REPJInstruction, InstructionPointer
+
+
+def create_waveforms(n_inner: int):
+    hold, linear = HoldInterpolationStrategy(), LinearInterpolationStrategy()
+    return [TableWaveform('A', [(0, 0, hold), (8, i, linear), (16 * (1 + i % 7), 0, hold)])
+            for i in range(n_inner)]
+
+
+def create_scan_program(waveforms, n_outer: int) -> Loop:
+    return Loop(children=[Loop(children=[Loop(waveform=waveform, repetition_count=2) for waveform in waveforms])
+                          for _ in range(n_outer)])
+
+
+def create_instructions(waveforms, n_outer: int):
+    target = InstructionPointer(None, 0)
+    return [instruction
+            for _ in range(n_outer)
+            for waveform in waveforms
+            for instruction in (EXECInstruction(waveform), REPJInstruction(1, target))]
+
+
+def measure_memory(function):
+    tracemalloc.start()
+    result = function()
+    allocated = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    return result, allocated
+
+
+def run_benchmark(sizes=((10, 1000), (100, 1000), (1000, 1000))):
+    print('{:>8} {:>12} {:>18} {:>18} {:>16}'.format('nodes', 'waveforms', 'Loop [B/node]', 'Waveform [B/wf]',
+                                                     'Instr. [B/instr]'))
+    for n_outer, n_inner in sizes:
+        waveforms, waveform_memory = measure_memory(lambda: create_waveforms(n_inner))
+        program, loop_memory = measure_memory(lambda: create_scan_program(waveforms, n_outer))
+        instructions, instruction_memory = measure_memory(lambda: create_instructions(waveforms, n_outer))
+
+        n_nodes = 1 + n_outer * (1 + n_inner)
+        print('{:>8} {:>12} {:>18.1f} {:>18.1f} {:>16.1f}'.format(n_nodes, n_inner,
+                                                                  loop_memory / n_nodes,
+                                                                  waveform_memory / n_inner,
+                                                                  instruction_memory / len(instructions)))
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -0,0 +1,51 @@
+"""Compares the vectorized TableWaveform.unsafe_sample with the former per segment sampling loop.
+
+Run with ``python -m tests.benchmarks.table_waveform_benchmark``."""
+import timeit
+
+import numpy as np
+
+from qupulse.pulses.interpolation import HoldInterpolationStrategy, LinearInterpolationStrategy,\
+    JumpInterpolationStrategy
+from qupulse._program.waveforms import TableWaveform, TableWaveformEntry
+
+
+def loop_sample(waveform: TableWaveform, sample_times: np.ndarray) -> np.ndarray:
+    """The sampling loop TableWaveform used before it was vectorized."""
+    output_array = np.empty_like(sample_times)
+    for entry1, entry2 in zip(waveform._table[:-1], waveform._table[1:]):
+        indices = slice(np.searchsorted(sample_times, entry1.t, 'left'),
+                        np.searchsorted(sample_times, entry2.t, 'right'))
+        output_array[indices] = \
+            entry2.interp((entry1.t, entry1.v), (entry2.t, entry2.v), sample_times[indices])
+    return output_array
+
+
+def create_table_waveform(n_entries: int, seed: int = 0) -> TableWaveform:
+    rng = np.random.RandomState(seed)
+    strategies = (HoldInterpolationStrategy(), LinearInterpolationStrategy(), JumpInterpolationStrategy())
+
+    times = np.cumsum(rng.randint(1, 10, size=n_entries))
+    times[0] = 0
+    values = rng.uniform(-1, 1, size=n_entries)
+    interps = rng.randint(0, len(strategies), size=n_entries)
+    return TableWaveform('A', [TableWaveformEntry(float(t), float(v), strategies[i])
+                               for t, v, i in zip(times, values, interps)])
+
+
+def run_benchmark(entry_counts=(10, 100, 1000, 10000, 100000), samples_per_entry: int = 4, repeat: int = 3):
+    print('{:>8} {:>10} {:>12} {:>12} {:>8}'.format('entries', 'samples', 'loop [s]', 'vector [s]', 'speedup'))
+    for n_entries in entry_counts:
+        waveform = create_table_waveform(n_entries)
+        sample_times = np.linspace(0, float(waveform.duration), num=n_entries * samples_per_entry)
+
+        np.testing.assert_equal(loop_sample(waveform, sample_times), waveform.unsafe_sample('A', sample_times))
+
+        loop_time = min(timeit.repeat(lambda: loop_sample(waveform, sample_times), number=1, repeat=repeat))
+        vector_time = min(timeit.repeat(lambda: waveform.unsafe_sample('A', sample_times), number=1, repeat=repeat))
+        print('{:>8} {:>10} {:>12.6f} {:>12.6f} {:>8.1f}'.format(n_entries, len(sample_times),
+                                                                 loop_time, vector_time, loop_time / vector_time))
+
+
+if __name__ == '__main__':
+    run_benchmark()
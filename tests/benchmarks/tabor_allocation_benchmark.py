@@ -0,0 +1,108 @@
+"""Randomized stress test of the segment placement of TaborChannelPair against the dummy device.
+
+Each cycle uploads a program with random segments and removes random programs afterwards. The benchmark reports the
+time spent in _find_place_for_segments_in_memory, the number of failed uploads and the fragmentation of the free
+memory, i.e. the fraction of free points that is not available at the end of the memory.
+
+Run with ``python -m tests.benchmarks.tabor_allocation_benchmark``."""
+import time
+
+import numpy as np
+
+from tests.hardware.dummy_modules import import_package
+
+import_package('pytabor')
+import_package('pyvisa')
+import_package('teawg')
+
+from qupulse.hardware.awgs.tabor import TaborAWGRepresentation, TaborSegment, TaborProgramMemory
+
+
+def create_channel_pair(total_capacity: int):
+    instrument = TaborAWGRepresentation('main_instrument', reset=True, paranoia_level=2)
+    for device in instrument.all_devices:
+        device.dev_properties = dict(device.dev_properties, max_arb_mem=2 * total_capacity)
+    return instrument, instrument.channel_pair_AB
+
+
+def fragmentation(channel_pair) -> float:
+    free_in_total = channel_pair._free_points_in_total
+    if free_in_total == 0:
+        return 0.
+    return 1. - channel_pair._free_points_at_end / free_in_total
+
+
+def run_stress(n_cycles: int, total_capacity: int = 2**17, fill_level: float = 0.8, seed: int = 0) -> dict:
+    rng = np.random.RandomState(seed)
+    instrument, channel_pair = create_channel_pair(total_capacity)
+
+    allocation_time = 0.
+    failures = 0
+    fragmentation_samples = []
+    live_programs = []
+    segment_counter = 0
+
+    for cycle in range(n_cycles):
+        for device in instrument.all_devices:
+            device.logged_commands = []
+            device._send_binary_data_calls = []
+            device._download_segment_lengths_calls = []
+
+        n_segments = rng.randint(1, 8)
+        segment_lengths = 192 + 16 * rng.randint(0, 48, size=n_segments)
+        segments = np.empty(n_segments, dtype=object)
+        for i, length in enumerate(segment_lengths):
+            # every fourth segment is reused from the previous programs
+            counter = segment_counter - rng.randint(1, 50) if rng.rand() < 0.25 else segment_counter
+            segment_counter += 1
+            segments[i] = TaborSegment(np.full(length, counter % 2**14, dtype=np.uint16),
+                                       np.full(length, counter // 2**14, dtype=np.uint16), None, None)
+            segment_lengths[i] = segments[i].num_points
+
+        start = time.perf_counter()
+        try:
+            waveform_to_segment, to_amend, to_insert = channel_pair._find_place_for_segments_in_memory(
+                segments, segment_lengths)
+        except MemoryError:
+            failures += 1
+            waveform_to_segment = None
+        allocation_time += time.perf_counter() - start
+
+        if waveform_to_segment is not None:
+            channel_pair._segment_references[waveform_to_segment[waveform_to_segment >= 0]] += 1
+            for wf_index in np.flatnonzero(to_insert > 0):
+                channel_pair._upload_segment(to_insert[wf_index], segments[wf_index])
+                waveform_to_segment[wf_index] = to_insert[wf_index]
+            if np.any(to_amend):
+                waveform_to_segment[to_amend] = channel_pair._amend_segments(segments[to_amend])
+
+            name = 'program_{}'.format(cycle)
+            channel_pair._known_programs[name] = TaborProgramMemory(waveform_to_segment=waveform_to_segment,
+                                                                    program=None)
+            live_programs.append(name)
+
+        while live_programs and (rng.rand() < 0.5 or
+                                 channel_pair._free_points_in_total < (1 - fill_level) * total_capacity):
+            channel_pair.remove(live_programs.pop(rng.randint(len(live_programs))))
+
+        fragmentation_samples.append(fragmentation(channel_pair))
+
+    return dict(cycles=n_cycles,
+                allocation_time=allocation_time,
+                failures=failures,
+                mean_fragmentation=float(np.mean(fragmentation_samples)),
+                max_fragmentation=float(np.max(fragmentation_samples)),
+                final_slots=len(channel_pair._segment_capacity))
+
+
+def run_benchmark():
+    print('{:>8} {:>16} {:>10} {:>14} {:>14} {:>8}'.format('cycles', 'alloc/upload', 'failures', 'mean frag',
+                                                            'max frag', 'slots'))
+    for n_cycles in (1000, 5000):
+        result = run_stress(n_cycles)
+        print('{cycles:>8} {time:>13.1f} us {failures:>10} {mean_fragmentation:>14.3f} {max_fragmentation:>14.3f} '
+              '{final_slots:>8}'.format(time=1e6 * result['allocation_time'] / n_cycles, **result))
+
+
+if __name__ == '__main__':
+    run_benchmark()
@@ -1,4 +1,7 @@
 import unittest
+import gc
+import math
+import pickle
 
 import numpy as np
 from sympy import sympify, Eq
@@ -49,6 +52,19 @@ class ExpressionVectorTests(unittest.TestCase):
             params['a'] = sympify('h')
             e.evaluate_numeric(**params)
 
+    def test_evaluate_numeric_batch(self) -> None:
+        e = ExpressionVector([['a * b + c', 'a + d'], ['a', 3]])
+        params = {
+            'a': [2, 3, 4],
+            'b': 1.5,
+            'c': np.array([-7, 1, 0]),
+            'd': 9
+        }
+        result = e.evaluate_numeric_batch(params)
+        self.assertEqual((3, 2, 2), result.shape)
+        for i, a in enumerate(params['a']):
+            np.testing.assert_equal(e.evaluate_numeric(a=a, b=1.5, c=params['c'][i], d=9), result[i])
+
     def test_partial_evaluation(self):
         e = ExpressionVector(['a * b + c', 'a + d'])
 
@@ -116,6 +132,24 @@ class ExpressionScalarTests(unittest.TestCase):
             params['a'] = sympify('h')
             e.evaluate_numeric(**params)
 
+    def test_evaluate_numeric_batch(self) -> None:
+        e = ExpressionScalar('a * b + c')
+        np.testing.assert_equal(np.array([2 * 1.5 - 7, 3 * 1.5 - 7]),
+                                e.evaluate_numeric_batch({'a': [2, 3], 'b': 1.5, 'c': -7, 'unused': [1, 2, 3]}))
+
+        np.testing.assert_equal(np.array([4, 4, 4]), ExpressionScalar(4).evaluate_numeric_batch({}, batch_size=3))
+
+        with self.assertRaises(ValueError):
+            ExpressionScalar(4).evaluate_numeric_batch({})
+        with self.assertRaises(ValueError):
+            e.evaluate_numeric_batch({'a': [2, 3], 'b': [1, 2, 3], 'c': -7})
+        with self.assertRaises(ValueError):
+            e.evaluate_numeric_batch({'a': [2, 3], 'b': 1.5, 'c': -7}, batch_size=3)
+        with self.assertRaises(ExpressionVariableMissingException):
+            e.evaluate_numeric_batch({'a': [2, 3], 'b': 1.5})
+        with self.assertRaises(NonNumericEvaluation):
+            e.evaluate_numeric_batch({'a': [2, sympify('h')], 'b': 1.5, 'c': -7})
+
     def test_evaluate_numpy(self):
         e = ExpressionScalar('a * b + c')
         params = {
@@ -357,6 +391,123 @@ class ExpressionScalarTests(unittest.TestCase):
         np.testing.assert_allclose(expected, result)
 
 
+class AffineExpressionScalarTests(unittest.TestCase):
+    def assertSameAsSympy(self, expression: ExpressionScalar, sympy_expression) -> None:
+        reference = ExpressionScalar(sympy_expression)
+        self.assertEqual(type(reference.sympified_expression), type(expression.sympified_expression))
+        self.assertEqual(reference.sympified_expression, expression.sympified_expression)
+        self.assertEqual(set(reference.variables), set(expression.variables))
+        self.assertEqual(str(reference), str(expression))
+        self.assertEqual(reference, expression)
+        self.assertEqual(hash(reference), hash(expression))
+        self.assertEqual(reference.get_serialization_data(), expression.get_serialization_data())
+
+    def test_lazy_sympification(self):
+        for value in ('a', 'b_2', '17', 3, -4.5, np.int64(3)):
+            expression = ExpressionScalar(value)
+            self.assertIsNone(expression._sympified_expression)
+            self.assertSameAsSympy(expression, sympify(value))
+            self.assertEqual(value, expression.original_expression)
+
+        for value in ('a*b', 'sin(t)', 'pi', 'gamma', '1.5', float('nan'), True):
+            self.assertIsNotNone(ExpressionScalar(value)._sympified_expression)
+
+    def test_affine_arithmetic(self):
+        a, b = ExpressionScalar('a'), ExpressionScalar('b')
+        sa, sb = sympify('a'), sympify('b')
+
+        self.assertSameAsSympy(a + 1, sa + 1)
+        self.assertSameAsSympy(2 - a, 2 - sa)
+        self.assertSameAsSympy(2 * a - b / 2, 2 * sa - sb / 2)
+        self.assertSameAsSympy(a / 2.0 + 0.5 * b, sa / 2.0 + 0.5 * sb)
+        self.assertSameAsSympy(3 * (a + b) - 3 * b, 3 * (sa + sb) - 3 * sb)
+        self.assertSameAsSympy((a + 0.5) - (a + 0.5), (sa + 0.5) - (sa + 0.5))
+        self.assertSameAsSympy(-(a - b), -(sa - sb))
+        self.assertSameAsSympy(ExpressionScalar(3) / 2, sympify(3) / 2)
+
+        self.assertIsNotNone((a + b)._affine)
+        self.assertIsNone((a * b)._affine)
+        self.assertSameAsSympy(a * b, sa * sb)
+        self.assertSameAsSympy(1 / a, 1 / sa)
+        self.assertSameAsSympy(a / 0, sa / 0)
+
+    def test_affine_comparison(self):
+        self.assertFalse(ExpressionScalar('a') * 2 == ExpressionScalar('a') * 2.)
+        self.assertTrue(ExpressionScalar('a') + 1 == ExpressionScalar('1 + a'))
+        self.assertTrue(ExpressionScalar(1) == 1.)
+        self.assertTrue(ExpressionScalar(1) < 1.5)
+        self.assertIsNone(ExpressionScalar('a') < ExpressionScalar('a') + 1)
+
+    def test_affine_evaluation(self):
+        expression = ExpressionScalar('a') / 2 - ExpressionScalar('b') * 3 + 1
+        self.assertEqual(2.5 - 6 + 1, expression.evaluate_numeric(a=5, b=2))
+        np.testing.assert_equal(np.array([1.5, -0.5]), expression.evaluate_numeric(a=np.array([1, 3]), b=np.array([0, 1])))
+        np.testing.assert_equal(np.array([1.5, -0.5]), expression.evaluate_numeric_batch({'a': [1, 3], 'b': [0, 1]}))
+        self.assertIs(ExpressionScalar('a').evaluate_numeric(a=3), 3)
+
+        with self.assertRaises(ExpressionVariableMissingException):
+            expression.evaluate_numeric(a=5)
+        with self.assertRaises(NonNumericEvaluation):
+            expression.evaluate_numeric(a=sympify('h'), b=1)
+
+    def test_affine_evaluation_none(self):
+        with self.assertRaises(NonNumericEvaluation):
+            ExpressionScalar('a').evaluate_numeric(a=None)
+
+    def test_affine_float_semantics(self):
+        a, sa = ExpressionScalar('a'), sympify('a')
+
+        negative_zero = ExpressionScalar(-0.0)
+        self.assertEqual(math.copysign(1., negative_zero.get_serialization_data()), 1.)
+        self.assertEqual(math.copysign(1., negative_zero.evaluate_numeric()), 1.)
+
+        # sympy floats have an unbounded exponent and round differently so float arithmetic is left to sympy
+        self.assertIsNone((a * 1e300)._affine)
+        self.assertSameAsSympy(a * 1e300 * 1e300, sa * 1e300 * 1e300)
+        self.assertEqual('1.0e+600*a', (a * 1e300 * 1e300).get_serialization_data())
+        self.assertSameAsSympy(ExpressionScalar(3) / 2.5, sympify(3) / 2.5)
+
+        # lambdify prints floats with 15 significant digits and orders the summands
+        for expression, sympy_expression, parameters in [
+                (a * 1.2345678901234567 + 0.1, sa * 1.2345678901234567 + 0.1, dict(a=3)),
+                (ExpressionScalar(1.2345678901234567), sympify(1.2345678901234567), dict()),
+                (ExpressionScalar('c') + ExpressionScalar('b') + a, sympify('c + b + a'), dict(a=0.1, b=0.2, c=1e16))]:
+            self.assertEqual(ExpressionScalar(sympy_expression).evaluate_numeric(**parameters),
+                             expression.evaluate_numeric(**parameters))
+
+
+class ExpressionScalarInterningTests(unittest.TestCase):
+    def test_same_input(self):
+        self.assertIs(ExpressionScalar('a*b'), ExpressionScalar('a*b'))
+        self.assertIs(ExpressionScalar(3), Expression.make(3))
+        self.assertIs(ExpressionScalar('a') + 1, 1 + ExpressionScalar('a'))
+        self.assertIs(ExpressionScalar(sympify('a*b')), ExpressionScalar(sympify('a*b')))
+
+    def test_distinct_representations(self):
+        self.assertIsNot(ExpressionScalar('a*b'), ExpressionScalar('a * b'))
+        self.assertEqual(repr(ExpressionScalar('a * b')), "Expression('a * b')")
+        self.assertIsNot(ExpressionScalar(1), ExpressionScalar(1.))
+        self.assertIsNot(ExpressionScalar(0.), ExpressionScalar(-0.))
+        self.assertIsNot(ExpressionScalar('a') * 2, ExpressionScalar('a') * 2.)
+
+    def test_weak_references(self):
+        expression = ExpressionScalar('interning_test_variable')
+        key = ExpressionScalar._get_intern_key('interning_test_variable')
+        self.assertIs(ExpressionScalar._interned[key], expression)
+
+        del expression
+        gc.collect()
+        self.assertNotIn(key, ExpressionScalar._interned)
+
+    def test_pickle(self):
+        expression = ExpressionScalar('a*b + c')
+        hash(expression)
+        unpickled = pickle.loads(pickle.dumps(expression))
+        self.assertIsNone(unpickled._hash)
+        self.assertEqual(expression, unpickled)
+        self.assertEqual(hash(expression), hash(unpickled))
+
+
 class ExpressionExceptionTests(unittest.TestCase):
     def test_expression_variable_missing(self):
         variable = 's'
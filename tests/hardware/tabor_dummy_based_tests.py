@@ -35,10 +35,13 @@ class DummyTaborProgramClass:
         class DummyTaborProgram:
             def __init__(self, class_obj: DummyTaborProgramClass):
                 self.sampled_segments_calls = []
+                self.sampled_segments_executors = []
                 self.class_obj = class_obj
                 self.waveform_mode = class_obj.waveform_mode
-            def sampled_segments(self, sample_rate, voltage_amplitude, voltage_offset, voltage_transformation):
+            def sampled_segments(self, sample_rate, voltage_amplitude, voltage_offset, voltage_transformation,
+                                 executor=None):
                 self.sampled_segments_calls.append((sample_rate, voltage_amplitude, voltage_offset, voltage_transformation))
+                self.sampled_segments_executors.append(executor)
                 return self.class_obj.segments, self.class_obj.segment_lengths
             def get_sequencer_tables(self):
                 return self.class_obj.sequencer_tables
@@ -133,6 +136,78 @@ class TaborAWGRepresentationDummyBasedTests(TaborDummyBasedTest):
         self.assertAllCommandLogsEqual([((), dict(paranoia_level=3, cmd_str='bleh')),
                                         ((), dict(cmd_str='bleho', paranoia_level=None))])
 
+    def test_command_batch(self):
+        self.reset_instrument_logs()
+        self.instrument.max_batch_commands = 2
+
+        with self.instrument.command_batch():
+            self.instrument.send_cmd('a')
+            with self.instrument.command_batch():
+                self.instrument.send_cmd('b')
+            self.instrument.send_cmd('c')
+            self.assertAllCommandLogsEqual([])
+
+            # binary transfers keep the command order
+            self.instrument.send_binary_data(pref=':TRAC:DATA', bin_dat='dummy')
+            self.assertAllCommandLogsEqual([((), dict(cmd_str=':a; :b', paranoia_level=0)),
+                                            ((), dict(cmd_str=':c', paranoia_level=None))])
+
+            self.instrument.send_cmd(':d', paranoia_level=3)
+            self.instrument.send_cmd('*e')
+        self.assertAllCommandLogsEqual([((), dict(cmd_str=':a; :b', paranoia_level=0)),
+                                        ((), dict(cmd_str=':c', paranoia_level=None)),
+                                        ((), dict(cmd_str=':d; *e', paranoia_level=3))])
+        for device in self.instrument.all_devices:
+            self.assertEqual(device._send_binary_data_calls, [(':TRAC:DATA', 'dummy', None)])
+
+    def test_command_batch_exception(self):
+        self.reset_instrument_logs()
+
+        # the queued commands are sent if the body raises
+        with self.assertRaises(ValueError):
+            with self.instrument.command_batch():
+                self.instrument.send_cmd(':a')
+                raise ValueError()
+        self.assertAllCommandLogsEqual([((), dict(cmd_str=':a', paranoia_level=None))])
+
+        def send_cmd(*args, **kwargs):
+            raise RuntimeError('device error')
+        for device in self.instrument.all_devices:
+            device.send_cmd = send_cmd
+
+        # a device error does not replace the original exception
+        with self.assertRaises(ValueError) as exception_context:
+            with self.instrument.command_batch():
+                self.instrument.send_cmd(':b')
+                raise ValueError()
+        self.assertIsInstance(exception_context.exception.__cause__, RuntimeError)
+
+        with self.assertRaises(RuntimeError):
+            with self.instrument.command_batch():
+                self.instrument.send_cmd(':c')
+
+    def test_mirrors_concurrently(self):
+        import threading
+
+        barrier = threading.Barrier(len(self.instrument.all_devices), timeout=5)
+        for device in self.instrument.all_devices:
+            device.send_cmd = lambda *args, **kwargs: barrier.wait()
+
+        # deadlocks and raises BrokenBarrierError if the devices are not driven concurrently
+        self.instrument.send_cmd(':TRIG')
+
+        answers = self.instrument.send_query(':OUTP?', query_mirrors=True)
+        self.assertEqual(len(answers), len(self.instrument.all_devices))
+
+    def test_mirror_executor_shutdown(self):
+        self.instrument.send_cmd(':TRIG')
+        mirror_executor = self.instrument._mirror_executor
+        self.assertIsNotNone(mirror_executor)
+
+        self.instrument.__del__()
+        with self.assertRaises(RuntimeError):
+            mirror_executor.submit(print)
+
     def test_trigger(self):
         self.reset_instrument_logs()
         self.instrument.trigger()
@@ -275,6 +350,442 @@ class TaborChannelPairTests(TaborDummyBasedTest):
         finally:
             sys.modules['qupulse.hardware.awgs.tabor'].TaborProgram = to_restore
 
+    def test_upload_sampling_workers(self):
+        import concurrent.futures
+
+        segments = np.array([1, 2])
+        segment_lengths = np.array([192, 192], dtype=np.uint16)
+
+        to_restore = sys.modules['qupulse.hardware.awgs.tabor'].TaborProgram
+        my_class = DummyTaborProgramClass(segments=segments, segment_lengths=segment_lengths)
+        sys.modules['qupulse.hardware.awgs.tabor'].TaborProgram = my_class
+        try:
+            program = self.Loop(waveform=self.DummyWaveform(duration=192))
+
+            channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+            channel_pair._find_place_for_segments_in_memory = lambda *args: (np.array([-1, -1], dtype=np.int64),
+                                                                             np.array([True, True]),
+                                                                             np.array([-1, -1]))
+            channel_pair._amend_segments = lambda segments_: np.array([1, 2], dtype=np.int64)
+
+            channel_pair.upload('test', program, (1, None), (None, None), (lambda x: x, lambda x: x))
+            channel_pair.upload('test2', program, (1, None), (None, None), (lambda x: x, lambda x: x),
+                                sampling_workers=3)
+
+            self.assertIsNone(my_class.created[0].sampled_segments_executors[0])
+            executor = my_class.created[1].sampled_segments_executors[0]
+            self.assertIsInstance(executor, concurrent.futures.ThreadPoolExecutor)
+            self.assertEqual(executor._max_workers, 3)
+        finally:
+            sys.modules['qupulse.hardware.awgs.tabor'].TaborProgram = to_restore
+
+    def test_upload_streaming(self):
+        from qupulse._program.waveforms import MultiChannelWaveform
+
+        def waveform(duration, value):
+            return MultiChannelWaveform([self.TableWaveform('A', [(0, value, self.HoldInterpolationStrategy()),
+                                                                  (duration, value, self.HoldInterpolationStrategy())]),
+                                         self.TableWaveform('B', [(0, -value, self.HoldInterpolationStrategy()),
+                                                                  (duration, 0, self.HoldInterpolationStrategy())])])
+
+        program = self.Loop(children=[self.Loop(waveform=waveform(192, 0.1)),
+                                      self.Loop(waveform=waveform(384, 0.2)),
+                                      self.Loop(waveform=waveform(192, 0.3), repetition_count=2),
+                                      self.Loop(waveform=waveform(192, 0.1))])
+
+        channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+        channel_pair._segment_references = np.array([1, 0, 1], dtype=np.uint32)
+        channel_pair._segment_capacity = np.array([192, 384 + 16, 192], dtype=np.uint32)
+        channel_pair._segment_lengths = channel_pair._segment_capacity.copy()
+        channel_pair._segment_hashes = np.array([channel_pair._segment_hashes[0], 2, 3], dtype=np.int64)
+
+        self.reset_instrument_logs()
+        channel_pair.upload('test', program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                            streaming=True, sampling_workers=2)
+
+        tabor_program = channel_pair._known_programs['test'].program
+        segments, _ = tabor_program.sampled_segments(10**9, (0.5, 0.5), (0, 0), (lambda x: x, lambda x: x))
+        self.assertEqual(len(segments), 3)
+
+        waveform_to_segment = channel_pair._known_programs['test'].waveform_to_segment
+        # the first segment arrives first and takes the only free slot
+        np.testing.assert_equal(waveform_to_segment, [1, 3, 4])
+        np.testing.assert_equal(channel_pair._segment_references, [1, 1, 1, 1, 1])
+        np.testing.assert_equal(channel_pair._segment_hashes, [channel_pair._segment_hashes[0],
+                                                               hash(segments[0]), 3,
+                                                               hash(segments[1]), hash(segments[2])])
+
+        expected_binary_data = [(':TRAC:DATA', segments[0].get_as_binary(), None),
+                                (':TRAC:DATA', self.make_combined_wave([segments[1], segments[2]]), None)]
+        for device in self.instrument.all_devices:
+            np.testing.assert_equal(device._send_binary_data_calls, expected_binary_data)
+
+        timings = channel_pair.last_upload_timings
+        self.assertGreater(timings.total, 0)
+
+        # uploading again only references the known segments
+        self.reset_instrument_logs()
+        channel_pair.upload('test_2', program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                            streaming=True)
+        np.testing.assert_equal(channel_pair._known_programs['test_2'].waveform_to_segment, [1, 3, 4])
+        np.testing.assert_equal(channel_pair._segment_references, [1, 2, 1, 2, 2])
+        for device in self.instrument.all_devices:
+            self.assertEqual(device._send_binary_data_calls, [])
+
+    def test_upload_streaming_shared_segment(self):
+        from qupulse._program.waveforms import MultiChannelWaveform
+
+        def waveform(value):
+            return MultiChannelWaveform([self.TableWaveform('A', [(0, value, self.HoldInterpolationStrategy()),
+                                                                  (192, value, self.HoldInterpolationStrategy())]),
+                                         self.TableWaveform('B', [(0, 0, self.HoldInterpolationStrategy()),
+                                                                  (192, 0, self.HoldInterpolationStrategy())])])
+
+        # different waveforms that are quantized to the same segment
+        program = self.Loop(children=[self.Loop(waveform=waveform(0.1)),
+                                      self.Loop(waveform=waveform(0.1 + 1e-9)),
+                                      self.Loop(waveform=waveform(0.1))])
+        single_program = self.Loop(children=[self.Loop(waveform=waveform(0.1))])
+
+        for streaming in (False, True):
+            channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+            channel_pair._segment_references = np.array([1], dtype=np.uint32)
+            channel_pair._segment_capacity = np.array([192], dtype=np.uint32)
+            channel_pair._segment_lengths = channel_pair._segment_capacity.copy()
+            channel_pair._segment_hashes = np.array([1], dtype=np.int64)
+
+            channel_pair.upload('single', single_program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                                streaming=streaming)
+            np.testing.assert_equal(channel_pair._segment_references, [1, 1])
+
+            channel_pair.upload('test', program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                                streaming=streaming)
+            np.testing.assert_equal(channel_pair._known_programs['test'].waveform_to_segment, [1, 1])
+            np.testing.assert_equal(channel_pair._segment_references, [1, 2])
+
+            channel_pair.free_program('test')
+            np.testing.assert_equal(channel_pair._segment_references, [1, 1])
+            channel_pair.free_program('single')
+            np.testing.assert_equal(channel_pair._segment_references, [1, 0])
+
+    def test_upload_device_error(self):
+        from qupulse._program.waveforms import MultiChannelWaveform
+
+        def program(value):
+            wf = MultiChannelWaveform([self.TableWaveform('A', [(0, value, self.HoldInterpolationStrategy()),
+                                                                (192, value, self.HoldInterpolationStrategy())]),
+                                       self.TableWaveform('B', [(0, 0, self.HoldInterpolationStrategy()),
+                                                                (192, 0, self.HoldInterpolationStrategy())])])
+            return self.Loop(children=[self.Loop(waveform=wf)])
+
+        for streaming in (False, True):
+            # amending updates the lengths of the new segments with batched commands after the binary transfer
+            channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+            channel_pair._segment_references = np.array([1, 1], dtype=np.uint32)
+            channel_pair._segment_capacity = np.array([400, 400], dtype=np.uint32)
+            channel_pair._segment_lengths = np.array([192, 192], dtype=np.uint32)
+            channel_pair._segment_hashes = np.array([1, 2], dtype=np.int64)
+
+            channel_pair.upload('test', program(0.1), ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                                streaming=streaming)
+            previous_program = channel_pair._known_programs['test']
+            np.testing.assert_equal(channel_pair._segment_references, [1, 1, 1])
+
+            binary_transfers = []
+
+            def send_cmd(*args, **kwargs):
+                if binary_transfers:
+                    raise RuntimeError('device error')
+            for device in self.instrument.all_devices:
+                device.send_cmd = send_cmd
+                device.send_binary_data = lambda *args, **kwargs: binary_transfers.append(args)
+
+            with self.assertRaises(RuntimeError):
+                channel_pair.upload('test', program(0.2), ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                                    force=True, streaming=streaming)
+            self.assertIs(channel_pair._known_programs['test'], previous_program)
+            np.testing.assert_equal(channel_pair._segment_references, [1, 1, 1, 0])
+
+            for device in self.instrument.all_devices:
+                del device.send_cmd
+                del device.send_binary_data
+
+    def test_upload_streaming_memory_error(self):
+        from qupulse._program.waveforms import MultiChannelWaveform
+
+        wf = MultiChannelWaveform([self.TableWaveform('A', [(0, 0.1, self.HoldInterpolationStrategy()),
+                                                            (192, 0.1, self.HoldInterpolationStrategy())]),
+                                   self.TableWaveform('B', [(0, 0.1, self.HoldInterpolationStrategy()),
+                                                            (192, 0.1, self.HoldInterpolationStrategy())])])
+        program = self.Loop(children=[self.Loop(waveform=wf)])
+
+        channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+        channel_pair._segment_references = np.array([1, 1], dtype=np.uint32)
+        channel_pair._segment_capacity = np.array([192, channel_pair.total_capacity - 192], dtype=np.uint32)
+        channel_pair._segment_lengths = channel_pair._segment_capacity.copy()
+        channel_pair._segment_hashes = np.array([1, 2], dtype=np.int64)
+
+        with self.assertRaises(MemoryError):
+            channel_pair.upload('test', program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                                streaming=True)
+        np.testing.assert_equal(channel_pair._segment_references, [1, 1])
+        self.assertNotIn('test', channel_pair._known_programs)
+
+    def test_upload_streaming_insufficient_memory_at_end(self):
+        from qupulse._program.waveforms import MultiChannelWaveform
+
+        def waveform(value):
+            return MultiChannelWaveform([self.TableWaveform('A', [(0, value, self.HoldInterpolationStrategy()),
+                                                                  (192, value, self.HoldInterpolationStrategy())]),
+                                         self.TableWaveform('B', [(0, 0, self.HoldInterpolationStrategy()),
+                                                                  (192, 0, self.HoldInterpolationStrategy())])])
+
+        channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+        channel_pair._segment_references = np.array([0, 1], dtype=np.uint32)
+        channel_pair._segment_capacity = np.array([192 + 16, channel_pair.total_capacity - 192 - 16], dtype=np.uint32)
+        channel_pair._segment_lengths = channel_pair._segment_capacity.copy()
+        channel_pair._segment_hashes = np.array([1, 2], dtype=np.int64)
+
+        # the second segment does not fit so the free slot must not be overwritten by the first one
+        self.reset_instrument_logs()
+        program = self.Loop(children=[self.Loop(waveform=waveform(0.1)), self.Loop(waveform=waveform(0.2))])
+        with self.assertRaises(MemoryError):
+            channel_pair.upload('test', program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                                streaming=True)
+        np.testing.assert_equal(channel_pair._segment_references, [0, 1])
+        np.testing.assert_equal(channel_pair._segment_hashes, [1, 2])
+        for device in self.instrument.all_devices:
+            self.assertEqual(device._send_binary_data_calls, [])
+
+        # a program that only fits into the free slot is placed after sampling
+        program = self.Loop(children=[self.Loop(waveform=waveform(0.1))])
+        channel_pair.upload('test', program, ('A', 'B'), (None, None), (lambda x: x, lambda x: x),
+                            streaming=True)
+        np.testing.assert_equal(channel_pair._known_programs['test'].waveform_to_segment, [0])
+        np.testing.assert_equal(channel_pair._segment_references, [1, 1])
+
+    def _create_snapshot_channel_pair(self, snapshot_path):
+        from qupulse.hardware.awgs.tabor import _RestoredTaborProgram
+
+        channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2),
+                                             memory_snapshot=snapshot_path)
+        segments = [self.TaborSegment(np.full(192, i, dtype=np.uint16), np.full(192, i, dtype=np.uint16), None, None)
+                    for i in range(1, 3)]
+        channel_pair._segment_lengths = np.array([192, 192, 192], dtype=np.uint32)
+        channel_pair._segment_capacity = np.array([192, 192, 208], dtype=np.uint32)
+        channel_pair._segment_hashes = np.array([hash(channel_pair._idle_segment)] + [hash(s) for s in segments],
+                                                dtype=np.int64)
+        channel_pair._segment_references = np.array([1, 1, 1], dtype=np.uint32)
+        program = _RestoredTaborProgram(sequencer_tables=[[(1, 0, 0), (2, 1, 0), (1, 0, 0)]],
+                                        advanced_sequencer_table=[(1, 1, 0)],
+                                        waveform_mode=self.TaborSequencing.SINGLE)
+        channel_pair._known_programs['test'] = self.TaborProgramMemory(np.array([1, 2], dtype=np.int64), program)
+        channel_pair.save_memory_snapshot()
+        return channel_pair, segments
+
+    def test_memory_snapshot(self):
+        import tempfile
+        import os
+
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, 'snapshot.json')
+            channel_pair, _ = self._create_snapshot_channel_pair(snapshot_path)
+            self.assertTrue(os.path.isfile(snapshot_path))
+
+            channel_pair.arm('test')
+            expected_sequencer_tables = channel_pair._sequencer_tables
+            expected_advanced_sequencer_table = channel_pair._advanced_sequence_table
+
+            self.reset_instrument_logs()
+            # the dummy device cannot be read back
+            restored = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2),
+                                             memory_snapshot=snapshot_path, read_back_segments=0)
+
+            # nothing is deleted or transferred
+            logged_commands = [kwargs['cmd_str'] for _, kwargs in self.instrument.main_instrument.logged_commands]
+            self.assertIn('SEQ:DEL:ALL', logged_commands)
+            self.assertNotIn(':TRAC:DEL:ALL', logged_commands)
+            self.assertEqual(self.instrument.main_instrument._send_binary_data_calls, [])
+
+            np.testing.assert_equal(restored._segment_lengths, channel_pair._segment_lengths)
+            np.testing.assert_equal(restored._segment_capacity, channel_pair._segment_capacity)
+            np.testing.assert_equal(restored._segment_hashes, channel_pair._segment_hashes)
+            np.testing.assert_equal(restored._segment_references, channel_pair._segment_references)
+            self.assertEqual(set(restored._known_programs), {'test'})
+            self.assertIsNone(restored._current_program)
+
+            restored.arm('test')
+            self.assertEqual(restored._sequencer_tables, expected_sequencer_tables)
+            self.assertEqual(restored._advanced_sequence_table, expected_advanced_sequencer_table)
+
+            # removing updates the snapshot
+            restored.remove('test')
+            self.assertEqual(restored._get_memory_snapshot(), self.TaborChannelPair(
+                self.instrument, identifier='asd', channels=(1, 2), memory_snapshot=snapshot_path,
+                read_back_segments=0
+            )._get_memory_snapshot())
+            np.testing.assert_equal(restored._segment_lengths, [192])
+
+    def test_memory_snapshot_mismatch(self):
+        import tempfile
+        import os
+        import warnings
+
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, 'snapshot.json')
+            self._create_snapshot_channel_pair(snapshot_path)
+
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                other = self.TaborChannelPair(self.instrument, identifier='asd', channels=(3, 4),
+                                              memory_snapshot=snapshot_path)
+            self.assertEqual(len(w), 1)
+            self.assertEqual(other._known_programs, dict())
+            np.testing.assert_equal(other._segment_lengths, [192])
+
+            # the snapshot was overwritten by clear
+            with self.assertRaisesRegex(Exception, 'different channels'):
+                self.TaborChannelPair(self.instrument, identifier='asd',
+                                      channels=(1, 2)).load_memory_snapshot(snapshot_path)
+
+            with open(snapshot_path, 'w') as snapshot_file:
+                snapshot_file.write('{"version": 1')
+            with warnings.catch_warnings(record=True) as w:
+                warnings.simplefilter('always')
+                self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2),
+                                      memory_snapshot=snapshot_path)
+            self.assertEqual(len(w), 1)
+
+    def test_memory_snapshot_read_back(self):
+        import tempfile
+        import os
+        import warnings
+
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, 'snapshot.json')
+            channel_pair, segments = self._create_snapshot_channel_pair(snapshot_path)
+            device_segments = [channel_pair._idle_segment] + segments
+
+            read_calls = []
+
+            def read_segments(segment_indices):
+                read_calls.append(list(segment_indices))
+                return [device_segments[i].get_as_binary() for i in segment_indices]
+
+            restored = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+            restored._read_segments = read_segments
+            restored.load_memory_snapshot(snapshot_path, read_back_segments=None)
+            self.assertEqual(read_calls, [[0, 1, 2]])
+            self.assertEqual(set(restored._known_programs), {'test'})
+
+            restored.load_memory_snapshot(snapshot_path, read_back_segments=2)
+            self.assertEqual(len(read_calls[1]), 2)
+
+            device_segments[2] = segments[0]
+            with self.assertRaisesRegex(Exception, 'differs'):
+                restored.load_memory_snapshot(snapshot_path, read_back_segments=None)
+
+    def test_memory_snapshot_shared_segment(self):
+        import tempfile
+        import os
+        from qupulse.hardware.awgs.tabor import _RestoredTaborProgram
+
+        with tempfile.TemporaryDirectory() as directory:
+            snapshot_path = os.path.join(directory, 'snapshot.json')
+            channel_pair, _ = self._create_snapshot_channel_pair(snapshot_path)
+
+            program = _RestoredTaborProgram(sequencer_tables=[[(1, 0, 0), (1, 0, 0)]],
+                                            advanced_sequencer_table=[(1, 1, 0)],
+                                            waveform_mode=self.TaborSequencing.SINGLE)
+            channel_pair._segment_references[1] += 1
+            channel_pair._known_programs['shared'] = self.TaborProgramMemory(np.array([1, 1], dtype=np.int64),
+                                                                             program)
+            channel_pair.save_memory_snapshot()
+
+            restored = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2),
+                                             memory_snapshot=snapshot_path, read_back_segments=0)
+            np.testing.assert_equal(restored._segment_references, [1, 2, 1])
+
+            restored.remove('shared')
+            np.testing.assert_equal(restored._segment_references, [1, 1, 1])
+            restored.remove('test')
+            np.testing.assert_equal(restored._segment_references[0], 1)
+            self.assertFalse(np.any(restored._segment_references[1:]))
+
+    def _create_fragmented_channel_pair(self):
+        from qupulse.hardware.awgs.tabor import _RestoredTaborProgram
+
+        channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+        segments = [channel_pair._idle_segment] + [
+            self.TaborSegment(np.full(n, i, dtype=np.uint16), np.full(n, i, dtype=np.uint16), None, None)
+            for i, n in enumerate([208, 192, 208, 192, 192], 1)]
+
+        channel_pair._segment_lengths = np.array([s.num_points for s in segments], dtype=np.uint32)
+        channel_pair._segment_capacity = np.array([192, 208, 192, 256, 192, 192], dtype=np.uint32)
+        channel_pair._segment_lengths[3] = 192
+        channel_pair._segment_hashes = np.array([hash(s) for s in segments], dtype=np.int64)
+        channel_pair._segment_references = np.array([1, 0, 1, 1, 1, 2], dtype=np.uint32)
+        program = _RestoredTaborProgram(sequencer_tables=[[(1, 0, 0), (1, 1, 0), (1, 2, 0), (1, 3, 0)]],
+                                        advanced_sequencer_table=[(1, 1, 0)],
+                                        waveform_mode=self.TaborSequencing.SINGLE)
+        channel_pair._known_programs['a'] = self.TaborProgramMemory(np.array([2, 3, 4, 5], dtype=np.int64), program)
+        channel_pair._known_programs['b'] = self.TaborProgramMemory(np.array([5], dtype=np.int64), program)
+
+        segments[3] = self.TaborSegment(np.full(192, 3, dtype=np.uint16), np.full(192, 3, dtype=np.uint16), None, None)
+        channel_pair._segment_hashes[3] = hash(segments[3])
+
+        def segment_source(segment_indices):
+            return [segments[i] for i in segment_indices]
+        return channel_pair, segments, segment_source
+
+    def test_compact_moves(self):
+        channel_pair, segments, segment_source = self._create_fragmented_channel_pair()
+        channel_pair.arm('a')
+
+        self.reset_instrument_logs()
+        self.assertTrue(channel_pair.compact(required_points=channel_pair.total_capacity - 192*3 - 208 - 256,
+                                             segment_source=segment_source))
+
+        np.testing.assert_equal(channel_pair._segment_capacity, [192, 208, 192, 256, 192])
+        np.testing.assert_equal(channel_pair._segment_references, [1, 2, 1, 1, 1])
+        np.testing.assert_equal(channel_pair._segment_hashes, [hash(segments[i]) for i in (0, 5, 2, 3, 4)])
+        np.testing.assert_equal(channel_pair._known_programs['a'].waveform_to_segment, [2, 3, 4, 1])
+        np.testing.assert_equal(channel_pair._known_programs['b'].waveform_to_segment, [1])
+
+        # one segment transferred and the armed program was updated
+        self.assertEqual(len(self.instrument.main_instrument._send_binary_data_calls), 1)
+        self.assertEqual(channel_pair._current_program, 'a')
+        self.assertEqual(channel_pair._sequencer_tables[1], [(1, 3, 0), (1, 4, 0), (1, 5, 0), (1, 2, 0)])
+
+    def test_compact_repack(self):
+        channel_pair, segments, segment_source = self._create_fragmented_channel_pair()
+
+        self.reset_instrument_logs()
+        self.assertTrue(channel_pair.compact(segment_source=segment_source))
+
+        np.testing.assert_equal(channel_pair._segment_capacity, [192, 192, 192, 192, 192])
+        np.testing.assert_equal(channel_pair._segment_lengths, [192, 192, 192, 192, 192])
+        np.testing.assert_equal(channel_pair._segment_references, [1, 1, 1, 1, 2])
+        np.testing.assert_equal(channel_pair._segment_hashes, [hash(segments[i]) for i in (0, 2, 3, 4, 5)])
+        np.testing.assert_equal(channel_pair._known_programs['a'].waveform_to_segment, [1, 2, 3, 4])
+        np.testing.assert_equal(channel_pair._known_programs['b'].waveform_to_segment, [4])
+        self.assertEqual(len(self.instrument.main_instrument._send_binary_data_calls), 1)
+
+    def test_compact_errors(self):
+        channel_pair, segments, segment_source = self._create_fragmented_channel_pair()
+
+        with self.assertRaises(MemoryError):
+            channel_pair.compact(required_points=channel_pair.total_capacity, segment_source=segment_source)
+
+        # nothing is transferred if the time budget is exhausted
+        self.reset_instrument_logs()
+        self.assertFalse(channel_pair.compact(time_budget=0., segment_source=segment_source))
+        self.assertEqual(self.instrument.main_instrument._send_binary_data_calls, [])
+        np.testing.assert_equal(channel_pair._segment_references, [1, 0, 1, 1, 1, 2])
+
+        with self.assertRaisesRegex(Exception, 'does not match'):
+            channel_pair.compact(segment_source=lambda indices: [segments[1]] * len(indices))
+
     def test_find_place_for_segments_in_memory(self):
         def hash_based_on_dir(ch):
             hash_list = []
@@ -345,10 +856,11 @@ class TaborChannelPairTests(TaborDummyBasedTest):
         channel_pair._segment_references = np.asarray([1, 0, 1, 1, 0, 3], dtype=np.int32)
         hash_before = hash_based_on_dir(channel_pair)
 
+        # best fit: the largest segment goes into the smaller of the two places
         w2s, ta, ti = channel_pair._find_place_for_segments_in_memory(segments, segment_lengths)
         self.assertEqual(w2s.tolist(), [-1, -1, -1, -1, -1])
-        self.assertEqual(ta.tolist(), [True, True, False, False, True])
-        self.assertEqual(ti.tolist(), [-1, -1, 4, 1, -1])
+        self.assertEqual(ta.tolist(), [False, True, False, True, True])
+        self.assertEqual(ti.tolist(), [4, -1, 1, -1, -1])
         self.assertEqual(hash_before, hash_based_on_dir(channel_pair))
 
         # mix everything
@@ -657,3 +1169,60 @@ class TaborChannelPairTests(TaborDummyBasedTest):
         for device in self.instrument.all_devices:
             self.assertEqual(device._download_adv_seq_table_calls, expected_adv_seq_table_log)
             self.assertEqual(device._download_sequencer_table_calls, expected_sequencer_table_log)
+
+    def test_change_armed_program_incremental(self):
+        channel_pair = self.TaborChannelPair(self.instrument, identifier='asd', channels=(1, 2))
+        channel_pair.incremental_sequencer_tables = True
+        # prevent entering and exiting configuration mode
+        channel_pair._configuration_guard_count = 2
+
+        w2s = np.array([1, 2, 3, 4])
+        table_a = [(1, 0, 0), (1, 1, 0), (1, 0, 0)]
+        table_b = [(2, 1, 0), (1, 2, 0), (1, 0, 0)]
+        table_c = [(3, 3, 0), (1, 2, 0), (1, 0, 0)]
+
+        def create_program(advanced_sequencer_table, sequencer_tables):
+            return DummyTaborProgramClass(advanced_sequencer_table=advanced_sequencer_table,
+                                          sequencer_tables=sequencer_tables,
+                                          waveform_mode=self.TaborSequencing.ADVANCED)(None, None, None, None)
+
+        def translate(table):
+            return [(rep, w2s[wf] + 1, jump) for rep, wf, jump in table]
+
+        channel_pair._known_programs['ab'] = self.TaborProgramMemory(w2s, create_program([(1, 1, 0), (2, 2, 0)],
+                                                                                         [table_a, table_b]))
+        channel_pair._known_programs['cb'] = self.TaborProgramMemory(w2s, create_program([(3, 2, 0), (1, 1, 0)],
+                                                                                         [table_c, table_b]))
+
+        channel_pair.change_armed_program('ab')
+        self.reset_instrument_logs()
+
+        # table b is reused in slot 3 and table c replaces table a in slot 2
+        channel_pair.change_armed_program('cb')
+        expected_sequencer_table_log = [((translate(table_c),), dict(pref=':SEQ:DATA', paranoia_level=None))]
+        expected_adv_seq_table_log = [([(1, 1, 1), (3, 3, 0), (1, 2, 0)], ':ASEQ:DATA', None)]
+        for device in self.instrument.all_devices:
+            self.assertEqual(device._download_sequencer_table_calls, expected_sequencer_table_log)
+            self.assertEqual(device._download_adv_seq_table_calls, expected_adv_seq_table_log)
+        self.assertEqual(channel_pair._sequencer_tables,
+                         [channel_pair._idle_sequence_table, translate(table_c), translate(table_b)])
+
+        # switching back only replaces table c
+        self.reset_instrument_logs()
+        channel_pair.change_armed_program('ab')
+        for device in self.instrument.all_devices:
+            self.assertEqual(device._download_sequencer_table_calls,
+                             [((translate(table_a),), dict(pref=':SEQ:DATA', paranoia_level=None))])
+
+        # arming the same program again does not download anything
+        self.reset_instrument_logs()
+        channel_pair.change_armed_program('ab')
+        for device in self.instrument.all_devices:
+            self.assertEqual(device._download_sequencer_table_calls, [])
+            self.assertEqual(device._download_adv_seq_table_calls, [])
+
+        # without incremental upload all tables are downloaded
+        channel_pair.incremental_sequencer_tables = False
+        channel_pair.change_armed_program('cb')
+        for device in self.instrument.all_devices:
+            self.assertEqual(len(device._download_sequencer_table_calls), 3)
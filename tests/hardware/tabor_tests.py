@@ -1,11 +1,12 @@
 import unittest
 import itertools
+import concurrent.futures
 import numpy as np
 
 from teawg import model_properties_dict
 
 from qupulse.hardware.awgs.tabor import TaborException, TaborProgram, \
-    TaborSegment, TaborSequencing, with_configuration_guard, PlottableProgram
+    TaborSegment, TaborSequencing, with_configuration_guard, PlottableProgram, plan_compaction, _FreeSegmentIndex
 from qupulse._program._loop import MultiChannelProgram, Loop
 from qupulse._program.instructions import InstructionBlock
 from qupulse.hardware.util import voltage_to_uint16
@@ -143,6 +144,29 @@ class TaborSegmentTests(unittest.TestCase):
         self.assertEqual(segment_none, segment_none)
         self.assertNotEqual(segment_a0, segment_1)
 
+    def test_hash(self):
+        import hashlib
+
+        ch_a = np.asarray(100 + np.arange(32), dtype=np.uint16)
+        ch_b = np.asarray(1000 + np.arange(32), dtype=np.uint16)
+        marker_ones = np.ones(16, dtype=bool)
+        marker_zeros = np.zeros(16, dtype=bool)
+
+        segment = TaborSegment(ch_a=ch_a, ch_b=ch_b, marker_a=marker_ones, marker_b=None)
+
+        # the digest is independent of the process' hash seed
+        expected_digest = hashlib.blake2b(b'\x01' + ch_a.tobytes() + b'\x01' + ch_b.tobytes() +
+                                          marker_ones.tobytes() + marker_zeros.tobytes(), digest_size=16).digest()
+        self.assertEqual(segment.digest, expected_digest)
+        self.assertEqual(hash(segment), int.from_bytes(expected_digest[:8], 'little', signed=True))
+
+        # equal segments have equal hashes
+        self.assertEqual(hash(segment), hash(TaborSegment(ch_a=ch_a.copy(), ch_b=ch_b, marker_a=marker_ones,
+                                                          marker_b=marker_zeros)))
+        self.assertNotEqual(hash(segment), hash(TaborSegment(ch_a=ch_a, ch_b=ch_b, marker_a=None, marker_b=None)))
+        self.assertNotEqual(TaborSegment(ch_a=None, ch_b=ch_b, marker_a=None, marker_b=None).digest,
+                            TaborSegment(ch_a=ch_b, ch_b=None, marker_a=None, marker_b=None).digest)
+
 
 class TaborProgramTests(unittest.TestCase):
     def __init__(self, *args, **kwargs):
@@ -356,6 +380,135 @@ class TaborProgramTests(unittest.TestCase):
             np.testing.assert_equal(sampled_seg.ch_a, data[0])
             np.testing.assert_equal(sampled_seg.ch_b, data[1])
 
+    def test_sampled_segments_executor(self):
+        from qupulse._program.waveforms import TableWaveform, MultiChannelWaveform
+        from qupulse.pulses.interpolation import LinearInterpolationStrategy
+
+        def table_waveform(channel, v0, v1):
+            return TableWaveform(channel, [(0, v0, LinearInterpolationStrategy()),
+                                           (384, v1, LinearInterpolationStrategy())])
+
+        root_loop = Loop(children=[Loop(waveform=MultiChannelWaveform([table_waveform('A', i / 20, -i / 20),
+                                                                        table_waveform('B', -i / 20, i / 20),
+                                                                        table_waveform('M', 0, i % 2)]))
+                                   for i in range(10)])
+
+        prog = TaborProgram(root_loop, self.instr_props, ('A', 'B'), ('M', None))
+        args = (10**9, (1., 1.), (0, 0), (lambda x: x, lambda x: 2*x))
+        expected, expected_lengths = prog.sampled_segments(*args)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+            sampled, sampled_lengths = prog.sampled_segments(*args, executor=executor)
+
+        np.testing.assert_equal(sampled_lengths, expected_lengths)
+        self.assertEqual(len(sampled), 10)
+        for segment, expected_segment in zip(sampled, expected):
+            self.assertEqual(segment, expected_segment)
+
+    def test_sample_segment_marker_times(self):
+        from qupulse.hardware.awgs.tabor import _sample_segment
+        from qupulse._program.waveforms import TableWaveform, MultiChannelWaveform, TransformingWaveform
+        from qupulse.pulses.interpolation import HoldInterpolationStrategy
+        from tests._program.transformation_tests import TransformationStub
+
+        class AllChannelsTransformation(TransformationStub):
+            def __init__(self, channels):
+                self.channels = channels
+                self.sample_times = []
+
+            def __call__(self, time, data):
+                self.sample_times.append(time)
+                return data
+
+            def get_output_channels(self, input_channels):
+                return input_channels
+
+            def get_input_channels(self, output_channels):
+                return self.channels
+
+        channels = {'A', 'B', 'M1', 'M2'}
+        transformation = AllChannelsTransformation(channels)
+        waveform = TransformingWaveform(MultiChannelWaveform([TableWaveform(channel,
+                                                                            [(0, 1, HoldInterpolationStrategy()),
+                                                                             (192, 1, HoldInterpolationStrategy())])
+                                                              for channel in sorted(channels)]),
+                                        transformation)
+
+        segment = _sample_segment(waveform, 1., ('A', 'B'), ('M1', 'M2'), (1., 1.), (0., 0.),
+                                  (lambda x: x, lambda x: x))
+        np.testing.assert_equal(segment.marker_a, np.ones(96, dtype=bool))
+        np.testing.assert_equal(segment.marker_b, np.ones(96, dtype=bool))
+
+        # one transformation call for the channels and one for both markers
+        self.assertEqual([len(sample_times) for sample_times in transformation.sample_times], [192, 96])
+
+
+class FreeSegmentIndexTests(unittest.TestCase):
+    def test_best_fit(self):
+        capacity = np.array([192, 256, 208, 512, 208, 192])
+        free_segments = _FreeSegmentIndex(capacity, [1, 2, 3, 4])
+        self.assertEqual(len(free_segments), 4)
+
+        self.assertEqual(free_segments.pop_best_fit(200), 2)
+        self.assertEqual(free_segments.pop_best_fit(192), 4)
+        self.assertIsNone(free_segments.pop_best_fit(1024))
+        self.assertEqual(free_segments.pop_best_fit(256), 1)
+        self.assertEqual(len(free_segments), 1)
+
+        free_segments.add(208, 2)
+        free_segments.remove(512, 3)
+        with self.assertRaises(KeyError):
+            free_segments.remove(512, 3)
+        self.assertEqual(free_segments.pop_best_fit(0), 2)
+        self.assertFalse(free_segments)
+
+
+class PlanCompactionTests(unittest.TestCase):
+    def test_no_fragmentation(self):
+        plan = plan_compaction(np.array([192, 192]), np.array([192, 192]), np.array([1, 1]), 1000)
+        self.assertEqual(plan.moves, [])
+        self.assertIsNone(plan.repack_start)
+        self.assertEqual(plan.transferred_points, 0)
+        self.assertEqual(plan.free_points_at_end, 1000 - 384)
+
+    def test_moves(self):
+        capacity = np.array([192, 400, 192, 208, 192, 256])
+        lengths = np.array([192, 400, 192, 208, 192, 192])
+        references = np.array([1, 0, 1, 0, 1, 1])
+
+        # the last segment goes into the best fitting slot 3 and the one before into slot 1
+        plan = plan_compaction(capacity, lengths, references, 2000, required_points=1000)
+        self.assertEqual(plan.moves, [(5, 3), (4, 1)])
+        self.assertIsNone(plan.repack_start)
+        self.assertEqual(plan.transferred_points, 384)
+        self.assertEqual(plan.free_points_at_end, 2000 - 192 - 400 - 192 - 208)
+
+        # a single move is sufficient
+        plan = plan_compaction(capacity, lengths, references, 2000, required_points=2000 - 192*3 - 400 - 208)
+        self.assertEqual(plan.moves, [(5, 3)])
+
+        # the moved segment does not fill slot 1 completely so removing all gaps requires repacking
+        plan = plan_compaction(capacity, lengths, references, 2000)
+        self.assertEqual(plan.moves, [])
+        self.assertEqual(plan.repack_start, 1)
+        self.assertEqual(plan.transferred_points, 192*3)
+        self.assertEqual(plan.free_points_at_end, 2000 - 192*4)
+
+    def test_repack(self):
+        capacity = np.array([192, 208, 192, 256, 192])
+        lengths = np.array([192, 208, 192, 192, 192])
+        references = np.array([1, 0, 1, 1, 1])
+
+        # moving the last segment into slot 1 is not sufficient
+        plan = plan_compaction(capacity, lengths, references, 1100, required_points=1100 - 192*4)
+        self.assertEqual(plan.moves, [])
+        self.assertEqual(plan.repack_start, 1)
+        self.assertEqual(plan.transferred_points, 192*3)
+        self.assertEqual(plan.free_points_at_end, 1100 - 192*4)
+
+        plan = plan_compaction(capacity, lengths, references, 1100, required_points=1100)
+        self.assertLess(plan.free_points_at_end, 1000)
+
 
 class ConfigurationGuardTest(unittest.TestCase):
     class DummyChannelPair:
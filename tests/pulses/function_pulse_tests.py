@@ -1,4 +1,5 @@
 import unittest
+from unittest import mock
 import sympy
 import numpy as np
 
@@ -254,10 +255,38 @@ class FunctionWaveformTest(unittest.TestCase):
         np.testing.assert_equal(result, expected_result)
         self.assertIs(result, out_array)
 
+    def test_unsafe_sample_chunked(self):
+        fw = FunctionWaveform(Expression('sin(2*pi*t) + 3'), 5, channel='A')
+
+        t = np.linspace(0, 5, num=50, dtype=float)
+        out_array = np.empty_like(t)
+        with mock.patch.object(FunctionWaveform, 'sample_chunk_size', 7),\
+                mock.patch.object(fw, '_kernel', wraps=fw._kernel) as kernel:
+            result = fw.unsafe_sample(channel='A', sample_times=t, output_array=out_array)
+        self.assertIs(result, out_array)
+        np.testing.assert_equal(result, np.sin(2*np.pi*t) + 3)
+        self.assertEqual(kernel.call_count, 8)
+        self.assertLessEqual(max(len(call[1]['t']) for call in kernel.call_args_list), 7)
+
+    def test_unsafe_sample_constant(self):
+        fw = FunctionWaveform(Expression('3'), 5, channel='A')
+        np.testing.assert_equal(fw.unsafe_sample(channel='A', sample_times=np.linspace(0, 5, num=11)), np.full(11, 3.))
+
     def test_unsafe_get_subset_for_channels(self):
         fw = FunctionWaveform(Expression('sin(2*pi*t) + 3'), 5, channel='A')
         self.assertIs(fw.unsafe_get_subset_for_channels({'A'}), fw)
 
+    def test_pickle(self):
+        import pickle
+
+        fw = FunctionWaveform(Expression('sin(2*pi*t) + 3'), 5, channel='A')
+        unpickled = pickle.loads(pickle.dumps(fw))
+        self.assertEqual(fw, unpickled)
+
+        t = np.linspace(0, 5, num=11)
+        np.testing.assert_equal(unpickled.unsafe_sample(channel='A', sample_times=t),
+                                fw.unsafe_sample(channel='A', sample_times=t))
+
 
 class FunctionPulseMeasurementTest(unittest.TestCase):
     def assert_window_equal(self, w1, w2):
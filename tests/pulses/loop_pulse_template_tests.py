@@ -1,6 +1,8 @@
 import unittest
 from unittest import mock
 
+import numpy
+
 from qupulse.expressions import Expression, ExpressionScalar
 from qupulse.pulses.loop_pulse_template import ForLoopPulseTemplate, WhileLoopPulseTemplate,\
     ConditionMissingException, ParametrizedRange, LoopIndexNotUsedException, LoopPulseTemplate
@@ -370,7 +372,7 @@ class ForLoopTemplateSequencingTests(MeasurementWindowTestCase):
                                               channel_mapping=channel_mapping,
                                               global_transformation=global_transformation,
                                               to_single_waveform=to_single_waveform,
-                                              parent_loop=program)
+                                              parent_loop=mock.ANY)
         expected_create_program_calls = [mock.call(**expected_create_program_kwargs,
                                                    parameters=dict(i=ConstantParameter(i)))
                                          for i in (1, 3)]
@@ -411,18 +413,49 @@ class ForLoopTemplateSequencingTests(MeasurementWindowTestCase):
                                      to_single_waveform=set(),
                                      global_transformation=None)
 
-        self.assertEqual(3, len(program.children))
+        # both iterations result in the same program and are merged
+        self.assertEqual(2, len(program.children))
         self.assertIs(children[0], program.children[0])
-        self.assertEqual(dt.waveform, program.children[1].waveform)
-        self.assertEqual(dt.waveform, program.children[2].waveform)
-        self.assertEqual(1, program.children[1].repetition_count)
-        self.assertEqual(1, program.children[2].repetition_count)
+        self.assertEqual(Loop(repetition_count=2, measurements=[('b', 2, 1)], children=[Loop(waveform=dt.waveform)]),
+                         program.children[1])
         self.assertEqual(1, program.repetition_count)
         self.assert_measurement_windows_equal({'b': ([4, 8], [1, 1]), 'B': ([2], [1])}, program.get_measurement_windows())
 
         # not ensure same result as from Sequencer here - we're testing appending to an already existing parent loop
         # which is a use case that does not immediately arise from using Sequencer
 
+    def test_create_program_merges_equal_iterations(self) -> None:
+        dt = DummyPulseTemplate(parameter_names={'i'}, duration=4, defined_channels={'A'})
+        flt = ForLoopPulseTemplate(body=dt, loop_index='i', loop_range=6)
+
+        wf_a = DummyWaveform(duration=4, sample_output=numpy.arange(4))
+        wf_b = DummyWaveform(duration=4, sample_output=numpy.arange(4) + 1)
+
+        def body_create_program(parameters, parent_loop, **_):
+            # iterations 0 to 2 and 4 to 5 are equal
+            i = parameters['i'].get_value()
+            parent_loop.add_measurements([('m', 1, 1)])
+            parent_loop.append_child(waveform=wf_b if i == 3 else wf_a)
+
+        program = Loop()
+        with mock.patch.object(dt, '_create_program', side_effect=body_create_program):
+            flt._internal_create_program(parameters={},
+                                         measurement_mapping={'m': 'm'},
+                                         channel_mapping={'A': 'A'},
+                                         parent_loop=program,
+                                         to_single_waveform=set(),
+                                         global_transformation=None)
+
+        expected_program = Loop(children=[Loop(repetition_count=3, measurements=[('m', 1, 1)],
+                                               children=[Loop(waveform=wf_a)]),
+                                          Loop(waveform=wf_b),
+                                          Loop(repetition_count=2, measurements=[('m', 1, 1)],
+                                               children=[Loop(waveform=wf_a)])],
+                                measurements=[('m', 13, 1)])
+        self.assertEqual(expected_program, program)
+        self.assert_measurement_windows_equal({'m': ([1, 5, 9, 13, 17, 21], numpy.ones(6))},
+                                              program.get_measurement_windows())
+
 
 class ForLoopTemplateOldSequencingTests(unittest.TestCase):
 
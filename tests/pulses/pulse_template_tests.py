@@ -3,6 +3,8 @@ from unittest import mock
 
 from typing import Optional, Dict, Set, Any, Union
 
+import numpy as np
+
 from qupulse.utils.types import ChannelID
 from qupulse.expressions import Expression, ExpressionScalar
 from qupulse.pulses.pulse_template import AtomicPulseTemplate, PulseTemplate
@@ -327,6 +329,44 @@ class PulseTemplateTest(unittest.TestCase):
             _internal_create_program.assert_called_once_with(**expected_internal_kwargs, parent_loop=Loop())
         self.assertIsNone(program)
 
+    def test_create_program_memoization(self):
+        from qupulse.pulses.table_pulse_template import TablePulseTemplate
+        from qupulse.pulses.sequence_pulse_template import SequencePulseTemplate
+        from qupulse.pulses.loop_pulse_template import ForLoopPulseTemplate
+
+        wait = TablePulseTemplate({'A': [(0, 'v'), ('t_wait', 'v')]}, measurements=[('M', 0, 1)])
+        ramp = TablePulseTemplate({'A': [(0, 0), (10, 'i', 'linear')]})
+        template = ForLoopPulseTemplate(SequencePulseTemplate(wait, ramp, (wait, {'v': 'v', 't_wait': 't_wait'},
+                                                                                 {'M': 'N'})), 'i', 3)
+        parameters = dict(t_wait=5, v=0.5)
+
+        with mock.patch.object(PulseTemplate, 'memoize_create_program', False):
+            expected = template.create_program(parameters=dict(parameters))
+
+        with mock.patch.object(wait, 'build_waveform', wraps=wait.build_waveform) as build_waveform:
+            program = template.create_program(parameters=dict(parameters))
+        self.assertEqual(expected, program)
+        np.testing.assert_equal(expected.get_measurement_windows(), program.get_measurement_windows())
+        # the measurement mapping of the last wait differs
+        self.assertEqual(build_waveform.call_count, 2)
+
+        # copies of the memoized loops share the waveforms
+        wait_loops = [program[iteration * 3] for iteration in range(3)]
+        self.assertEqual(len(set(map(id, wait_loops))), 3)
+        self.assertEqual(len(set(id(loop.waveform) for loop in wait_loops)), 1)
+
+        def get_key(**parameters):
+            return wait._get_create_program_memo_key(parameters={name: ConstantParameter(value)
+                                                                 for name, value in parameters.items()},
+                                                     measurement_mapping={'M': 'M'},
+                                                     channel_mapping={'A': 'A'},
+                                                     global_transformation=None,
+                                                     to_single_waveform=set())
+        self.assertEqual(get_key(v=np.arange(2), t_wait=1), get_key(v=np.arange(2), t_wait=1))
+        self.assertNotEqual(get_key(v=np.arange(2), t_wait=1), get_key(v=np.arange(3), t_wait=1))
+        self.assertNotEqual(get_key(v=1, t_wait=1), get_key(v=1., t_wait=1))
+        self.assertIsNone(get_key(v=1))
+
     def test_matmul(self):
         a = PulseTemplateStub()
         b = PulseTemplateStub()
@@ -219,7 +219,7 @@ class RepetitionPulseTemplateSequencingTests(MeasurementWindowTestCase):
         channel_mapping = dict(asd='f')
 
         children = [Loop(waveform=DummyWaveform(duration=0))]
-        program = Loop(children=children, measurements=[('a', [0], [1])], repetition_count=2)
+        program = Loop(children=children, measurements=[('a', 0, 1)], repetition_count=2)
 
         t._internal_create_program(parameters=parameters,
                                    measurement_mapping=measurement_mapping,
@@ -240,7 +240,7 @@ class RepetitionPulseTemplateSequencingTests(MeasurementWindowTestCase):
 
         self.assert_measurement_windows_equal({'fire': ([0, 6], [7.1, 7.1]),
                                          'b': ([0, 2, 4, 6, 8, 10], [1, 1, 1, 1, 1, 1]),
-                                         'a': ([0], [1])}, program.get_measurement_windows())
+                                         'a': ([0, 6], [1, 1])}, program.get_measurement_windows())
 
         # not ensure same result as from Sequencer here - we're testing appending to an already existing parent loop
         # which is a use case that does not immediately arise from using Sequencer
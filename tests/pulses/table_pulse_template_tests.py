@@ -221,6 +221,26 @@ class TablePulseTemplateTest(unittest.TestCase):
                           1: [(0, 3, LinearInterpolationStrategy()),
                               (5, 2, LinearInterpolationStrategy())]}, instantiated_entries)
 
+    def test_get_entries_instantiated_batch(self) -> None:
+        table = TablePulseTemplate({0: [('foo', 'v', 'linear'),
+                                        ('bar', 0, 'jump')],
+                                    1: [(0, 3, 'linear'),
+                                        ('bar+foo', 2, 'linear')]})
+        parameters = {'v': [2.3, 1.], 'foo': [1, 2], 'bar': 4}
+        batch = table.get_entries_instantiated_batch(parameters)
+        self.assertEqual([table.get_entries_instantiated({'v': 2.3, 'foo': 1, 'bar': 4}),
+                          table.get_entries_instantiated({'v': 1., 'foo': 2, 'bar': 4})], batch)
+
+        self.assertEqual([table.get_entries_instantiated({'v': 2.3, 'foo': 1, 'bar': 4})] * 2,
+                         table.get_entries_instantiated_batch({'v': 2.3, 'foo': 1, 'bar': 4}, batch_size=2))
+
+        with self.assertRaises(ParameterNotProvidedException):
+            table.get_entries_instantiated_batch({'v': [2.3, 1.], 'foo': [1, 2]})
+
+        vector_table = TablePulseTemplate({0: [('foo', ['v', 1], 'linear')]})
+        with self.assertRaisesRegex(ValueError, 'scalar voltages'):
+            vector_table.get_entries_instantiated_batch({'v': [2.3, 1.], 'foo': [1, 2]})
+
     def test_empty_instantiated(self) -> None:
         with self.assertRaises(TypeError):
             TablePulseTemplate()
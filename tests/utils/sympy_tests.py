@@ -16,7 +16,7 @@ b_ = IndexedBase(b)
 
 from qupulse.utils.sympy import sympify as qc_sympify, substitute_with_eval, recursive_substitution, Len,\
     evaluate_lambdified, evaluate_compiled, get_most_simple_representation, get_variables, get_free_symbols,\
-    almost_equal
+    almost_equal, LambdifyCache, SympifyCache, sympify_cache
 
 
 ################################################### SUBSTITUTION #######################################################
@@ -286,6 +286,48 @@ class LamdifiedEvaluationTest(EvaluationTestsBase, unittest.TestCase):
         super().test_eval_many_arguments()
 
 
+class LambdifyCacheTests(unittest.TestCase):
+    def test_get_lambdified(self):
+        cache = LambdifyCache(max_size=2)
+
+        lambdified = cache.get_lambdified(a*b, ('a', 'b'))
+        self.assertEqual(lambdified(a=2, b=3), 6)
+        self.assertIs(cache.get_lambdified(a*b, ('a', 'b')), lambdified)
+        self.assertIsNot(cache.get_lambdified(a*b, ('b', 'a')), lambdified)
+
+        statistics = cache.statistics
+        self.assertEqual((statistics.hits, statistics.misses, statistics.evictions, statistics.n_entries),
+                         (1, 2, 0, 2))
+
+        # integer and float constants compare equal in sympy but evaluate to different types
+        self.assertIsInstance(cache.get_lambdified(sympy.Float(1.), ())(), float)
+        self.assertEqual(cache.statistics.evictions, 1)
+        self.assertEqual(cache.statistics.n_entries, 2)
+
+        cache.clear()
+        cache.reset_statistics()
+        self.assertEqual(cache.statistics, (0, 0, 0, 0, 2))
+
+    def test_array_expression(self):
+        cache = LambdifyCache()
+        expression = np.array([a, 2*b])
+        lambdified = cache.get_lambdified(expression, ('a', 'b'))
+        self.assertIs(cache.get_lambdified(np.array([a, 2*b]), ('a', 'b')), lambdified)
+        np.testing.assert_equal(lambdified(a=1, b=2), [1, 4])
+
+    def test_max_size(self):
+        cache = LambdifyCache()
+        cache.get_lambdified(a, ('a',))
+        cache.get_lambdified(b, ('b',))
+        cache.max_size = 1
+        self.assertEqual(cache.statistics.n_entries, 1)
+        cache.max_size = 0
+        cache.get_lambdified(a, ('a',))
+        self.assertEqual(cache.statistics.n_entries, 0)
+        with self.assertRaises(ValueError):
+            cache.max_size = -1
+
+
 class CompiledEvaluationTest(EvaluationTestsBase, unittest.TestCase):
 
     def evaluate(self, expression: Union[sympy.Expr, np.ndarray], parameters):
@@ -329,3 +371,34 @@ class AlmostEqualTests(unittest.TestCase):
         self.assertFalse(almost_equal(sympy.sin(a), sympy.sin(a) + 1e-14))
 
         self.assertTrue(almost_equal(sympy.sin(a), sympy.sin(a) + 1e-14, epsilon=1e-13))
+
+
+class SympifyCacheTests(unittest.TestCase):
+    def test_get_sympified(self):
+        cache = SympifyCache(max_size=2)
+
+        sympified = cache.get_sympified('a*b')
+        self.assertEqual(sympified, a*b)
+        self.assertIs(cache.get_sympified('a*b'), sympified)
+        self.assertEqual(cache.get_sympified('len(a)'), Len(a))
+        self.assertEqual(cache.statistics, (1, 2, 0, 2, 2))
+
+        cache.get_sympified('c')
+        self.assertEqual(cache.statistics.evictions, 1)
+
+        # mutable results are not shared
+        self.assertIsNot(cache.get_sympified('[1, 2]'), cache.get_sympified('[1, 2]'))
+        self.assertEqual(cache.statistics.n_entries, 2)
+
+    def test_sympify_uses_cache(self):
+        max_size = sympify_cache.max_size
+        try:
+            sympify_cache.clear()
+            self.assertIs(qc_sympify('sympify_cache_test*2'), qc_sympify(np.str_('sympify_cache_test*2')))
+            self.assertEqual(sympify_cache.statistics.n_entries, 1)
+
+            sympify_cache.max_size = 0
+            self.assertEqual(qc_sympify('sympify_cache_test*2'), 2*sympy.Symbol('sympify_cache_test'))
+            self.assertEqual(sympify_cache.statistics.n_entries, 0)
+        finally:
+            sympify_cache.max_size = max_size
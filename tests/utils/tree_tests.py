@@ -116,3 +116,12 @@ class NodeTests(unittest.TestCase):
 
         self.assertEqual(breadth_nodes, (root, root[0], root[1], root[0][0], root[0][1]))
 
+
+    def test_slots(self):
+        node = Node(children=[Node()])
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIs(weakref.ref(node)(), node)
+        self.assertIs(node[0].parent, node)
+
+        special_node = SpecialNode(my_argument=3)
+        self.assertEqual(special_node.init_arg, 3)